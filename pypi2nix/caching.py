@@ -1,4 +1,10 @@
 import os
+import json
+import fcntl
+import hashlib
+import tempfile
+import threading
+from contextlib import contextmanager
 
 try:
     import cPickle as pickle
@@ -11,6 +17,36 @@ class hashabledict(dict):
         return hash(tuple(sorted(self.items())))
 
 
+@contextmanager
+def atomic_write(path, mode='wb'):
+    """Opens a temporary file next to the given path for writing, which
+    replaces the path once it is written completely.
+    """
+    fd, tmp_path = tempfile.mkstemp(
+        dir=os.path.dirname(os.path.abspath(path)),
+        prefix=os.path.basename(path) + '.')
+    try:
+        # Temporary files are private, the result should not be
+        umask = os.umask(0)
+        os.umask(umask)
+        os.chmod(tmp_path, 0o666 & ~umask)
+
+        with os.fdopen(fd, mode) as f:
+            yield f
+        os.rename(tmp_path, path)
+    except:
+        os.remove(tmp_path)
+        raise
+
+
+def fingerprint(*values):
+    """Returns a digest of the given values, which is stable across runs.
+    Values can be nested dicts, lists and tuples of strings and numbers.
+    """
+    return hashlib.sha1(
+        json.dumps(values, sort_keys=True, default=str)).hexdigest()
+
+
 class PersistentCache(object):
     def __init__(self, cache_file):
         """Creates a new persistent cache, retrieving/storing cached key-value
@@ -19,35 +55,88 @@ class PersistentCache(object):
         self._cache_file = cache_file
         self._cache = None
 
+        # Keys set through this instance, which win when merging with what
+        # other processes wrote to the same file in the meantime
+        self._dirty = {}
+
+        # Guards the in-memory cache and the keys set, which prefetching
+        # threads update too
+        self._thread_lock = threading.RLock()
+
     @property
     def cache(self):
         """The dictionary that is the actual in-memory cache.  This property
         lazily loads the cache from disk.
         """
-        if self._cache is None:
-            self.read_cache()
-        return self._cache
+        with self._thread_lock:
+            if self._cache is None:
+                self.read_cache()
+            return self._cache
+
+    def _load(self):
+        if os.path.exists(self._cache_file):
+            with open(self._cache_file, 'rb') as f:
+                return pickle.load(f)
+
+        # Create a new, empty cache otherwise (store a __format__ field
+        # that can be used to version the file, should we need to make
+        # changes to its internals)
+        return {'__format__': 1}
+
+    @contextmanager
+    def _lock(self):
+        """Locks the cache file against writes by other processes, and the
+        cache against changes by other threads.
+        """
+        with self._thread_lock, open(self._cache_file + '.lock', 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
 
     def read_cache(self):
         """Reads the cached contents into memory."""
-        if os.path.exists(self._cache_file):
-            with open(self._cache_file, 'r') as f:
-                self._cache = pickle.load(f)
-        else:
-            # Create a new, empty cache otherwise (store a __format__ field
-            # that can be used to version the file, should we need to make
-            # changes to its internals)
-            self._cache = {'__format__': 1}
+        self._cache = self._load()
 
     def write_cache(self):
-        """Writes (pickles) the cache to disk."""
-        with open(self._cache_file, 'w') as f:
-            pickle.dump(self._cache, f)
+        """Writes (pickles) the cache to disk.
+
+        Several processes can share a cache file: under a lock, entries
+        written by others are merged in, and the file is replaced
+        atomically, so readers never see a partially written file.
+        Pending keys are cleared once they are written.
+        """
+        with self._lock():
+            cache = self._load()
+            cache.update(self._dirty)
+
+            fd, path = tempfile.mkstemp(
+                dir=os.path.dirname(os.path.abspath(self._cache_file)),
+                prefix=os.path.basename(self._cache_file) + '.')
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    pickle.dump(cache, f)
+                os.rename(path, self._cache_file)
+            except:
+                os.remove(path)
+                raise
+
+            self._cache = cache
+            self._dirty = {}
+
+    def flush(self):
+        """Writes the keys set since the last write, if there are any."""
+        with self._thread_lock:
+            if self._dirty:
+                self.write_cache()
 
     def empty_cache(self):
-        self._cache = None
-        if os.path.exists(self._cache_file):
-            os.remove(self._cache_file)
+        with self._lock():
+            self._cache = None
+            self._dirty = {}
+            if os.path.exists(self._cache_file):
+                os.remove(self._cache_file)
 
     def __contains__(self, item):
         return item in self.cache
@@ -56,8 +145,17 @@ class PersistentCache(object):
         return self.cache[key]
 
     def __setitem__(self, key, value):
-        self.cache[key] = value
-        self.write_cache()
+        """Sets the key in memory, it is written to disk on `flush`."""
+        with self._thread_lock:
+            self.cache[key] = value
+            self._dirty[key] = value
+
+    def update(self, items):
+        """Sets many key-value pairs, writing the cache only once."""
+        with self._thread_lock:
+            self.cache.update(items)
+            self._dirty.update(items)
+            self.write_cache()
 
     def get(self, key, default=None):
         try:
@@ -65,3 +163,9 @@ class PersistentCache(object):
         except KeyError:
             return default
 
+
+def flush_caches(caches):
+    """Flushes the persistent caches in the given dict of caches."""
+    for cache in caches.itervalues():
+        if isinstance(cache, PersistentCache):
+            cache.flush()
@@ -3,22 +3,33 @@ import sys
 import logging
 import argparse
 import json
+import atexit
+import shutil
+import tempfile
 import collections
+import multiprocessing
+from functools import partial
 
 from jinja2 import Environment, PackageLoader
 
 from .log import logger
 from .package_resolver import PackageResolver
-from .package_manager import Package
-from .caching import PersistentCache, hashabledict
+from .package_manager import Package, prune_extracted
+from .caching import PersistentCache, hashabledict, atomic_write
+from .lockfile import read_lockfile, write_lockfile
+from .parallel import run_parallel
+from .render import (
+    render_model, flat_packages, json_data, variant_name, alias_extras)
 from .datastructures import Spec, SpecSet, first
 
 env = Environment(loader=PackageLoader('pypi2nix', 'templates'))
-env.globals['toset'] = lambda x: set(x)
-env.filters["surround_by_quote"] = \
-    lambda a_list: ['"%s"' % an_element for an_element in a_list]
+env.globals['variant_name'] = variant_name
+env.globals['alias_extras'] = alias_extras
 
 pypi2nix_template = env.get_template('python-packages-generated.nix.jinja2')
+sections_template = env.get_template('python-packages-sections.nix.jinja2')
+flat_template = env.get_template('python-packages-flat.nix.jinja2')
+loader_template = env.get_template('python-packages-loader.nix.jinja2')
 
 
 def setup_logging(verbose):
@@ -133,6 +144,87 @@ def parse_specline(specline, default_envs):
     return penvs
 
 
+def render_generated(resolved_pkgs, resolved_alias, test_extra, jobs=1):
+    """Returns a stream of the default template for the resolved packages
+    and aliases of all environments.
+
+    The alias and package sections of every environment and the groups of
+    shared packages are rendered from a `render_model`.  With one job they are rendered package by package
+    while the stream is consumed, so the output is never held in memory as
+    a whole.  With more jobs, the sections of every environment and the
+    shared packages split into chunks of about 1/`jobs` of them are
+    rendered in up to `jobs` worker processes first, and then concatenated.
+    """
+    model = render_model(resolved_pkgs, resolved_alias, test_extra)
+    sections = sections_template.module
+    tasks = {}
+
+    def packages(key, pkgs, size):
+        keys = []
+        for start in range(0, len(pkgs), size):
+            keys.append(key + (start,))
+            tasks[key + (start,)] = partial(
+                sections.packages, pkgs[start:start + size])
+        return keys
+
+    alias_keys = []
+    for env, aliases in model.aliases:
+        alias_keys.append(("aliases", env))
+        tasks[("aliases", env)] = partial(sections.aliases, env, aliases)
+    shared_size = 1
+    if jobs > 1:
+        total = sum(len(pkgs) for _, pkgs in model.shared)
+        shared_size = max(1, -(-total // jobs))
+    shared_keys = [
+        (envs, packages(("shared", envs), pkgs, shared_size))
+        for envs, pkgs in model.shared]
+    env_keys = [
+        (env, packages(("packages", env), pkgs, len(pkgs) if jobs > 1 else 1))
+        for env, pkgs in model.packages]
+
+    if jobs > 1:
+        render = run_parallel(tasks, jobs).pop
+    else:
+        render = lambda key: tasks.pop(key)()
+
+    return pypi2nix_template.stream(
+        alias_sections=(render(key) for key in alias_keys),
+        shared_sections=(
+            (envs, (render(key) for key in keys))
+            for envs, keys in shared_keys),
+        env_sections=(
+            (env, (render(key) for key in keys)) for env, keys in env_keys))
+
+
+def write_output(path, stream):
+    """Writes a rendered template stream chunk by chunk to the given path,
+    which is replaced atomically, or to stdout if the path is -.
+    """
+    if path == '-':
+        stream.dump(sys.stdout, encoding='utf-8')
+        sys.stdout.flush()
+        return
+
+    with atomic_write(path) as f:
+        stream.dump(f, encoding='utf-8')
+
+
+def write_json(path, data):
+    """Writes data as JSON with sorted keys, one value per line to keep
+    diffs between regenerations small, to the given path, which is replaced
+    atomically, or to stdout if the path is -.
+    """
+    if path == '-':
+        json.dump(data, sys.stdout, indent=1, sort_keys=True)
+        sys.stdout.write('\n')
+        sys.stdout.flush()
+        return
+
+    with atomic_write(path, 'w') as f:
+        json.dump(data, f, indent=1, sort_keys=True)
+        f.write('\n')
+
+
 def main():
     if hasattr(sys, "pypy_version_info"):
         vers = "pypy"
@@ -185,6 +277,11 @@ def main():
         help='''Root of the download cache (default: ~/.pip-tools/cache)''',
         default=os.path.join(os.path.expanduser('~'), '.pip-tools', 'cache')
     )
+    parser.add_argument(
+        "--extracted-max-age", type=int,
+        help='''Days after which packages extracted into the download cache that were not used are removed, 0 keeps them (default: 30)''',
+        default=30
+    )
     parser.add_argument(
         "--overrides",
         help='''Package overrides (default: ''',
@@ -195,12 +292,35 @@ def main():
         help='''Profile used for generating tests (all, top_level or none, default: top_level)''',
         default="top_level"
     )
+    parser.add_argument(
+        "--jobs", type=int,
+        help='''Number of environments to resolve in parallel (default: number of CPUs)''',
+        default=multiprocessing.cpu_count()
+    )
+    parser.add_argument(
+        "--prefetch-workers", type=int,
+        help='''Number of threads prefetching packages per environment, 0 disables prefetching (default: 4)''',
+        default=4
+    )
+    parser.add_argument(
+        "--output-mode", choices=("default", "flat", "json"),
+        help='''Output mode, flat precomputes extras and override lookups for faster evaluation, json writes the packages to a json file next to the output, which is a nix loader for it (default: default)''',
+        default="default"
+    )
+    parser.add_argument(
+        "--lockfile",
+        help='''Lockfile to take locked packages from and to write resolved packages to (default: next to the output file)''',
+        default=None
+    )
     parser.add_argument("input", help="Input json or setup.py file")
     parser.add_argument(
-        "output", help="Output nix file (default stdout)",
-        type=argparse.FileType('w'), default=sys.stdout
+        "output", help="Output nix file, - for stdout (default: stdout)",
+        nargs="?", default="-"
     )
     args = parser.parse_args()
+    if args.output_mode == "json" and args.output.endswith('.json'):
+        parser.error("the json output mode writes a nix loader to the output "
+                     "file, and the package data next to it")
 
     # Setup logging
     setup_logging(args.verbose)
@@ -210,15 +330,26 @@ def main():
         os.makedirs(args.cache_root)
     if not os.path.exists(args.download_cache_root):
         os.makedirs(args.download_cache_root)
+    if args.extracted_max_age > 0:
+        prune_extracted(
+            args.download_cache_root, args.extracted_max_age * 24 * 60 * 60)
+
+    # Workers exit without running atexit handlers, so they create their
+    # temporary files in a directory that is removed by this process
+    if args.jobs > 1:
+        tempfile.tempdir = tempfile.mkdtemp(prefix='pypi2nix-')
+        atexit.register(shutil.rmtree, tempfile.tempdir, True)
 
     # Create basic cache dict
     cache = collections.defaultdict(dict)
-    if args.update:  # if updating remove link cache
-        os.remove(os.path.join(args.cache_root, "link_cache.pickle"))
     cache["link_cache"] = PersistentCache(
         os.path.join(args.cache_root, "link_cache.pickle"))
+    if args.update:  # if updating remove link cache
+        cache["link_cache"].empty_cache()
     cache["pkg_info_cache"] = PersistentCache(
         os.path.join(args.cache_root, "pkginfo.pickle"))
+    cache["requirements_cache"] = PersistentCache(
+        os.path.join(args.cache_root, "deps.pickle"))
 
     # Testing extras
     test_extra = tuple(args.test_extra.split(","))
@@ -239,12 +370,20 @@ def main():
             os.path.join(args.cache_root, "%s-deps.pickle" % name))
         env_cache["version_cache"] = PersistentCache(
             os.path.join(args.cache_root, "%s-versions.pickle" % name))
+        env_cache["closure_cache"] = PersistentCache(
+            os.path.join(args.cache_root, "%s-closures.pickle" % name))
+        env_cache["results_cache"] = PersistentCache(
+            os.path.join(args.cache_root, "%s-results.pickle" % name))
+        if args.update:  # releases of packages could have changed too
+            env_cache["version_cache"].empty_cache()
+            env_cache["results_cache"].empty_cache()
 
         # Create reslvers for each enviroment
         envs[name] = PackageResolver(
             download_cache_root=args.download_cache_root, cache=env_cache,
             exe=path, python_path=python_path,
-            test_extra=test_extra, test_profile=args.test_profile
+            test_extra=test_extra, test_profile=args.test_profile,
+            prefetch_workers=args.prefetch_workers
         )
 
     # Parse enabled environemnts
@@ -265,12 +404,24 @@ def main():
             open(overrides_path).read(), object_hook=_decode_dict)
         assert isinstance(overrides, dict), "Package overrides are not dict"
 
+    # Load lockfile
+    lockfile = args.lockfile
+    if lockfile is None and args.output != '-':
+        lockfile = os.path.splitext(args.output)[0] + '.lock.json'
+
+    locked = {}
+    if lockfile and not args.update:
+        locked = read_lockfile(lockfile)
+        if locked:
+            logger.info("- Lockfile found %s", lockfile)
+
     # Process speciffications
     logger.info('')
     logger.info("=> Processing speciffications")
 
     resolved_pkgs = {}
     resolved_alias = {}
+    tasks = {}  # Resolves every environment
 
     path = os.path.abspath(args.input)
     # Hande local packages
@@ -290,15 +441,13 @@ def main():
             local_overrides.update(overrides.get("*", {}))
             local_overrides.update(overrides.get(env, {}))
 
-            resolved_pkgs[env] = resolved_pkgs.get(env) or {}
-            resolved_alias[env] = resolved_alias.get(env) or {}
-
-            resolved_pkgs[env], resolved_alias[env] = \
-                envs[env].resolve(
-                    specs=input_specs,
-                    overrides=local_overrides,
-                    dependency_links=package.get_dependency_links()
-                )
+            tasks[env] = partial(
+                envs[env].resolve,
+                specs=input_specs,
+                overrides=local_overrides,
+                dependency_links=package.get_dependency_links(),
+                locked=locked.get(env)
+            )
     # Handle packages specified in json file
     else:
         # Load input file
@@ -312,8 +461,9 @@ def main():
         assert isinstance(input_spec, list), \
             "Input speciffication is not a dict"
 
-        # For every specified package for each python environment resolve its
-        # dependencies, then merge dependencies per env.
+        # Collect speciffied packages of all speclines for each python
+        # environment, then resolve their dependencies at once per env.
+        env_entries = collections.OrderedDict()
         for specline in input_spec or []:
 
             # Parse specline for all enabled environemnts
@@ -323,50 +473,63 @@ def main():
                 logger.info("=> Unified speciffications for specline %s", specline)
                 logger.info("%s", penvs)
 
-            # Process package for each environment
-            for env, info in {
-                env: penvs.get(env)
-                for env in envs if env in enabled_envs and env in penvs
-            }.iteritems():
-                spec = Spec.from_line(info.get("spec"), source="input")
-                name = info.get("name")
-
-                logger.info('')
-                logger.info("~> %s for env \"%s\" in progress..." % (name, env))
-                logger.info('~> ################################\n')
+            for env in envs:
+                if env not in enabled_envs or env not in penvs:
+                    continue
+                info = penvs[env]
+                env_entries.setdefault(env, []).append((
+                    info.get("name"),
+                    Spec.from_line(info.get("spec"), source="input"),
+                    info.get("versions"),
+                    info.get("overrides")
+                ))
+
+        # Process packages for each environment
+        for env, entries in env_entries.iteritems():
+            logger.info('')
+            logger.info("~> %d packages for env \"%s\" in progress..." % (
+                len(entries), env))
+            logger.info('~> ################################\n')
 
-                resolved = resolved_pkgs[env] = resolved_pkgs.get(env) or {}
-                resolved_alias[env] = resolved_alias.get(env) or {}
+            local_overrides = {}
+            local_overrides.update(overrides.get("*", {}))
+            local_overrides.update(overrides.get(env, {}))
 
-                local_overrides = {}
-                local_overrides.update(overrides.get("*", {}))
-                local_overrides.update(overrides.get(env, {}))
-                local_overrides.update(info.get("overrides"))
+            tasks[env] = partial(
+                envs[env].resolve_many, entries, overrides=local_overrides,
+                results=envs[env].cache["results_cache"],
+                locked=locked.get(env))
 
-                pkgs, alias = envs[env].resolve(
-                    specs=set([(spec, None)]),
-                    versions=info.get("versions"),
-                    overrides=local_overrides
-                )
-                resolved_alias[env].update(alias)
-                for res_name, res_info in pkgs.iteritems():
-                    # if package already in resoved just merge extra
-                    if res_name in resolved:
-                        resolved[res_name]["packages"] += [name]
-                        for k, v in res_info["extra"].iteritems():
-                            resolved[res_name]["extra"][k] = list(
-                                set(resolved[res_name]["extra"].get(k, []) + v)
-                            )
-                    else:
-                        res_info["packages"] = [name]
-                        resolved.update({res_name: res_info})
+    # Resolve environments in parallel, each in its own worker process
+    for env, (pkgs, alias) in run_parallel(tasks, args.jobs).iteritems():
+        resolved_pkgs[env], resolved_alias[env] = pkgs, alias
 
     logger.info('')
-    logger.info("=> Rendering template")
-    result = pypi2nix_template.render(
-        resolved_alias=resolved_alias, resolved_pkgs=resolved_pkgs,
-        test_extra=test_extra
-    )
+    if args.output_mode == "json":
+        data = json_data(resolved_pkgs, resolved_alias, test_extra)
+        if args.output == '-':
+            logger.info("=> Writing package data to stdout")
+            write_json(args.output, data)
+        else:
+            data_file = os.path.splitext(args.output)[0] + '.json'
+            logger.info("=> Writing package data to %s", data_file)
+            write_json(data_file, data)
+            logger.info("=> Writing loader to %s", args.output)
+            write_output(args.output, loader_template.stream(
+                data_file=os.path.basename(data_file)))
+    else:
+        logger.info("=> Rendering template to %s", args.output)
+        if args.output_mode == "flat":
+            shared_pkgs, env_pkgs = flat_packages(
+                resolved_pkgs, resolved_alias, test_extra)
+            stream = flat_template.stream(
+                resolved_alias=resolved_alias, shared_pkgs=shared_pkgs,
+                env_pkgs=env_pkgs)
+        else:
+            stream = render_generated(
+                resolved_pkgs, resolved_alias, test_extra, args.jobs)
+        write_output(args.output, stream)
 
-    logger.info("=> Generating output file")
-    args.output.write(result)
+    if lockfile:
+        logger.info("=> Writing lockfile %s", lockfile)
+        write_lockfile(lockfile, resolved_pkgs, resolved_alias)
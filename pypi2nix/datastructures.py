@@ -1,8 +1,9 @@
+import bisect
 import operator
-from functools import partial, wraps
+from functools import wraps
 from collections import defaultdict
 from itertools import chain
-from .version import NormalizedVersion
+from .version import version_key
 
 
 class ConflictError(Exception):
@@ -12,9 +13,7 @@ class ConflictError(Exception):
 def normalized_op(op):
     @wraps(op)
     def _normalized(v1, v2):
-        nv1 = NormalizedVersion(v1)
-        nv2 = NormalizedVersion(v2)
-        return op(nv1, nv2)
+        return op(version_key(v1), version_key(v2))
     return _normalized
 
 
@@ -47,12 +46,13 @@ def spec_cmp(spec1, spec2):
     if result != 0:
         return result
 
-    val1 = NormalizedVersion(val1)
-    val2 = NormalizedVersion(val2)
-    return cmp(val1, val2)
+    return cmp(version_key(val1), version_key(val2))
 
 
 class Spec(object):
+    __slots__ = ('_name', '_preds', '_source', '_extra', '_hash',
+                 '_str', '_no_extra')
+
     @classmethod
     def from_pinned(cls, name, version, source=None, extra=()):
         """Creates a spec line for a pinned representation directly, no
@@ -74,11 +74,36 @@ class Spec(object):
         Each Spec belongs to a single package name, and can have multiple
         'preds', short for predicates, which are the famous (qualifier,
         version) tuples.
+
+        Specs are immutable.  Predicates are deduplicated and kept in
+        canonical order, so equal specs compare, hash and print the same.
         """
-        self._name = name.lower()
-        self._preds = preds if preds else tuple()
-        self._source = source
-        self._extra = extra if extra else tuple()
+        self._init(name.lower(),
+                   tuple(sorted(set(map(tuple, preds or ())), cmp=spec_cmp)),
+                   source, tuple(extra or ()))
+
+    def _init(self, name, preds, source, extra):
+        setattr = object.__setattr__
+        setattr(self, '_name', name)
+        setattr(self, '_preds', preds)
+        setattr(self, '_source', source)
+        setattr(self, '_extra', extra)
+        setattr(self, '_hash', hash((name, preds, extra)))
+        setattr(self, '_str', None)
+        setattr(self, '_no_extra', None)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Spec objects are immutable")
+
+    def __reduce__(self):
+        return (Spec, (self._name, self._preds, self._source, self._extra))
+
+    def __setstate__(self, state):
+        """Restores specs pickled before Spec got slots."""
+        if isinstance(state, tuple):
+            state = state[0] or state[1]
+        self._init(state['_name'], tuple(state['_preds']),
+                   state['_source'], tuple(state['_extra']))
 
     def add_source(self, source):
         """Creates a new, immutable, Spec which is a copy of the current Spec,
@@ -86,21 +111,24 @@ class Spec(object):
         """
         return Spec(self.name, self.preds, source, self.extra)
 
-    @property  # noqa
+    def pin(self, version):
+        """Creates a new, immutable, Spec which is a copy of the current Spec,
+        but pinned to the given version.
+        """
+        return Spec(self.name, [('==', version)], self.source, self.extra)
+
+    @property
     def name(self):
         return self._name
 
-    @name.setter
-    def name(self, name):
-        self._name = name
-
     @property
     def fullname(self):
         return self.name + "-" + self.pinned
 
     @property
     def fullname_with_extra(self):
-        return self.fullname + ("-" + "_".join(self.extra)) if self.extra else ""
+        return self.fullname + (
+            ("-" + "_".join(self.extra)) if self.extra else "")
 
     @property
     def preds(self):
@@ -116,26 +144,28 @@ class Spec(object):
 
     @property
     def is_pinned(self):
-        return any([qual == '==' for qual, _ in self._preds])
+        return any(qual == '==' for qual, _ in self._preds)
+
+    def matches(self, version):
+        """Returns whether the given version satisfies all predicates."""
+        return all(ops[qual](version, value) for qual, value in self._preds)
 
     @property
     def pinned(self):
-        if not self.is_pinned:
-            raise ConflictError("%s not pinned" % self)
-
-        _, pred = first(self._preds)
-        return pred
-
-    @pinned.setter
-    def pinned(self, version):
-        self._preds = [('==', version)]
+        for qual, version in self._preds:
+            if qual == '==':
+                return version
+        raise ConflictError("%s not pinned" % self)
 
     @property
     def no_extra(self):
-        return self.description(with_extra=False, with_source=False)
+        if self._no_extra is None:
+            object.__setattr__(self, '_no_extra', self.description(
+                with_extra=False, with_source=False))
+        return self._no_extra
 
     def description(self, with_source=True, with_extra=True):  # noqa
-        qualifiers = ','.join(map(''.join, sorted(self.preds, cmp=spec_cmp)))
+        qualifiers = ','.join(map(''.join, self.preds))
         source = ''
         extra = ''
         if with_source and self.source:
@@ -145,7 +175,10 @@ class Spec(object):
         return '%s%s%s%s' % (self.name, extra, qualifiers, source)
 
     def __str__(self):
-        return self.description(with_source=False, with_extra=True)
+        if self._str is None:
+            object.__setattr__(self, '_str', self.description(
+                with_source=False, with_extra=True))
+        return self._str
 
     def __unicode__(self):
         return unicode(str(self))
@@ -154,16 +187,131 @@ class Spec(object):
         return str(self)
 
     def __eq__(self, other):
-        return (self.name == other.name and
-                self.preds == other.preds and
+        if not isinstance(other, Spec):
+            return NotImplemented
+        return (self._hash == other._hash and
+                self._name == other._name and
+                self._preds == other._preds and
                 #self.source == other.source and
-                self.extra == other.extra)
+                self._extra == other._extra)
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        if result is NotImplemented:
+            return result
+        return not result
 
     def __hash__(self):
-        return (hash(self.name) ^
-                hash(frozenset(self.preds)) ^
-                #hash(self.source) ^
-                hash(self.extra))
+        return self._hash
+
+
+class VersionRange(object):
+    def __init__(self, name):
+        """The set of versions of a package that satisfies a number of
+        predicates, represented as an interval over parsed version keys with
+        a set of excluded versions.
+
+        Each bound is a (key, exclusive, pred) tuple, where pred is the
+        original predicate the bound came from.
+        """
+        self.name = name
+        self.lower = None
+        self.upper = None
+        self.pinned = {}
+        self.excluded = {}
+
+    def add(self, pred):
+        """Narrows the range down by the given (qualifier, version) pred."""
+        qual, version = pred
+        key = version_key(version)
+
+        if qual == '==':
+            self.pinned.setdefault(key, pred)
+        elif qual == '!=':
+            self.excluded.setdefault(key, pred)
+        elif qual in ('>', '>='):
+            bound = (key, qual == '>', pred)
+            # higher is narrower, exclusive wins a tie
+            if self.lower is None or bound[:2] > self.lower[:2]:
+                self.lower = bound
+        elif qual in ('<', '<='):
+            bound = (key, qual == '<', pred)
+            # lower is narrower, exclusive wins a tie
+            if self.upper is None or \
+                    (bound[0], not bound[1]) < (self.upper[0], not self.upper[1]):
+                self.upper = bound
+        else:
+            raise ValueError('Unknown qualifier %s' % qual)
+
+    def _conflict(self, pred1, pred2, joiner='and'):
+        return ConflictError('Conflict: {name}{0}{1} {joiner} {name}{2}{3}'.format(
+            pred1[0], pred1[1], pred2[0], pred2[1],
+            name=self.name, joiner=joiner))
+
+    def normalize(self):
+        """Returns the smallest list of preds describing this range, together
+        with the set of original preds it was built from.  Raises
+        ConflictError if the range is empty.
+        """
+        lower, upper, excluded = self.lower, self.upper, dict(self.excluded)
+        origins = set()
+
+        # An excluded inclusive bound can be rewritten to an exclusive one,
+        # for example: foo<=1.2 and foo!=1.2 become foo<1.2.
+        if lower and not lower[1] and lower[0] in excluded:
+            origins.add(excluded.pop(lower[0]))
+            origins.add(lower[2])
+            lower = (lower[0], True, ('>', lower[2][1]))
+        if upper and not upper[1] and upper[0] in excluded:
+            origins.add(excluded.pop(upper[0]))
+            origins.add(upper[2])
+            upper = (upper[0], True, ('<', upper[2][1]))
+
+        pinned = self.pinned
+        if lower and upper:
+            if lower[0] > upper[0] or \
+                    (lower[0] == upper[0] and (lower[1] or upper[1])):
+                raise self._conflict(upper[2], lower[2])
+
+            # An inclusive range of a single version is a pinned version
+            if lower[0] == upper[0]:
+                pinned = dict(pinned)
+                pinned.setdefault(lower[0], ('==', lower[2][1]))
+                origins.update([lower[2], upper[2]])
+
+        if pinned:
+            if len(pinned) > 1:
+                raise ConflictError('Conflict: %s' % ' with '.join(
+                    '%s==%s' % (self.name, version)
+                    for _, version in sorted(pinned.values())))
+
+            key, pred = first(pinned.items())
+            if lower and (key < lower[0] or (key == lower[0] and lower[1])):
+                raise self._conflict(pred, lower[2], 'with')
+            if upper and (key > upper[0] or (key == upper[0] and upper[1])):
+                raise self._conflict(pred, upper[2], 'with')
+            if key in excluded:
+                raise self._conflict(pred, excluded[key], 'with')
+
+            origins.add(pred)
+            return [pred], origins
+
+        preds = []
+        for bound in (lower, upper):
+            if bound:
+                origins.add(bound[2])
+                preds.append(bound[2])
+
+        # Only keep exclusions that actually fall within the range
+        for key, pred in sorted(excluded.items()):
+            if lower and key <= lower[0]:
+                continue
+            if upper and key >= upper[0]:
+                continue
+            origins.add(pred)
+            preds.append(pred)
+
+        return preds, origins
 
 
 class SpecSet(object):
@@ -172,15 +320,47 @@ class SpecSet(object):
         conflict detection.
         """
         self._byname = defaultdict(set)
+
+        # Sorted names and, per name, sorted (str(spec), spec) pairs, which
+        # are kept in order on insertion so iterating needs no sorting
+        self._names = []
+        self._ordered = {}
+
+        # Normalized spec per name, invalidated whenever a name gets new specs
+        self._normalized = {}
+
         self.add_specs(specs)
 
     def __iter__(self):
-        """Iterate over all specs in the set."""
-        for key in sorted(self._byname.keys(), key=str.lower):
-            specs = self._byname[key]
-            for spec in sorted(specs):
+        """Iterate over all specs in the set, ordered by name and spec."""
+        for name in self._names:
+            for _, spec in self._ordered[name]:
                 yield spec
 
+    def __len__(self):
+        return sum(len(specs) for specs in self._ordered.itervalues())
+
+    def __contains__(self, spec):
+        return spec in self._byname.get(str(spec.name), ())
+
+    def names(self):
+        """Returns the sorted names of all packages in the set."""
+        return list(self._names)
+
+    def specs_for_name(self, name):
+        """Returns all specs for the given package name, ordered by spec."""
+        return [spec for _, spec in self._ordered.get(name.lower(), ())]
+
+    def get(self, name, default=None):
+        """Returns the spec for the given package name, or default if the set
+        has none.  If there are more specs for the name, like in sets that
+        are not normalized, the first one in order is returned.
+        """
+        specs = self._ordered.get(name.lower())
+        if not specs:
+            return default
+        return specs[0][1]
+
     def add_specs(self, iterable):
         for spec in iterable:
             self.add_spec(spec)
@@ -189,13 +369,21 @@ class SpecSet(object):
         if isinstance(spec, basestring):
             spec = Spec.from_line(spec)
 
-        self._byname[str(spec.name)].add(spec)
+        name = str(spec.name)
+        specs = self._byname[name]
+        if spec not in specs:
+            if not specs:
+                bisect.insort(self._names, name)
+                self._ordered[name] = []
+            specs.add(spec)
+            bisect.insort(self._ordered[name], (str(spec), spec))
+            self._normalized.pop(name, None)
 
     def explode(self, name):
         """Explodes the list of all Specs for the given package name into
         a list of Specs with maximally one predicate.
         """
-        specs = self._byname[name]
+        specs = self._byname.get(name, ())
         return [Spec(spec.name, [pred], spec.source, spec.extra)
                 for spec in specs
                 for pred in spec.preds]
@@ -228,216 +416,123 @@ class SpecSet(object):
         # Keep a pred->source mapping around, which we need to reattach the
         # original source to the preds once we've normalized the set
         sources = defaultdict(set)
-        all_preds = set()
+        version_range = VersionRange(name)
         for spec in exploded_spec_list:
             pred = first(spec.preds)  # it's the _only_ pred in the set, since it's exploded
             sources[pred].add(spec.source)
             if pred[1] == "dev": # hack to fix stupid pytz
                 continue
-            all_preds.add(pred)
-
-        # First, group the flattened pred list by qualifier
-        by_qualifiers = defaultdict(set)
-        for pred in all_preds:
-            qualifier, version = pred
-            by_qualifiers[qualifier].add(version)
-
-        # The following nested helper methods each perform in-place
-        # modifications on the by_qualifiers dict.
-
-        def select_strongest(qual, selector):
-            """Selects the version that defines the narrowest range for the
-            given qualifier.  Assumes the values of by_qualifiers to be an
-            iterable and will convert that into a single version.
-            """
-            if qual in by_qualifiers:
-                by_qualifiers[qual] = selector(by_qualifiers[qual])
-
-        def drop_either_inequality(qual, qual_or_equal):
-            """Keeps one of the given inequality specs and drops the other.
-
-            For example: foo>1.2 and foo>=1.3 will drop foo>1.2; and
-                         foo>1.3 and foo>=1.2 will drop foo>=1.2; but
-                         foo>1.3 and foo>=1.3 will drop foo>=1.3.
-            """
-            op = ops[qual_or_equal]
-            if qual in by_qualifiers and qual_or_equal in by_qualifiers:
-                v1 = by_qualifiers[qual]
-                v2 = by_qualifiers[qual_or_equal]
-                if op(v1, v2):
-                    del by_qualifiers[qual_or_equal]
-                else:
-                    del by_qualifiers[qual]
-
-        def rewrite_inequalities(qual):
-            """Tries to get rid of any non-equal spec, if possible.
-
-            For example: foo<=1.2 and foo!=1.2 can be rewritten to foo<1.2.
-            """
-            if '!=' not in by_qualifiers:
-                return
-
-            qual_or_equal = qual + '='
-            if qual_or_equal in by_qualifiers:
-                try:
-                    by_qualifiers['!='].remove(by_qualifiers[qual_or_equal])
-                except KeyError:
-                    pass
-                else:
-                    by_qualifiers[qual] = by_qualifiers[qual_or_equal]
-                    del by_qualifiers[qual_or_equal]
-
-        # For each qualifier type, apply selection logic.  For the unequality
-        # qualifiers, select the value that yields the strongest range
-        # possible.
-
-        # Pick the smallest less-than pred
-        select_strongest('<', min)
-        select_strongest('<=', min)
-        select_strongest('>', max)
-        select_strongest('>=', max)
-
-        # Pick either the less-than of less-than-or-equal expression if both
-        # are present
-        drop_either_inequality('<', '<=')
-        drop_either_inequality('>', '>=')
-
-        # Tries to rewrite inequalities to shorter form
-        rewrite_inequalities('<')
-        rewrite_inequalities('>')
-
-        # Normalize less-than/greater-than in the specific case where they
-        # overlap on a specific version
-        if '>=' in by_qualifiers and '<=' in by_qualifiers:
-            if by_qualifiers['>='] == by_qualifiers['<=']:
-                by_qualifiers['=='].add(by_qualifiers['<='])
-                del by_qualifiers['>=']
-                del by_qualifiers['<=']
-
-        # Detect any conflicts
-        if '==' in by_qualifiers:
-            # Multiple '==' keys are conflicts
-            if len(set(by_qualifiers['=='])) > 1:
-                raise ConflictError('Conflict: %s' %
-                                    (' with '.join(map(lambda v: '%s==%s' % (name, v),
-                                                       by_qualifiers['=='],))))
-
-            # Pick the only == qualifier
-            by_qualifiers['=='] = first(by_qualifiers['=='])
-
-            # Any non-'==' key is a conflict if the pinned version does not
-            # fall in that range.  Otherwise, the unequality variant can be
-            # removed from the pred set.
-            pinned_version = by_qualifiers['==']
-            for qual, value in by_qualifiers.items():
-                if qual == '==':
-                    continue
-
-                # Perform conflict checks
-                for op in ['>', '>=', '<', '<=']:
-                    if qual == op and not ops[op](pinned_version, value):
-                        raise ConflictError(
-                            "Conflict: {name}=={pinned} with "
-                            "{name}{op}{version}".format(
-                                name=name, pinned=pinned_version,
-                                op=op, version=value))
-                if qual == '!=':
-                    # != is the only qualifier than can have multiple values
-                    for val in value:
-                        if pinned_version == val:
-                            raise ConflictError(
-                                "Conflict: {name}=={pinned} with "
-                                "{name}!={version}".format(
-                                    name=name, pinned=pinned_version,
-                                    version=val))
-
-                # If no conflicts are found, prefer the pinned version and
-                # discard the inequality pred
-                del by_qualifiers[qual]
-        else:
-            # Checks for conflicts due to non-overlapping ranges
-            less_than = None
-            if '<' in by_qualifiers:
-                less_than = by_qualifiers['<']
-                less_than_op = '<'
-            elif '<=' in by_qualifiers:
-                less_than = by_qualifiers['<=']
-                less_than_op = '<='
-
-            greater_than = None
-            if '>' in by_qualifiers:
-                greater_than = by_qualifiers['>']
-                greater_than_op = '>'
-            elif '>=' in by_qualifiers:
-                greater_than = by_qualifiers['>=']
-                greater_than_op = '>='
-
-            if less_than and greater_than:
-                if ops['<='](less_than, greater_than):
-                    raise ConflictError(
-                        'Conflict: {name}{ltop}{lt} and '
-                        '{name}{gtop}{gt}'.format(
-                            name=name, ltop=less_than_op, lt=less_than,
-                            gtop=greater_than_op, gt=greater_than))
-
-            # Remove obsolete not-equal versions
-            if '!=' in by_qualifiers:
-                disallowed_versions = by_qualifiers['!=']
-                for qual, version in by_qualifiers.items():
-                    if qual == '!=':
-                        continue
-
-                    op = ops[qual]
-
-                    def inverse_op(v1, v2):
-                        return not op(v1, v2)
-
-                    disallowed_versions = set(filter(partial(inverse_op, version), disallowed_versions))
-                by_qualifiers['!='] = set(disallowed_versions)
-
-        # Now, take special care regarding the rare, but valid, != operator,
-        # of which multiple values can occur and still make perfect sense.
-        preds = []
-        for qual, value in by_qualifiers.items():
-            if qual == '!=':
-                values = value  # it's plural
-                for val in values:
-                    preds.append((qual, val))
-            else:
-                preds.append((qual, value))
+            version_range.add(pred)
+
+        preds, origins = version_range.normalize()
 
         # Lookup which sources were used to construct this normalized spec set
         if preds:
-            used_sources = {source for pred in preds for source in sources[pred]} - {None}
+            used_sources = {source for pred in origins
+                            for source in sources[pred]} - {None}
         else:
             # No predicates, un-pinned requirement. Needs special-casing to
             # keep the original source.
-            used_sources = [spec.source for spec in self._byname[name]
+            used_sources = [spec.source for spec in self.specs_for_name(name)
                             if spec.source is not None]
         source = ' and '.join(sorted(used_sources, key=lambda item: item.lower()))
 
         # Lookup which extra where used for this normalized spec set
         extra = set()
-        for spec in self._byname[name]:
+        for spec in self.specs_for_name(name):
             extra.update(spec.extra)
 
-        return Spec(name, preds, source, extra=tuple(extra))
+        return Spec(name, preds, source, extra=tuple(sorted(extra)))
+
+    def normalize_name(self, name):
+        """Normalizes specs for the given package name like
+        `normalize_specs_for_name`, but on conflict prefers the only pinned
+        spec for that name, if there is one.
+
+        The result is cached until specs for that name are added.
+        """
+        if name in self._normalized:
+            return self._normalized[name]
+
+        try:
+            spec = self.normalize_specs_for_name(name)
+        except ConflictError:
+            spec = [s for s in self.specs_for_name(name) if s.is_pinned]
+            if not spec or len(spec) > 1: raise
+            spec = spec[0]
+
+        self._normalized[name] = spec
+        return spec
 
     def normalize(self):
         """Generates a new spec set that is more compact, but equivalent to
         this spec set.
         """
         new_spec_set = SpecSet()
-        for name in self._byname:
-            try:
-                new_spec_set.add_spec(self.normalize_specs_for_name(name))
-            except ConflictError:
-                spec = [s for s in self._byname[name] if s.is_pinned]
-                if not spec or len(spec) > 1: raise
-                new_spec_set.add_spec(spec[0])
+        for name in self._names:
+            new_spec_set.add_spec(self.normalize_name(name))
         return new_spec_set
 
     def __str__(self):
         """Print the spec set: one line per spec in the set."""
         lines = [s.description() for s in self]
         return '\n'.join(lines)
+
+
+class ResolvedNode(object):
+    def __init__(self, spec, deps=()):
+        """A pinned package in a resolved dependency graph, together with the
+        (spec, extras section) pairs of its dependencies, as returned by the
+        package manager.
+
+        Link, hash and package info are filled in once they are looked up.
+        """
+        self.spec = spec
+        self.deps = list(deps)
+        self.link = None
+        self.hash = None
+        self.pkg_info = None
+
+    @property
+    def name(self):
+        return self.spec.name
+
+    @property
+    def version(self):
+        return self.spec.pinned
+
+    def __repr__(self):
+        return 'ResolvedNode(%r)' % (str(self.spec),)
+
+
+class ResolvedGraph(object):
+    def __init__(self):
+        """The result of resolving a spec set: the pinned spec set and a
+        `ResolvedNode` for every package in it, by name.
+        """
+        self.pinned = SpecSet()
+        self._nodes = {}
+
+    def add(self, spec, deps=()):
+        """Adds a node for the given pinned spec and returns it."""
+        node = ResolvedNode(spec, deps)
+        self.pinned.add_spec(spec)
+        self._nodes[spec.name] = node
+        return node
+
+    def __iter__(self):
+        """Iterate over all nodes, ordered by name."""
+        for name in self.pinned.names():
+            yield self._nodes[name]
+
+    def __len__(self):
+        return len(self._nodes)
+
+    def __contains__(self, name):
+        return name.lower() in self._nodes
+
+    def __getitem__(self, name):
+        return self._nodes[name.lower()]
+
+    def get(self, name, default=None):
+        return self._nodes.get(name.lower(), default)
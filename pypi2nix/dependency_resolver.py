@@ -1,40 +1,172 @@
-import sys
+import logging
 
 from .log import logger
-from .datastructures import SpecSet, Spec
+from .datastructures import ConflictError, ResolvedGraph, SpecSet
+
+# Times the versions of members of a closure are matched against the
+# dependencies of the other members, before giving up grafting it
+MAX_GRAFT_ROUNDS = 4
 
 
 def print_specset(specset, round, debug=False):
-    (logger.debug if debug else logger.info)('After round #%s:' % (round,))
-    for spec in sorted(specset, key=lambda s: s.description()):
-        (logger.debug if debug else logger.info)(
-            '  - %s' % (spec.description(),))
+    level = logging.DEBUG if debug else logging.INFO
+    if not logger.isEnabledFor(level):
+        return
+
+    logger.log(level, 'After round #%s:' % (round,))
+    for spec in specset:
+        logger.log(level, '  - %s' % (spec.description(),))
+
+
+class ClosureCache(object):
+    def __init__(self, cache, fingerprint=None, validate=None):
+        """Remembers the dependencies of resolved packages, so a
+        `DependencyResolver` can graft the closure of a package in one step,
+        instead of expanding it round by round.
+
+        Dependencies are stored in `cache`, a dict like a PersistentCache, by
+        (name, version, extra) of every package and `fingerprint`, which
+        identifies overrides and versions they were resolved with.  Closures
+        are not stored, as the versions of their members depend on the
+        constraints of the resolution they were found in.  They are rebuilt
+        from the dependencies when they are read.
+
+        `validate(name, version, extra)` returns the dependencies of a package
+        as they are known now, or None if they are not known anymore.  Stored
+        dependencies are only used if they are still the same.
+        """
+        self.cache = cache
+        self.fingerprint = fingerprint
+        self.validate = validate
+
+    def _key(self, name, version, extra):
+        return (name, version, tuple(extra), self.fingerprint)
+
+    def get_dependencies(self, name, version, extra=()):
+        """Returns the stored dependencies of the pinned package, or None if
+        they are not known or outdated.
+        """
+        deps = self.cache.get(self._key(name, version, extra))
+        if deps is None or self.validate is None:
+            return deps
+        current = self.validate(name, version, extra)
+        if current is None or set(current) != set(deps):
+            logger.debug('- Dependencies of %s-%s are outdated' % (
+                name, version))
+            return None
+        return deps
+
+    def get(self, name, version, extra=(), best_match=None):
+        """Returns the closure of the pinned package, which maps (name,
+        version, extra) of each of its members to the dependencies of that
+        member, or None if the dependencies of the package are not known.
+
+        `best_match(spec)` returns the version of a dependency under the
+        current constraints, or None if it can not be found.  Members are
+        only followed as far as their dependencies are known.
+        """
+        deps = self.get_dependencies(name, version, extra)
+        if deps is None:
+            return None
+
+        closure = {(name, version, tuple(extra)): deps}
+        todo = [deps]
+        while todo:
+            for dep, _ in todo.pop():
+                version = best_match(dep) if best_match else None
+                if version is None:
+                    continue
+                key = (dep.name, version, tuple(dep.extra))
+                if key in closure:
+                    continue
+                member_deps = self.get_dependencies(*key)
+                if member_deps is not None:
+                    closure[key] = member_deps
+                    todo.append(member_deps)
+        return closure
+
+    def add_graph(self, graph):
+        """Stores the dependencies of all packages in the resolved graph."""
+        deps = {}
+        for node in graph:
+            key = self._key(node.name, node.version, node.spec.extra)
+            if self.cache.get(key) != node.deps:
+                deps[key] = node.deps
+
+        # Write a persistent cache only once
+        if deps:
+            self.cache.update(deps)
 
 
 class DependencyResolver(object):
-    def __init__(self, spec_set, package_manager):
+    def __init__(
+        self, spec_set, package_manager, closures=None, previous=None
+    ):
         """This class resolves a given SpecSet by querying the given
         PackageManager.
+
+        Resolution is incremental: every round only expands the package
+        names whose normalized spec changed since they were last expanded.
+        Names that did not change would yield the same dependencies again,
+        which are already part of the spec set.
+
+        With a `ClosureCache`, the known closure of a pinned package is
+        grafted at once: the dependencies of all of its members are added in
+        the same round, and the package manager is not asked for them again.
+
+        With the `ResolvedGraph` of a `previous` resolution, every name stays
+        pinned to its previous version while that satisfies its spec, and
+        the previous dependencies are reused.  So only names whose
+        constraints changed are resolved again, along with what their new
+        dependencies affect.  Nodes that have to be resolved anew, like
+        version bumps, should be left out of the previous graph.
         """
         self.spec_set = spec_set
         self.pkgmgr = package_manager
+        self.closures = closures
+        self.previous = previous
+
+        # Names last expanded from the previous resolution
+        self.reused = set()
+
+        # Names that got new specs in the last round, None means all names
+        self._worklist = None
+
+        # Normalized spec every name was last expanded with
+        self._expanded = {}
+
+        # Best version and dependencies found when expanding every name
+        self._deps = {}
+
+        # Dependencies of members of grafted closures, by (name, version,
+        # extra)
+        self._grafted = {}
 
     def resolve_one_round(self):
         """Resolves one level of the current spec set, by finding best matches
-        for the current spec set in the package manager and returning all
-        (new) requirements for those packages.
+        for the changed part of the spec set in the package manager and
+        returning all (new) requirements for those packages.
 
         Returns whether the spec set was changed significantly by this round.
         """
 
         new_deps = self.find_new_dependencies()
         self.spec_set.add_specs(new_deps)
+        self._worklist = set(spec.name for spec in new_deps)
         return len(new_deps) > 0
 
     def resolve(self, max_rounds=12):
+        """Resolves the spec set like `resolve_graph`, but only returns the
+        pinned spec set.
+        """
+        return self.resolve_graph(max_rounds).pinned
+
+    def resolve_graph(self, max_rounds=12):
         """Resolves the spec set one round at a time, until the set does not
         change significantly anymore.  Protects against infinite loops by
         breaking out after a max number rounds.
+
+        Returns the resolved `ResolvedGraph`.
         """
 
         round = 0
@@ -51,46 +183,156 @@ class DependencyResolver(object):
 
             print_specset(self.spec_set, round, debug=True)
 
-        # Return the pinned spec set
-        return self.pin_spec_set()
+        if self.previous is not None:
+            logger.info('- Reused the previous resolution for %d of %d '
+                        'packages' % (len(self.reused), len(self._deps)))
+
+        # Return the pinned graph
+        graph = self.pin_graph()
+        if self.closures is not None:
+            self.closures.add_graph(graph)
+        return graph
 
     def pin_spec_set(self):
         """Pins all packages in given resolved spec set and returns a new spec
         set.  Requires the input spec set to be resolved.
         """
-        new_spec_set = SpecSet()
+        return self.pin_graph().pinned
+
+    def pin_graph(self):
+        """Pins all packages in given resolved spec set and returns them as a
+        `ResolvedGraph`, with their dependencies.  Requires the input spec set
+        to be resolved.
+
+        Best versions and dependencies found while expanding are reused, so
+        the package manager is only asked again for names whose spec changed
+        after their last expansion.
+        """
+        graph = ResolvedGraph()
         for spec in self.spec_set.normalize():
-            best_version = self.pkgmgr.find_best_match(spec)
-            spec.pinned = best_version
-            new_spec_set.add_spec(spec)
-        return new_spec_set
+            expanded = self._expanded.get(spec.name)
+            if expanded is not None and expanded == spec:
+                best_version, deps = self._deps[spec.name]
+            else:
+                best_version = self.pkgmgr.find_best_match(spec)
+                deps = self.pkgmgr.get_dependencies(
+                    spec.name, best_version, spec.extra)
+            graph.add(spec.pin(best_version), deps)
+        return graph
+
+    def changed_specs(self):
+        """Returns normalized specs of all names in the worklist, whose
+        normalized spec differs from the one they were last expanded with.
+        """
+        names = self._worklist
+        if names is None:
+            names = self.spec_set.names()
+
+        changed = []
+        for name in names:
+            spec = self.spec_set.normalize_name(name)
+            expanded = self._expanded.get(name)
+            if expanded is None or not expanded == spec:
+                changed.append(spec)
+        return changed
 
     def find_all_dependencies(self):
-        """Finds best matches for the current spec set in the package manager,
+        """Finds best matches for the changed specs in the package manager,
         returning all requirements for those packages.
         """
-        spec_set = self.spec_set
         pkgmgr = self.pkgmgr
 
         deps = set()
-        for spec in spec_set.normalize():
-            version = pkgmgr.find_best_match(spec)
-            pkg_deps = pkgmgr.get_dependencies(spec.name, version, spec.extra)
-
+        for spec in self.changed_specs():
             # Append source information to the new specs
             if spec.source:
                 source = '%s ~> %s' % (spec.source, spec)
             else:
                 source = '%s' % spec
 
+            previous = None
+            if self.previous is not None:
+                previous = self.previous.get(spec.name)
+            if previous is not None and \
+                    previous.spec.extra == spec.extra and \
+                    spec.matches(previous.version):
+                version, pkg_deps = previous.version, previous.deps
+                self.reused.add(spec.name)
+            else:
+                self.reused.discard(spec.name)
+                version = pkgmgr.find_best_match(spec)
+                key = (spec.name, version, spec.extra)
+                if key not in self._grafted:
+                    deps.update(self.graft_closure(key, source))
+                if key in self._grafted:
+                    pkg_deps = self._grafted[key]
+                else:
+                    pkg_deps = pkgmgr.get_dependencies(
+                        spec.name, version, spec.extra)
+
+            self._expanded[spec.name] = spec
+            self._deps[spec.name] = (version, pkg_deps)
+
             for d, _ in pkg_deps:
                 deps.update([d.add_source(source)])
 
         return deps
 
+    def graft_closure(self, key, source):
+        """Grafts the known closure of the (name, version, extra) pinned
+        package, returning the dependencies of all of its members.
+
+        Members are only grafted with the version that is the best match for
+        their spec, combined from the current spec set and the dependencies
+        of the other members.  As versions of members may change when other
+        members are left out, this is repeated until the closure is stable.
+        """
+        if self.closures is None:
+            return set()
+
+        def best_match(dep):
+            combined = SpecSet(self.spec_set.specs_for_name(dep.name))
+            combined.add_specs(specs.specs_for_name(dep.name))
+            combined.add_spec(dep)
+            try:
+                spec = combined.normalize_name(dep.name)
+            except ConflictError:
+                return None
+            return self.pkgmgr.find_best_match(spec)
+
+        grafted = {}
+        for _ in range(MAX_GRAFT_ROUNDS):
+            specs = SpecSet()
+            for member_deps in grafted.itervalues():
+                specs.add_specs(dep for dep, _ in member_deps)
+
+            closure = self.closures.get(*key, best_match=best_match)
+            if closure is None:
+                return set()
+            if closure == grafted:
+                break
+            grafted = closure
+        else:
+            # Versions of members did not settle, expand them one by one
+            grafted = None
+
+        if not grafted:
+            return set()
+
+        logger.debug('- Grafting closure of %s-%s (%d packages)' % (
+            key[0], key[1], len(grafted)))
+        self._grafted.update(grafted)
+
+        deps = set()
+        for (name, version, _), member_deps in grafted.iteritems():
+            member_source = '%s ~> %s==%s' % (source, name, version)
+            for d, _ in member_deps:
+                deps.update([d.add_source(member_source)])
+        return deps
+
     def find_new_dependencies(self):
-        """Finds all dependencies for the given spec set (in the package
+        """Finds all dependencies for the changed specs (in the package
         manager), but only returns what specs are new to the set.
         """
         all_deps = self.find_all_dependencies()
-        return all_deps - set(self.spec_set)  # only return _new_ specs
+        return set(d for d in all_deps if d not in self.spec_set)
@@ -0,0 +1,168 @@
+"""
+Lockfiles record the packages resolved for every environment: their
+versions, source URLs, digests and dependencies.
+
+A `PackageManager` given the locked packages of its environment takes
+versions, dependencies, links and hashes from the lockfile, instead of
+querying the index, introspecting and hashing package archives again.
+"""
+
+import os
+import json
+
+from .datastructures import Spec, ResolvedGraph
+from .version import VersionIndex
+from .caching import fingerprint, atomic_write
+
+LOCKFILE_FORMAT = 2
+
+
+def lock_packages(pkgs, alias):
+    """Returns the lockfile section of one environment, for the package
+    dict and aliases returned by `PackageResolver.resolve_many`.
+    """
+    packages = {}
+    for fullname, pkg in pkgs.iteritems():
+        packages[fullname] = {
+            "name": pkg["name"],
+            "version": pkg["version"],
+            "extras": list(pkg["extras"]),
+            "url": pkg["src"]["url"],
+            "hash": [pkg["src"]["algo"], pkg["src"]["sum"]],
+            "deps": pkg["deps"],
+            "extra": pkg["extra"],
+            "requires": pkg["requires"],
+            "links": pkg["links"],
+            "pkg_info": pkg["pkg_info"],
+            "overrides": pkg["overrides"],
+        }
+    return {
+        "aliases": dict(
+            (name, spec.fullname) for name, (spec, _) in alias.iteritems()),
+        "packages": packages,
+    }
+
+
+def write_lockfile(path, resolved_pkgs, resolved_alias):
+    """Writes the lockfile for the resolved packages and aliases of all
+    environments, replacing the file atomically.
+    """
+    lock = {
+        "format": LOCKFILE_FORMAT,
+        "envs": dict(
+            (env, lock_packages(pkgs, resolved_alias[env]))
+            for env, pkgs in resolved_pkgs.iteritems()),
+    }
+
+    with atomic_write(path, 'w') as f:
+        json.dump(lock, f, indent=2, sort_keys=True)
+        f.write('\n')
+
+
+def read_lockfile(path):
+    """Returns the locked packages of every environment in the lockfile,
+    by environment name.  Returns an empty dict if there is no lockfile, or
+    if it was written in another format.
+    """
+    if not os.path.exists(path):
+        return {}
+
+    with open(path) as f:
+        lock = json.load(f)
+    if lock.get("format") != LOCKFILE_FORMAT:
+        return {}
+
+    return dict(
+        (str(env), section["packages"])
+        for env, section in lock["envs"].iteritems())
+
+
+class LockedPackages(object):
+    def __init__(self, packages):
+        """Index of the locked packages of one environment, as returned by
+        `read_lockfile`, by name and version.
+        """
+        self._records = {}
+        self._hashes = {}
+        for record in packages.itervalues():
+            name = str(record["name"]).lower()
+            self._records.setdefault(name, {})[str(record["version"])] = record
+            self._hashes[record["url"]] = record
+
+        self._indexes = dict(
+            (name, VersionIndex(records))
+            for name, records in self._records.iteritems())
+
+    def best_match(self, spec, overrides):
+        """Returns the best locked version matching the spec, or None if
+        there is none or it was locked with other overrides.
+        """
+        index = self._indexes.get(spec.name)
+        if index is None:
+            return None
+        version = index.best_match(spec.preds, prereleases=True)
+        if version is None or self.get(spec.name, version, overrides) is None:
+            return None
+        return version
+
+    def get(self, name, version, overrides):
+        """Returns the locked record of the package, or None if it is not
+        locked or was locked with other overrides.
+        """
+        record = self._records.get(name, {}).get(version)
+        if record is None or record["overrides"] != fingerprint(overrides):
+            return None
+        return record
+
+    def _requires(self, record):
+        return [
+            (Spec.from_line(str(line)), section and str(section))
+            for line, section in record["requires"]]
+
+    def get_dependencies(self, name, version, extra, overrides):
+        """Returns the locked dependencies of the package for the given
+        extras, or None if they were locked for other extras or overrides.
+        """
+        record = self.get(name, version, overrides)
+        if record is None or tuple(record["extras"]) != tuple(extra):
+            return None
+        return self._requires(record)
+
+    def graph(self, overrides={}, versions=None):
+        """Returns the locked packages as a `ResolvedGraph`, to resolve
+        incrementally from.
+
+        Left out are names that are locked in more than one version, or
+        with other overrides, and names whose spec in `versions`, a SpecSet,
+        the locked version does not match anymore, like version bumps.
+        """
+        graph = ResolvedGraph()
+        for name, records in self._records.iteritems():
+            if len(records) != 1:
+                continue
+            (version, record), = records.items()
+
+            pinned = versions.get(name) if versions is not None else None
+            if pinned is not None and not pinned.matches(version):
+                continue
+            if record["overrides"] != fingerprint(overrides.get(name)):
+                continue
+
+            graph.add(
+                Spec.from_pinned(name, version,
+                                 extra=tuple(map(str, record["extras"]))),
+                self._requires(record))
+        return graph
+
+    def get_hash(self, url, overrides={}):
+        """Returns the locked (algorithm, digest) of the archive at the url,
+        or None if its package was locked with other overrides than in
+        `overrides`, a dict of overrides by name.
+        """
+        record = self._hashes.get(url)
+        if record is None:
+            return None
+        name = str(record["name"]).lower()
+        if record["overrides"] != fingerprint(overrides.get(name)):
+            return None
+        return tuple(map(str, record["hash"]))
@@ -1,4 +1,5 @@
 from __future__ import absolute_import
+import threading
 from logging import Logger
 
 
@@ -16,7 +17,12 @@ class IndentationContext(object):
 class IndentingLogger(Logger):
     def __init__(self, *args, **kwargs):
         Logger.__init__(self, *args, **kwargs)
-        self._indent_level = 0
+        # Every thread indents its own messages
+        self._local = threading.local()
+
+    @property
+    def _indent_level(self):
+        return getattr(self._local, 'indent_level', 0)
 
     def _log(self, level, msg, *args, **kwargs):
         indentation = '    ' * self._indent_level
@@ -24,10 +30,10 @@ class IndentingLogger(Logger):
         Logger._log(self, level, msg, *args, **kwargs)
 
     def do_indent(self):
-        self._indent_level += 1
+        self._local.indent_level = self._indent_level + 1
 
     def do_unindent(self):
-        self._indent_level -= 1
+        self._local.indent_level = self._indent_level - 1
 
     def indent(self):
         return IndentationContext(self)
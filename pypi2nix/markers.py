@@ -0,0 +1,162 @@
+"""
+Minimal PEP 508 environment marker evaluation, used when neither packaging
+nor a setuptools vendoring it is installed.
+
+`Marker` parses markers of comparisons combined with `and`, `or` and
+parentheses, like `packaging.markers.Marker`.  Versions are compared by
+their `version_key`, everything else as strings.
+"""
+
+import re
+
+from .version import version_key
+
+
+class InvalidMarker(ValueError):
+    """A marker that can not be parsed"""
+
+
+_TOKENS = re.compile(r"""\s*(?:
+    (?P<string>'[^']*'|"[^"]*") |
+    (?P<op>===|==|!=|~=|<=|>=|<|>|\(|\)|not\s+in\b|in\b|and\b|or\b) |
+    (?P<name>[a-zA-Z_][a-zA-Z0-9_.]*)
+)""", re.X)
+
+_VARIABLES = set([
+    "implementation_name", "implementation_version", "os_name",
+    "platform_machine", "platform_python_implementation", "platform_release",
+    "platform_system", "platform_version", "python_full_version",
+    "python_version", "sys_platform", "extra",
+])
+
+# Names of variables in markers written before PEP 508
+_ALIASES = {
+    "os.name": "os_name",
+    "sys.platform": "sys_platform",
+    "platform.version": "platform_version",
+    "platform.machine": "platform_machine",
+    "platform.python_implementation": "platform_python_implementation",
+    "python_implementation": "platform_python_implementation",
+}
+
+_COMPARISONS = ("===", "==", "!=", "~=", "<=", ">=", "<", ">", "in", "not in")
+
+
+def _tokenize(marker):
+    tokens = []
+    pos = 0
+    marker = marker.rstrip()
+    while pos < len(marker):
+        match = _TOKENS.match(marker, pos)
+        if match is None or match.end() == pos:
+            raise InvalidMarker("Invalid marker: %r" % marker)
+        kind = match.lastgroup
+        value = match.group(kind)
+        if kind == "op":
+            value = " ".join(value.split())
+        tokens.append((kind, value))
+        pos = match.end()
+    return tokens
+
+
+def _compare(lhs, op, rhs):
+    if op == "in":
+        return lhs in rhs
+    if op == "not in":
+        return lhs not in rhs
+    if op == "===":
+        return lhs == rhs
+    if op == "==":
+        return lhs == rhs or version_key(lhs) == version_key(rhs)
+    if op == "!=":
+        return not _compare(lhs, "==", rhs)
+    if op == "~=":
+        prefix = rhs.split(".")[:-1]
+        return version_key(lhs) >= version_key(rhs) and \
+            lhs.split(".")[:len(prefix)] == prefix
+    return {
+        "<": lambda a, b: a < b, "<=": lambda a, b: a <= b,
+        ">": lambda a, b: a > b, ">=": lambda a, b: a >= b,
+    }[op](version_key(lhs), version_key(rhs))
+
+
+class Marker(object):
+    def __init__(self, marker):
+        self._tokens = _tokenize(marker)
+        self._pos = 0
+        self._expression = self._parse_or()
+        if self._pos != len(self._tokens):
+            raise InvalidMarker("Invalid marker: %r" % marker)
+
+    def _peek(self):
+        if self._pos < len(self._tokens):
+            return self._tokens[self._pos]
+        return (None, None)
+
+    def _next(self):
+        token = self._peek()
+        if token[0] is None:
+            raise InvalidMarker("Unexpected end of marker")
+        self._pos += 1
+        return token
+
+    def _parse_or(self):
+        expression = self._parse_and()
+        while self._peek() == ("op", "or"):
+            self._next()
+            expression = ("or", expression, self._parse_and())
+        return expression
+
+    def _parse_and(self):
+        expression = self._parse_atom()
+        while self._peek() == ("op", "and"):
+            self._next()
+            expression = ("and", expression, self._parse_atom())
+        return expression
+
+    def _parse_atom(self):
+        if self._peek() == ("op", "("):
+            self._next()
+            expression = self._parse_or()
+            if self._next() != ("op", ")"):
+                raise InvalidMarker("Expected )")
+            return expression
+
+        lhs = self._parse_value()
+        kind, op = self._next()
+        if kind != "op" or op not in _COMPARISONS:
+            raise InvalidMarker("Expected a comparison, got %r" % op)
+        return ("compare", lhs, op, self._parse_value())
+
+    def _parse_value(self):
+        kind, value = self._next()
+        if kind == "string":
+            return ("string", value[1:-1])
+        if kind == "name":
+            name = _ALIASES.get(value, value)
+            if name in _VARIABLES:
+                return ("variable", name)
+        raise InvalidMarker("Expected a variable or a string, got %r" % value)
+
+    def _evaluate(self, expression, environment):
+        kind = expression[0]
+        if kind == "or":
+            return self._evaluate(expression[1], environment) or \
+                self._evaluate(expression[2], environment)
+        if kind == "and":
+            return self._evaluate(expression[1], environment) and \
+                self._evaluate(expression[2], environment)
+
+        _, lhs, op, rhs = expression
+        return _compare(
+            self._value(lhs, environment), op, self._value(rhs, environment))
+
+    def _value(self, value, environment):
+        kind, value = value
+        return environment[value] if kind == "variable" else value
+
+    def evaluate(self, environment):
+        """Returns whether the marker holds in the given environment, a dict
+        of marker variable values.
+        """
+        return self._evaluate(self._expression, environment)
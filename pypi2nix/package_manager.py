@@ -6,6 +6,8 @@ import subprocess
 import sys
 import tarfile
 import tempfile
+import threading
+import time
 import zipfile
 import hashlib
 
@@ -26,19 +28,105 @@ from email.parser import FeedParser
 from collections import defaultdict
 
 from .log import logger
-from .datastructures import Spec, first
+from .datastructures import Spec, SpecSet, first
+from .version import VersionIndex
+from .lockfile import LockedPackages
+from .requirements import (
+    get_marker_environment, parse_requires_file, branches_on_interpreter,
+    select_deps)
 
 
 class NoPackageMatch(Exception):
     pass
 
 
+def copy_tree(src, dst):
+    """Copies the directory tree src to dst, which must not exist.  Where
+    the filesystem supports it, like btrfs or xfs, copies are reflinks that
+    share data with src until either is written to.
+    """
+    with open(os.devnull, 'w') as devnull:
+        try:
+            subprocess.check_call(
+                ['cp', '-a', '--reflink=auto', src, dst], stderr=devnull)
+            return
+        except (OSError, subprocess.CalledProcessError):
+            # No GNU cp, copy file by file
+            if os.path.exists(dst):
+                shutil.rmtree(dst)
+    shutil.copytree(src, dst, symlinks=True)
+
+
+def prune_extracted(download_cache_root, max_age):
+    """Removes archives extracted into the download cache, that were not
+    used in the last `max_age` seconds, along with leftovers of failed
+    extractions.
+    """
+    extracted = os.path.join(download_cache_root, 'extracted')
+    if not os.path.isdir(extracted):
+        return
+
+    deadline = time.time() - max_age
+    for name in os.listdir(extracted):
+        path = os.path.join(extracted, name)
+        try:
+            if os.path.getmtime(path) < deadline:
+                logger.debug('- Removing unused extracted package %s' % path)
+                shutil.rmtree(path)
+        except OSError:
+            # Removed by another process in the meantime
+            pass
+
+
+class CandidateFinder(PackageFinder):
+    """PackageFinder that can also list all releases of a project"""
+
+    def __init__(self, *args, **kwargs):
+        PackageFinder.__init__(self, *args, **kwargs)
+        # Releases seen by the current find_candidates call of every thread,
+        # prefetching threads share the finder with the resolver
+        self._local = threading.local()
+
+    def _sort_versions(self, applicable_versions):
+        applicable_versions = PackageFinder._sort_versions(
+            self, applicable_versions)
+        self._local.candidates = [
+            (version, link) for _, link, version in applicable_versions]
+        return applicable_versions
+
+    def find_candidates(self, name):
+        """Returns (version, link) tuples of all releases of the named project,
+        most preferred first, or an empty list if none could be found.
+        """
+        self._local.candidates = None
+        requirement = InstallRequirement.from_line(name, prereleases=True)
+        try:
+            self.find_requirement(requirement, False)
+        except DistributionNotFound:
+            return []
+        return self._local.candidates or []
+
+
+class LazyPackage(object):
+    """Package that is only downloaded and extracted once it is used"""
+
+    def __init__(self, load):
+        self._load = load
+        self._package = None
+
+    def __getattr__(self, name):
+        if self._package is None:
+            self._package = self._load()
+        return getattr(self._package, name)
+
+
 class Package(object):
     """Interface to local extracted package"""
 
     def __init__(
         self,
         fullname=None, dist_dir=None, package_dir=None,
+        name=None, version=None,
         exe=sys.executable, python_path=":".join(sys.path)
     ):
         """
@@ -47,64 +135,75 @@ class Package(object):
             - fullname and dist_dir
             - package_dir
             - dist_dir (will mock setup.py to get name and version)
+
+        If name and version are already known (for example from a pinned
+        spec) they can be passed in, so setup.py does not have to be run
+        just to learn them. Otherwise they are computed on first access.
         """
 
         self.exe = exe
         self.python_path = python_path
 
-        fullname = fullname or (package_dir and os.listdir(package_dir)[0])
-        self.dist_dir = dist_dir or os.path.join(package_dir, fullname)
-        self.name, self.version = self._get_name_version(fullname)
+        self._fullname = \
+            fullname or (package_dir and os.listdir(package_dir)[0])
+        self.dist_dir = dist_dir or os.path.join(package_dir, self._fullname)
+
+        self._name = name and name.lower()
+        self._version = version
+
+    @property
+    def name(self):
+        if self._name is None:
+            self._load_name_version()
+        return self._name
+
+    @property
+    def version(self):
+        if self._version is None:
+            self._load_name_version()
+        return self._version
 
-        self.name = self.name.lower()
+    @property
+    def _display_name(self):
+        """Name usable in messages, without triggering name detection"""
+        return self._name or self._fullname or "noname"
 
-    def get_deps(self, extra=()):
+    def _load_name_version(self):
+        name, version = self._get_name_version(self._fullname)
+        self._name = self._name or name.lower()
+        self._version = self._version or version
+
+    def get_deps(self, extra=(), environment=None):
         """
         Get package dependencies from egg info or from by intercepting setup
-        arguments
+        arguments, for the given extras and environment marker values
+        (default: the ones of the package interpreter)
+        """
+
+        if environment is None:
+            environment = get_marker_environment(self.exe, self.python_path)
+
+        return select_deps(
+            self._read_package_requires_file(),
+            self._get_package_setup_arguments,
+            extra, environment, self.name)
+
+    def get_requirements(self):
+        """
+        Gets all requirements of the package, independent of extras and of
+        the interpreter, so they can be shared by all environments: a dict
+        with requires.txt entries as (requirement, section, marker) tuples,
+        setup arguments, dependency links and whether setup.py looks like it
+        branches on the interpreter, in which case the rest only holds for
+        the interpreter of this package.
         """
 
-        name, version = self.name, self.version
-        deps = self._extract_egginfo(extra)
-
-        # distutils does not provide egg_info and tests_require is not
-        # written out
-        to_list = lambda x: x if isinstance(x, list) else [x]
-        flatten = lambda lst: \
-            sum(([x] if not isinstance(x, list) else flatten(x) for x in lst), [])
-
-        setup_args = self._get_package_setup_arguments() or {}
-        if not deps:
-            deps += [
-                (str(p), None) for p in
-                flatten(to_list(setup_args.get("install_requires") or []) +
-                        to_list(setup_args.get("requires") or []))
-                if p
-            ]
-
-        # This should be written by egg_info, but it's not
-        if "_tests_require" in extra:
-            deps += [
-                (str(p), '_tests_require') for p in
-                flatten(to_list(setup_args.get("tests_require") or [])) if p
-            ]
-        # Native dependencies
-        if "_setup_requires" in extra:
-            deps += [
-                (str(p), "_setup_requires") for p in
-                flatten(to_list(setup_args.get("setup_requires") or [])) if p
-            ]
-        if "_test_suite" in extra:
-            # Hardcoded nose collector test suite fix
-            if (
-                "nose.collector" in (setup_args.get("test_suite") or "")
-                and name != "nose"
-            ):
-                deps += [('nose', '_test_suite')]
-
-        #logger.debug('Found: %s' % (deps,))
-
-        return [(Spec.from_line(dep), src) for dep, src in deps if "#" not in dep]
+        return {
+            "requires": self._read_package_requires_file(),
+            "setup_args": self._get_package_setup_arguments() or {},
+            "links": self.get_dependency_links(),
+            "interpreter_specific": self._branches_on_interpreter(),
+        }
 
     def get_pkginfo(self):
         """Gets package info by reading PKG-INFO file"""
@@ -190,18 +289,9 @@ class Package(object):
 
         raise Exception("Name or version of %s not found!" % self.dist_dir)
 
-    def _extract_egginfo(self, extra=()):
-        """
-        Returns a list of string representations of dependencies for
-        a given distribution.
-        """
-
-        deps = self._read_package_requires_file(extra)
-
-        return deps
-
-    def _read_package_requires_file(self, extra=()):
-        """Returns a list of dependencies for an unpacked package dir."""
+    def _read_package_requires_file(self):
+        """Returns (requirement, section, marker) tuples of all dependencies
+        for an unpacked package dir."""
 
         egg_info_dir = self._get_package_egg_info_path()
         if egg_info_dir and \
@@ -210,28 +300,22 @@ class Package(object):
         else:  # requires.txt not found
             return []
 
-        deps = []
         with open(requires, 'r') as requirements:
-            skip_section = False
-            section = None
-            for requirement in requirements.readlines():
-                dep = requirement.strip()
-                if not dep:
-                    continue
-                elif dep[0] == "[":
-                    section = dep[1:-1]
-                    skip_section = not section in extra
-                    continue
-                if not skip_section:
-                    deps.append((dep, section))
+            return parse_requires_file(requirements.readlines())
 
-        return deps
+    def _branches_on_interpreter(self):
+        setup_py = os.path.join(self.dist_dir, "setup.py")
+        if not os.path.exists(setup_py):
+            return False
+
+        with open(setup_py, 'r') as f:
+            return branches_on_interpreter(f.read())
 
     def _get_package_egg_info_path(self):
         """Gets package egginfo path"""
 
         dist_dir = self.dist_dir
-        name, version = self.name, self.version
+        name = self.name
 
         def _get_egg_info_path():
             egg_info_dir = '{0}.egg-info'.format(name.replace('-', '_'))
@@ -295,10 +379,12 @@ class Package(object):
             ], cwd=self.dist_dir)
             parsed = json.loads(out.partition('#**#')[-1].rpartition('#**#')[0])
         except subprocess.CalledProcessError:
-            logger.warn("!! setup extract failed for %s", getattr(self, "name", "noname"))
+            logger.warn("!! setup extract failed for %s", self._display_name)
             return None
         except ValueError:
-            logger.warn("!! setup extract failed for %s, parse error", getattr(self, "name", "noname"))
+            logger.warn(
+                "!! setup extract failed for %s, parse error",
+                self._display_name)
             logger.warn(out)
             return None
         self._pkg_setup_arguments_call_cache = parsed
@@ -311,7 +397,7 @@ class PackageManager(object):
     def __init__(
         self, overrides={}, versions=[], extra=(), dependency_links=[],
         exe=sys.executable, python_path="",
-        download_cache_root="", cache=None,
+        download_cache_root="", cache=None, locked=None,
         link_hook=lambda overrides, spec, link: (link, None),
         dependency_hook=lambda overrides, spec, deps, package: deps,
         spec_hook=lambda overrides, spec: spec
@@ -319,13 +405,17 @@ class PackageManager(object):
         self.extra = extra
         self.exe, self.python_path = exe, python_path
         self.overrides = overrides or {}
-        self.versions = versions or []
+        self.versions = SpecSet(versions or [])
+
+        # Packages locked in a lockfile, used instead of the index and
+        # package archives when they match
+        self.locked = LockedPackages(locked or {})
 
         self._dependency_hook = dependency_hook
         self._link_hook = link_hook
         self._spec_hook = spec_hook
 
-        self.finder = PackageFinder(
+        self.finder = CandidateFinder(
             find_links=[],
             index_urls=['https://pypi.python.org/simple/'],
             use_mirrors=True,
@@ -339,78 +429,134 @@ class PackageManager(object):
         cache = cache or defaultdict(dict)
         self._link_cache = cache["link_cache"]
         self._dep_cache = cache["dep_cache"]
+        self._requirements_cache = cache["requirements_cache"]
         self._pkg_info_cache = cache["pkg_info_cache"]
         self._extract_cache = cache["extract_cache"]
+        self._version_cache = cache["version_cache"]
+        self._version_index_cache = {}
         self._best_match_call_cache = {}
         self._dep_call_cache = {}
         self._pkg_info_call_cache = {}
 
-    def find_best_match(self, spec):
-        def _find_cached_match(spec):
-            #if spec.is_pinned:
-                ## If this is a pinned spec, we can take a shortcut: if it is
-                ## found in the dependency cache, we can safely assume it has
-                ## been downloaded before, and thus must exist.  We can know
-                ## this without every reaching out to PyPI and avoid the
-                ## network overhead.
-                #name, version = spec.name, first(spec.preds)[1]
-                #if (name, version) in self._dep_cache:
-                    #source = 'dependency cache'
-                    #return version, source
-            version = None
-            overrides = self.overrides.get(spec.name)
-
-            ## Try the link cache, and otherwise, try PyPI
-            if (spec.no_extra, overrides) in self._link_cache:
-                link, version = self._link_cache[(spec.no_extra, overrides)]
-                source = 'link cache'
-            else:
-                try:
-                    requirement = InstallRequirement.from_line(specline)
-                    link = self.finder.find_requirement(requirement, False)
-                except DistributionNotFound:
-                    requirement = InstallRequirement.from_line(
-                        specline, prereleases=True)
-                    link = self.finder.find_requirement(requirement, False)
-
-                link, version = self._link_hook(overrides, spec, link)
+    def _get_candidates(self, name):
+        """Returns a `VersionIndex` of all known releases of the named
+        project and a dict with their links by version.
 
+        Releases are taken from the version cache if they are known, and are
+        otherwise looked up once on the index for all specs of the project.
+        Returns None if no releases could be found.
+        """
+        key = (name, tuple(sorted(self.finder.dependency_links)))
+        if key in self._version_index_cache:
+            return self._version_index_cache[key]
+
+        candidates = self._version_cache.get(key)
+        if not candidates:
+            candidates = self.finder.find_candidates(name)
+            for _, link in candidates:
                 # Hack to make pickle work
                 link.comes_from = None
-                source = 'PyPI'
+            if candidates:
+                self._version_cache[key] = candidates
+
+        result = None
+        if candidates:
+            links = {}
+            for version, link in candidates:
+                # Candidates are sorted by preference, keep the best link
+                links.setdefault(version, link)
+            result = VersionIndex(links), links
+        self._version_index_cache[key] = result
+        return result
+
+    def _find_candidate_link(self, spec):
+        """Finds the link of the best release matching the spec in the known
+        releases of its project. Returns (link, version), or (None, None) if
+        none of them match.
+        """
+        candidates = self._get_candidates(spec.name)
+        if candidates is None:
+            return None, None
+
+        index, links = candidates
+        version = index.best_match(spec.preds)
+        if version is None:
+            return None, None
+        return links[version], version
+
+    def _find_requirement_link(self, specline):
+        """Finds the link of the best release matching the specline on the
+        index, using pip's `PackageFinder`.
+        """
+        try:
+            requirement = InstallRequirement.from_line(specline)
+            return self.finder.find_requirement(requirement, False)
+        except DistributionNotFound:
+            requirement = InstallRequirement.from_line(
+                specline, prereleases=True)
+            return self.finder.find_requirement(requirement, False)
+
+    def _find_link(self, spec):
+        """Finds the link and version of the best release matching the spec,
+        from the link cache, the known releases of its project or PyPI.
+        """
+        overrides = self.overrides.get(spec.name)
+
+        if (spec.no_extra, overrides) in self._link_cache:
+            link, version = self._link_cache[(spec.no_extra, overrides)]
+            return link, version, 'link cache'
+
+        link, candidate_version = self._find_candidate_link(spec)
+        if link is not None:
+            source = 'version index'
+        else:
+            link = self._find_requirement_link(spec.no_extra)
+            source = 'PyPI'
+
+        link, version = self._link_hook(overrides, spec, link)
+
+        # Hack to make pickle work
+        link.comes_from = None
 
-                if link.egg_fragment:
-                    version = link.egg_fragment.rsplit('-', 1)[1]
-                    link = Link(
-                        link.url_without_fragment + "#%s=%s" % self.get_hash(link)
-                    )
-                elif not version:
-                    _, version = splitext(link.filename)[0].rsplit('-', 1)
+        if link.egg_fragment:
+            version = link.egg_fragment.rsplit('-', 1)[1]
+            link = Link(
+                link.url_without_fragment + "#%s=%s" % self.get_hash(link)
+            )
+        elif not version:
+            version = candidate_version
+            if not version:
+                _, version = splitext(link.filename)[0].rsplit('-', 1)
 
-                # It's more reliable to get version from pinned spec then filename
-                if spec.is_pinned:
-                    version = spec.pinned
+        # It's more reliable to get version from pinned spec then filename
+        if spec.is_pinned:
+            version = spec.pinned
 
-                assert version, "Version must be set!"
-                self._link_cache[(spec.no_extra, overrides)] = (link, version)
+        assert version, "Version must be set!"
+        self._link_cache[(spec.no_extra, overrides)] = (link, version)
 
-                # Take this moment to smartly insert the pinned variant of this
-                # spec into the link_cache, too
-                pinned_spec = Spec.from_pinned(spec.name, version)
-                self._link_cache[pinned_spec.fullname] = (link, version)
+        # Take this moment to smartly insert the pinned variant of this
+        # spec into the link_cache, too
+        pinned_spec = Spec.from_pinned(spec.name, version)
+        self._link_cache[pinned_spec.fullname] = (link, version)
 
-            return version, source
+        return link, version, source
 
-        version = next((v for v in self.versions if v.name == spec.name), None)
+    def find_best_match(self, spec):
+        version = self.versions.get(spec.name)
         if version:
-            spec.pinned = version.pinned
+            spec = spec.pin(version.pinned)
 
         specline = spec.no_extra
         if '==' not in specline or specline not in self._best_match_call_cache:
             logger.debug('- Finding best package matching %s' % spec)
-        version = next((v for v in self.versions if v.name == spec.name), None)
         with logger.indent():
-            version, source = _find_cached_match(spec)
+            version = self.locked.best_match(
+                spec, self.overrides.get(spec.name))
+            if version is not None:
+                source = 'lockfile'
+            else:
+                _, version, source = self._find_link(spec)
         if '==' not in specline or specline not in self._best_match_call_cache:
             logger.debug('  Found best match: %s (from %s)' % (version, source))
         self._best_match_call_cache[specline] = True
@@ -419,6 +565,16 @@ class PackageManager(object):
 
     def get_dependencies(self, name, version, extra=()):
         """Gets list of dependencies from package"""
+        return self._get_dependencies(name, version, extra)
+
+    def get_cached_dependencies(self, name, version, extra=()):
+        """Gets list of dependencies from package like `get_dependencies`,
+        but only from the dependency cache.  Returns None if they are not
+        cached.
+        """
+        return self._get_dependencies(name, version, extra, cached_only=True)
+
+    def _get_dependencies(self, name, version, extra=(), cached_only=False):
         spec = Spec.from_pinned(name, version, extra=extra)
         overrides = self.overrides.get(spec.name)
         extra = self.extra + extra
@@ -426,22 +582,32 @@ class PackageManager(object):
         if spec not in self._dep_call_cache:
             logger.debug('- Getting dependencies for %s-%s' % (name, version))
         with logger.indent():
+            locked_deps = self.locked.get_dependencies(
+                name, version, spec.extra, overrides)
             deps = self._dep_cache.get((spec, overrides))
             links = self._dep_cache.get((spec, overrides, "links"))
-            if deps is not None and links is not None:
+            if locked_deps is not None:
+                locked = self.locked.get(name, version, overrides)
+                deps, links = locked_deps, list(locked["links"])
+                source = 'lockfile'
+            elif deps is not None and links is not None:
                 source = 'dependency cache'
+            elif cached_only:
+                return None
             else:
-                package = self.get_package(spec)
+                package = LazyPackage(lambda: self.get_package(spec))
+                requirements, source = self._get_requirements(spec)
 
-                deps = package.get_deps(extra=extra)
+                deps = select_deps(
+                    requirements["requires"],
+                    lambda: requirements["setup_args"],
+                    extra, self.marker_environment, spec.name)
                 deps = self._dependency_hook(overrides, spec, deps, package)
                 self._dep_cache[(spec, overrides)] = deps
 
-                links = package.get_dependency_links()
+                links = requirements["links"]
                 self._dep_cache[(spec, overrides, "links")] = links
 
-                source = 'package archive'
-
         # Run spec hook
         deps = [
             (self._spec_hook(self.overrides.get(dep.name), dep), src)
@@ -458,7 +624,73 @@ class PackageManager(object):
         self._dep_call_cache[spec] = True
         return deps
 
+    def get_dependency_links(self, name, version, extra=()):
+        """Returns the dependency links of the package found while getting
+        its dependencies, or an empty list if they are not known.
+        """
+        spec = Spec.from_pinned(name, version, extra=extra)
+        overrides = self.overrides.get(spec.name)
+        locked = self.locked.get(name, version, overrides)
+        if locked is not None and tuple(locked["extras"]) == spec.extra:
+            return list(locked["links"])
+        return list(self._dep_cache.get((spec, overrides, "links")) or [])
+
+    def prefetch(self, spec):
+        """Finds the best match for the spec and downloads and extracts its
+        package archive, unless its requirements are known already.  Does
+        not run any of the package's code.
+        """
+        if self.locked.best_match(
+                spec, self.overrides.get(spec.name)) is not None:
+            return
+
+        version = self.find_best_match(spec)
+        link, _ = self.get_link(spec.name, version)
+        if link.hash and link.hash_name and \
+                "%s:%s" % (link.hash_name, link.hash) in self._requirements_cache:
+            return
+
+        path = self._get_or_download_package(
+            Spec.from_pinned(spec.name, version).fullname)
+        self._get_pristine_tree(path)
+
+    @property
+    def marker_environment(self):
+        """Environment marker values of the interpreter of this manager"""
+        return get_marker_environment(self.exe, self.python_path)
+
+    def _get_requirements(self, spec):
+        """Returns the requirements of the package archive of the pinned spec
+        (see `Package.get_requirements`) and where they came from.
+
+        Requirements are shared by all environments, by archive digest,
+        unless setup.py branches on the interpreter.  Those are stored per
+        interpreter, and only introspected again for each one of them.
+        """
+        link, _ = self.get_link(spec.name, spec.pinned)
+        digest = "%s:%s" % self.get_hash(link)
+
+        requirements = self._requirements_cache.get(digest)
+        if requirements is not None and requirements["interpreter_specific"]:
+            requirements = self._requirements_cache.get((digest, self.exe))
+        if requirements is not None:
+            return requirements, 'requirements cache'
+
+        requirements = self.get_package(spec).get_requirements()
+        if requirements["interpreter_specific"]:
+            logger.debug(
+                '  %s branches on the interpreter, not sharing requirements'
+                % spec.fullname)
+            self._requirements_cache[(digest, self.exe)] = requirements
+        if digest not in self._requirements_cache:
+            self._requirements_cache[digest] = requirements
+        return requirements, 'package archive'
+
     def get_pkg_info(self, name, version):
+        locked = self.locked.get(name, version, self.overrides.get(name))
+        if locked is not None:
+            return locked["pkg_info"]
+
         spec = Spec.from_pinned(name, version)
 
         if spec.no_extra not in self._pkg_info_call_cache:
@@ -482,15 +714,27 @@ class PackageManager(object):
         return pkg_info
 
     def get_link(self, name, version):
-        logger.debug('- Getting link for %s-%s' % (name, version))
+        """Returns (link, version) of the given package version, which is
+        usually in the link cache already since its best match was found.
+        """
+        locked = self.locked.get(name, version, self.overrides.get(name))
+        if locked is not None:
+            return Link(str(locked["url"])), version
+
         spec = Spec.from_pinned(name, version)
-        self.find_best_match(spec)
+        if spec.fullname not in self._link_cache:
+            logger.debug('- Getting link for %s-%s' % (name, version))
+            self.find_best_match(spec)
         return self._link_cache[spec.fullname]
 
     def get_hash(self, link):
         if link.hash and link.hash_name:
             return (link.hash_name, link.hash)
 
+        locked = self.locked.get_hash(link.url, self.overrides)
+        if locked is not None:
+            return locked
+
         def md5hash(path):
             return ("md5",  hashlib.md5(open(path, 'rb').read()).hexdigest())
 
@@ -510,6 +754,7 @@ class PackageManager(object):
         path = self._get_or_download_package(spec.fullname)
         return Package(
             package_dir=self._extract(path),
+            name=spec.name, version=spec.pinned,
             exe=self.exe, python_path=self.python_path
         )
 
@@ -544,13 +789,25 @@ class PackageManager(object):
     def _download_package(self, link):
         """Downloads the given package link contents to the local
         package cache. Overwrites anything that's in the cache already.
+
+        The archive is downloaded to a temporary file first and then moved
+        in place, so other processes never see partial downloads.
         """
         url = link.url_without_fragment
         logger.info('- Downloading package from %s' % (url,))
         with logger.indent():
             fullpath = self._get_local_package_path(url)
-            response = _get_response_from_url(url, link)
-            _download_url(response, link, fullpath)
+            fd, temppath = tempfile.mkstemp(
+                dir=os.path.dirname(fullpath),
+                prefix=os.path.basename(fullpath) + '.')
+            os.close(fd)
+            try:
+                response = _get_response_from_url(url, link)
+                _download_url(response, link, temppath)
+                os.rename(temppath, fullpath)
+            except:
+                os.remove(temppath)
+                raise
             return fullpath
 
     def _unpack_archive(self, path, target_directory):
@@ -569,16 +826,61 @@ class PackageManager(object):
             finally:
                 archive.close()
 
+    def _get_pristine_tree(self, path):
+        """Returns the directory the given archive is extracted to, which is
+        shared by all environments and processes and must never be written
+        to.  The archive is extracted only once, atomically.  Its time of
+        modification is its time of last use, see `prune_extracted`.
+        """
+        target = os.path.join(
+            self.download_cache_root, 'extracted',
+            hashlib.sha1(os.path.basename(path)).hexdigest())
+        if os.path.isdir(target):
+            try:
+                os.utime(target, None)
+            except OSError:
+                pass
+            return target
+
+        logger.info('- Extracting package %s' % (path,))
+
+        parent = os.path.dirname(target)
+        if not os.path.isdir(parent):
+            try:
+                os.makedirs(parent)
+            except OSError:
+                if not os.path.isdir(parent):
+                    raise
+
+        temp_dir = tempfile.mkdtemp(dir=parent, prefix='.tmp-')
+        try:
+            self._unpack_archive(path, temp_dir)
+            os.rename(temp_dir, target)
+        except OSError:
+            # Another process could have extracted it in the meantime
+            if not os.path.isdir(target):
+                raise
+        finally:
+            if os.path.exists(temp_dir):
+                shutil.rmtree(temp_dir)
+
+        return target
+
     def _extract(self, path):
+        """Returns a private copy of the extracted archive, that can be
+        written to by setup.py.  Files are copied, as reflinks where the
+        filesystem supports them, rather than hardlinked, since setup.py can
+        rewrite any file in place, like a version file.
+        """
         if path in self._extract_cache:
             return self._extract_cache[path]
 
-        logger.info('- Extracting package %s' % (path,))
+        pristine_dir = self._get_pristine_tree(path)
 
         build_dir = tempfile.mkdtemp()
         atexit.register(shutil.rmtree, build_dir)
         unpack_dir = os.path.join(build_dir, 'build')
-        self._unpack_archive(path, unpack_dir)
+        copy_tree(pristine_dir, unpack_dir)
 
         # Cache unpack
         self._extract_cache[path] = unpack_dir
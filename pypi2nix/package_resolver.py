@@ -1,10 +1,12 @@
 import os
 import sys
+import copy
 import requests
 import ConfigParser
 import StringIO
 
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
+from itertools import chain
 from functools import partial
 from urlparse import urlparse
 from jinja2 import Environment
@@ -12,20 +14,106 @@ from pip.index import Link
 from pip.util import splitext
 
 from .log import logger
-from .datastructures import Spec, SpecSet, first
+from .datastructures import Spec, SpecSet, ConflictError
 from .package_manager import PackageManager
-from .dependency_resolver import DependencyResolver
-from .caching import hashabledict
+from .dependency_resolver import DependencyResolver, ClosureCache
+from .prefetch import Prefetcher
+from .caching import hashabledict, fingerprint, flush_caches
+from . import __version__
 
 env = Environment()
 
 
+def _dep_names(pkg):
+    """Yields fullnames of all dependencies of a package, including the ones
+    of all of its extras sections.
+    """
+    for dep, _ in pkg["deps"]:
+        yield dep
+    for section in pkg["extra"]:
+        for dep, _ in pkg["extra"][section]:
+            yield dep
+
+
+def reachable_packages(packages, root):
+    """Returns fullnames of all packages reachable from the given root
+    fullname in the given dict of packages by fullname, including the root.
+    """
+    seen = set([root])
+    todo = [root]
+    while todo:
+        for dep in _dep_names(packages[todo.pop()]):
+            if dep not in seen:
+                seen.add(dep)
+                todo.append(dep)
+    return seen
+
+
+def break_circular_deps(packages, roots=()):
+    """Removes circular dependencies from the given dict of packages by
+    fullname, visiting the packages depth first starting at the given root
+    fullnames.
+
+    Circular dependencies are the back edges of an iterative depth first
+    search over dependencies and all extras sections: dependencies on
+    packages that are on the current search path when they are visited.
+    Removing them leaves the graph acyclic while keeping every other
+    dependency.  Runs in O(V + E) time.
+    """
+    visited = set()
+    on_path = set()
+    back_edges = set()
+
+    for root in chain(roots, sorted(packages)):
+        if root in visited:
+            continue
+
+        visited.add(root)
+        on_path.add(root)
+        work = [(root, _dep_names(packages[root]))]
+        while work:
+            name, deps = work[-1]
+            for dep in deps:
+                if dep in on_path:
+                    back_edges.add((name, dep))
+                elif dep not in visited:
+                    visited.add(dep)
+                    on_path.add(dep)
+                    work.append((dep, _dep_names(packages[dep])))
+                    break
+            else:
+                work.pop()
+                on_path.discard(name)
+
+    def is_circular(name, dep):
+        return (name, dep) in back_edges
+
+    for name, pkg in packages.iteritems():
+        deps = [(dep, extra) for dep, extra in pkg["deps"]
+                if not is_circular(name, dep)]
+        if len(deps) != len(pkg["deps"]):
+            logger.info('- Circular deps detected in package %s' % name)
+            pkg["has_circular_deps"] = True
+            pkg["deps"] = deps
+
+        for section in pkg["extra"]:
+            deps = [(dep, extra) for dep, extra in pkg["extra"][section]
+                    if not is_circular(name, dep)]
+            if len(deps) != len(pkg["extra"][section]):
+                logger.info(
+                    '- Circular deps detected in package %s for extra %s'
+                    % (name, section))
+                pkg["has_circular_deps"] = True
+                pkg["extra"][section] = deps
+
+
 class PackageResolver(object):
     def __init__(
         self,
         exe=sys.executable, python_path=":".join(sys.path),
         download_cache_root="/tmp", cache=defaultdict(dict),
         overrides={}, test_profile="top_level", remove_circular_deps=True,
+        prefetch_workers=4,
 
         # Additional internal extra used
         extra=("_setup_requires",),
@@ -43,11 +131,15 @@ class PackageResolver(object):
             spec_hook=self._spec_hook
         )
 
+        self.exe = exe
+        self.python_path = python_path
+        self.cache = cache
         self.extra = extra
         self.test_extra = test_extra
         self.test_profile = test_profile
         self.overrides = overrides
         self.remove_circular_deps = remove_circular_deps
+        self.prefetch_workers = prefetch_workers
 
     def _parse_buildout(self, content):
 
@@ -204,18 +296,28 @@ class PackageResolver(object):
                 overrides, spec)
 
             new_spec = Spec.from_line(overrides.get("spec"), source="spec_hook")
-            if not new_spec.extra and spec.extra:
-                new_spec._extra = spec._extra
-            if not new_spec.preds and spec.preds:
-                new_spec._preds = spec._preds
-
-            return new_spec
+            return Spec(
+                new_spec.name, new_spec.preds or spec.preds,
+                new_spec.source, new_spec.extra or spec.extra)
 
         return spec
 
     def resolve(
         self, specs,
-        versions=set(), overrides={}, extra=(), dependency_links=[]
+        versions=set(), overrides={}, extra=(), dependency_links=[],
+        locked=None, break_cycles=True
+    ):
+        try:
+            return self._resolve(
+                specs, versions, overrides, extra, dependency_links, locked,
+                break_cycles)
+        finally:
+            # Cache entries found while resolving are written at once
+            flush_caches(self.cache)
+
+    def _resolve(
+        self, specs, versions, overrides, extra, dependency_links, locked,
+        break_cycles
     ):
         _overrides = {}
         _overrides.update(self.overrides)
@@ -223,6 +325,9 @@ class PackageResolver(object):
 
         target_specs = specs
 
+        # Before top level packages are marked in overrides
+        overrides_fingerprint = fingerprint(sorted(_overrides.items()))
+
         logger.info('===> Collecting requirements')
 
         spec_set = SpecSet()
@@ -231,8 +336,9 @@ class PackageResolver(object):
         # Add specs to spec_set and add override for spec as top level packages
         for spec, source in target_specs:
             spec_set.add_spec(spec)
-            _overrides[spec.name] = _overrides.get(spec.name, hashabledict())
-            _overrides[spec.name].update(hashabledict(tlp=True))
+            # Copied, so the flag does not leak into other runs
+            _overrides[spec.name] = hashabledict(
+                _overrides.get(spec.name) or {}, tlp=True)
             tlp.append(spec.name)
 
         # Parses versions
@@ -244,6 +350,7 @@ class PackageResolver(object):
             overrides=_overrides,
             versions=versions,
             dependency_links=dependency_links,
+            locked=locked,
         )
 
         logger.info('===> Normalizing requirements')
@@ -252,12 +359,37 @@ class PackageResolver(object):
             for spec in spec_set:
                 logger.info('- %s' % (spec,))
 
+        # Resolve incrementally from the locked graph, if there is one
+        previous = None
+        if locked:
+            previous = package_manager.locked.graph(
+                _overrides, package_manager.versions)
+
+        # Closures of packages only apply to runs with the same overrides
+        # and versions
+        closures = ClosureCache(
+            self.cache["closure_cache"],
+            fingerprint=fingerprint(
+                overrides_fingerprint, sorted(str(v) for v in versions)),
+            validate=package_manager.get_cached_dependencies)
+
         logger.info('===> Resolving full tree')
 
         with logger.indent():
-            resolver = DependencyResolver(
-                spec_set, package_manager=package_manager)
-            pinned = resolver.resolve()
+            if self.prefetch_workers:
+                with Prefetcher(
+                    package_manager, workers=self.prefetch_workers
+                ) as prefetcher:
+                    resolver = DependencyResolver(
+                        spec_set, package_manager=prefetcher,
+                        closures=closures, previous=previous)
+                    graph = resolver.resolve_graph()
+            else:
+                resolver = DependencyResolver(
+                    spec_set, package_manager=package_manager,
+                    closures=closures, previous=previous)
+                graph = resolver.resolve_graph()
+            pinned = graph.pinned
 
         logger.info('===> Pinned spec set resolved')
         with logger.indent():
@@ -269,11 +401,14 @@ class PackageResolver(object):
 
         with logger.indent():
             result = {}
-            for spec in pinned:
-                package_manager.find_best_match(spec)
-                pkg_info = package_manager.get_pkg_info(spec.name, spec.pinned)
-                link, _ = package_manager.get_link(spec.name, spec.pinned)
-                hash = package_manager.get_hash(link)
+            for node in graph:
+                spec = node.spec
+                node.link, _ = package_manager.get_link(spec.name, spec.pinned)
+                node.hash = package_manager.get_hash(node.link)
+                node.pkg_info = package_manager.get_pkg_info(
+                    spec.name, spec.pinned)
+
+                link, hash, pkg_info = node.link, node.hash, node.pkg_info
                 pkg = {
                     "name": spec.name,
                     "fullname": spec.fullname,
@@ -290,14 +425,24 @@ class PackageResolver(object):
                     "meta": {
                         "homepage": pkg_info["Home-page"]
                     } if pkg_info else {},
-                    "has_circular_deps": False, "checked": False
+                    "has_circular_deps": False,
+
+                    # What the package was resolved with, for lockfiles
+                    "extras": list(spec.extra),
+                    "requires": [
+                        (str(dep), section) for dep, section in node.deps],
+                    "links": package_manager.get_dependency_links(
+                        spec.name, spec.pinned, spec.extra),
+                    "pkg_info": dict(
+                        (key, pkg_info[key])
+                        for key in ("has_tests", "Home-page")
+                        if key in pkg_info
+                    ) if pkg_info else pkg_info,
+                    "overrides": fingerprint(_overrides.get(spec.name)),
                 }
 
-                deps = package_manager.get_dependencies(
-                    spec.name, spec.pinned, spec.extra)
-
-                for dep, section in deps:
-                    pinned_dep = first(pinned._byname[dep.name])
+                for dep, section in node.deps:
+                    pinned_dep = pinned.get(dep.name)
 
                     # skip dependencies pointing to ourself (recursive dependencies)
                     if spec.fullname == pinned_dep.fullname:
@@ -314,51 +459,189 @@ class PackageResolver(object):
 
                 result[spec.fullname] = pkg
 
-        def _remove_circular_deps(pkg, visited=[]):
-            if pkg["checked"]:
-                return pkg
-
-            new_deps = [
-                (_remove_circular_deps(
-                    result[dep], visited + [pkg["fullname"]]
-                )["fullname"], extra)
-                for dep, extra in pkg["deps"] if not dep in visited
-            ]
-            if new_deps != pkg["deps"]:
-                logger.info('- Circular deps detected in package %s' %pkg["fullname"])
-                pkg["has_circular_deps"] = True
-                pkg["deps"] = new_deps
-
-            for section in pkg["extra"]:
-                new_deps = [
-                    (_remove_circular_deps(
-                        result[dep], visited + [pkg["fullname"]]
-                    )["fullname"], extra)
-                    for dep, extra in pkg["extra"][section] if not dep in visited
-                ]
-                if new_deps != pkg["extra"][section]:
-                    logger.info(
-                        '- Circular deps detected in package %s for extra %s'
-                        % (pkg["fullname"], section))
-                    pkg["has_circula_deps"] = True
-                    pkg["extra"][section] = new_deps
-
-            pkg["checked"] = True
-            return pkg
-
-        logger.info('===> Removing circular dependencies')
-
-        def get_pinned(name):
-            return next((s for s in pinned if s.name == name))
-
-        if self.remove_circular_deps:
-            for target_spec, source in target_specs:
-                _remove_circular_deps(
-                    result[get_pinned(target_spec.name).fullname])
+        if self.remove_circular_deps and break_cycles:
+            logger.info('===> Removing circular dependencies')
+            with logger.indent():
+                break_circular_deps(result, [
+                    pinned.get(target_spec.name).fullname
+                    for target_spec, source in target_specs])
 
         return (
             result, {
                 spec.name:
-                (get_pinned(spec.name), src) for spec, src in target_specs
+                (pinned.get(spec.name), src) for spec, src in target_specs
             }
         )
+
+    def _entry_fingerprint(self, entry, extra, dependency_links):
+        """Returns a fingerprint of everything an entry is resolved with,
+        except for overrides of packages, which are checked separately.
+        """
+        name, spec, versions, entry_overrides = entry
+        return fingerprint(
+            __version__, self.exe, self.python_path, self.test_profile,
+            self.extra, self.test_extra, extra, dependency_links,
+            name, str(spec), versions, sorted((entry_overrides or {}).items()))
+
+    def _batch_fingerprint(self, batch, extra, dependency_links):
+        """Returns a fingerprint of the entries resolved together, since every
+        entry is resolved with the constraints of the others.
+        """
+        return fingerprint([
+            self._entry_fingerprint(entry, extra, dependency_links)
+            for entry in batch])
+
+    def _overrides_fingerprint(self, overrides, pkgs):
+        """Returns a fingerprint of the overrides that apply to the given
+        resolved packages.  Spec overrides apply to dependencies before they
+        are renamed, so they are always included.
+        """
+        names = set(pkg["name"] for pkg in pkgs.itervalues())
+        return fingerprint(sorted(
+            (name, value) for name, value in overrides.iteritems()
+            if name in names or "spec" in (value or {})))
+
+    def resolve_many(
+        self, entries, overrides={}, extra=(), dependency_links=[],
+        results=None, locked=None
+    ):
+        """Resolves many (name, spec, versions, overrides) entries, like the
+        speclines of an input file, in as few resolver runs as possible.
+
+        Entries with the same versions and overrides are resolved together,
+        so dependencies they share are only resolved once.  If such a batch
+        conflicts, its entries are resolved one by one, and conflicts are
+        reported per entry.
+
+        With a `results` cache, like a PersistentCache, the packages every
+        batch resolved to are stored by a fingerprint of the inputs of all
+        its entries.  Batches whose entries and overrides of resolved
+        packages did not change are taken from the cache, and only the
+        others are resolved.
+
+        Packages `locked` in a lockfile are used like in `resolve`.
+
+        Returns the merged package dict and aliases, like `resolve`.  Every
+        package lists the names of the entries it is needed by in its
+        "packages" field.  Circular dependencies are only removed from the
+        merged packages, so entries keep packages they only reach through a
+        cycle.
+        """
+        resolved, resolved_alias = {}, {}
+        new_results = {}
+
+        def local_overrides(entry):
+            _, _, _, entry_overrides = entry
+            local_overrides = {}
+            local_overrides.update(overrides)
+            local_overrides.update(entry_overrides or {})
+            return local_overrides
+
+        def merge(batch, pkgs, alias):
+            resolved_alias.update(alias)
+            batch_pkgs = []
+            for name, spec, _, _ in batch:
+                root = alias[spec.name][0].fullname
+                batch_pkgs.append((name, dict(
+                    (fullname, pkgs[fullname])
+                    for fullname in reachable_packages(pkgs, root))))
+
+            for name, entry_pkgs in batch_pkgs:
+                for fullname, pkg in entry_pkgs.iteritems():
+                    # if package already in resolved just merge extra
+                    if fullname not in resolved:
+                        pkg["packages"] = []
+                        resolved[fullname] = pkg
+                    elif resolved[fullname] is not pkg:
+                        for k, v in pkg["extra"].iteritems():
+                            resolved[fullname]["extra"][k] = list(
+                                set(resolved[fullname]["extra"].get(k, []) + v)
+                            )
+                    resolved[fullname]["packages"].append(name)
+
+        def resolve(batch):
+            _, _, versions, _ = batch[0]
+            return self.resolve(
+                specs=set((spec, None) for _, spec, _, _ in batch),
+                versions=versions or set(),
+                overrides=local_overrides(batch[0]),
+                extra=extra, dependency_links=dependency_links,
+                locked=locked, break_cycles=False
+            )
+
+        def resolve_batch(batch):
+            """Returns the (entry indexes, pkgs, alias) results of resolving
+            the batch, together or, if it conflicts, one entry at a time.
+            """
+            logger.info('~> Resolving %s' % ', '.join(
+                name for name, _, _, _ in batch))
+            try:
+                return [(range(len(batch)),) + resolve(batch)]
+            except ConflictError as e:
+                if len(batch) == 1:
+                    raise ConflictError('%s: %s' % (batch[0][0], e))
+                logger.info(
+                    '~> Conflict resolving together (%s), '
+                    'resolving one by one' % e)
+
+            parts = []
+            for index, entry in enumerate(batch):
+                try:
+                    pkgs, alias = resolve([entry])
+                except ConflictError as e:
+                    raise ConflictError('%s: %s' % (entry[0], e))
+                parts.append(([index], pkgs, alias))
+            return parts
+
+        def overrides_fingerprint(batch, parts):
+            pkgs = {}
+            for _, part_pkgs, _ in parts:
+                pkgs.update(part_pkgs)
+            return self._overrides_fingerprint(local_overrides(batch[0]), pkgs)
+
+        batches = OrderedDict()
+        for entry in entries:
+            _, _, versions, entry_overrides = entry
+            key = (tuple(versions or ()),
+                   tuple(sorted((entry_overrides or {}).items())))
+            batches.setdefault(key, []).append(entry)
+
+        unchanged = []
+        for batch in batches.itervalues():
+            parts = None
+            if results is not None:
+                key = self._batch_fingerprint(batch, extra, dependency_links)
+                cached = results.get(key)
+                if cached is not None:
+                    stored, parts = copy.deepcopy(cached)
+                    if stored == overrides_fingerprint(batch, parts):
+                        unchanged.extend(name for name, _, _, _ in batch)
+                    else:
+                        parts = None
+
+            if parts is None:
+                parts = resolve_batch(batch)
+                if results is not None:
+                    # Copied before packages are merged with other entries
+                    new_results[key] = copy.deepcopy(
+                        (overrides_fingerprint(batch, parts), parts))
+
+            for indexes, pkgs, alias in parts:
+                merge([batch[index] for index in indexes], pkgs, alias)
+
+        if unchanged:
+            logger.info('~> Reused results of %d unchanged entries: %s'
+                        % (len(unchanged), ', '.join(unchanged)))
+
+        # Write a persistent cache only once
+        if new_results:
+            results.update(new_results)
+
+        if self.remove_circular_deps:
+            logger.info('===> Removing circular dependencies')
+            with logger.indent():
+                break_circular_deps(resolved, [
+                    resolved_alias[entry[1].name][0].fullname
+                    for entry in entries])
+
+        return resolved, resolved_alias
@@ -0,0 +1,65 @@
+import multiprocessing
+import traceback
+
+try:
+    from Queue import Empty
+except ImportError:
+    from queue import Empty  # noqa
+
+
+class WorkerError(Exception):
+    pass
+
+
+def _run_task(queue, key, task):
+    try:
+        queue.put((key, True, task()))
+    except BaseException:
+        queue.put((key, False, traceback.format_exc()))
+
+
+def run_parallel(tasks, jobs=1, poll_interval=1):
+    """Runs the given tasks, a dict of callables by key, in up to `jobs`
+    forked worker processes at a time and returns their results by key.
+
+    Tasks and the state they use are inherited by forking, so only their
+    results have to be picklable.  With a single job, or a single task,
+    tasks run in this process.  Raises WorkerError if any task fails.
+    """
+    if jobs <= 1 or len(tasks) <= 1:
+        return dict((key, task()) for key, task in tasks.iteritems())
+
+    queue = multiprocessing.Queue()
+    pending = list(tasks.iteritems())
+    running = {}
+    results = {}
+    try:
+        while pending or running:
+            while pending and len(running) < jobs:
+                key, task = pending.pop(0)
+                process = multiprocessing.Process(
+                    target=_run_task, args=(queue, key, task))
+                process.start()
+                running[key] = process
+
+            # Results have to be received before joining workers, which
+            # otherwise block on flushing them
+            try:
+                key, ok, value = queue.get(timeout=poll_interval)
+            except Empty:
+                for key, process in running.items():
+                    if not process.is_alive() and process.exitcode != 0:
+                        raise WorkerError('Worker for %s died with exit code %s'
+                                          % (key, process.exitcode))
+                continue
+
+            running.pop(key).join()
+            if not ok:
+                raise WorkerError('Worker for %s failed:\n%s' % (key, value))
+            results[key] = value
+    finally:
+        for process in running.values():
+            process.terminate()
+            process.join()
+
+    return results
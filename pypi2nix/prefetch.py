@@ -0,0 +1,135 @@
+import threading
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue  # noqa
+
+from .log import logger
+
+
+class Prefetcher(object):
+    def __init__(self, package_manager, workers=4, max_queued=64):
+        """Wraps a PackageManager for a DependencyResolver, speculatively
+        fetching packages as soon as they are discovered as dependencies.
+
+        Background workers find the best match of every new dependency and
+        download and extract its archive, so the network and disk latency
+        overlaps with introspection on the resolver thread.  At most
+        `max_queued` packages wait to be prefetched; dependencies discovered
+        while the queue is full are left to the resolver.
+
+        Everything else is delegated to the wrapped package manager.
+        """
+        self.pkgmgr = package_manager
+        self.workers = workers
+        self.stats = dict(
+            scheduled=0, dropped=0, failed=0, hits=0, waits=0, misses=0)
+
+        self._queue = queue.Queue(max_queued)
+        self._threads = []
+        self._cancelled = threading.Event()
+
+        # Completion events of packages scheduled for prefetching, by name
+        self._events = {}
+
+    def __getattr__(self, name):
+        return getattr(self.pkgmgr, name)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.cancel()
+
+    def start(self):
+        for _ in range(self.workers):
+            thread = threading.Thread(target=self._work)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def cancel(self):
+        """Stops prefetching, dropping packages that were not fetched yet,
+        and logs prefetching statistics.
+        """
+        self._cancelled.set()
+        while True:
+            try:
+                spec = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            self._events[spec.name].set()
+        for thread in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+        if self.stats["scheduled"]:
+            logger.info('- Prefetched %d packages, hit rate %.0f%%' % (
+                self.stats["scheduled"], self.hit_rate() * 100))
+
+    def hit_rate(self):
+        """Returns the share of packages the resolver asked for, that were
+        prefetched or being prefetched already.
+        """
+        hits = self.stats["hits"] + self.stats["waits"]
+        total = hits + self.stats["misses"]
+        return float(hits) / total if total else 0.0
+
+    def schedule(self, spec):
+        """Schedules prefetching the best match of the given spec, unless
+        its package was scheduled before or the queue is full.
+        """
+        if spec.name in self._events or self._cancelled.is_set():
+            return
+
+        self._events[spec.name] = threading.Event()
+        try:
+            self._queue.put_nowait(spec)
+        except queue.Full:
+            del self._events[spec.name]
+            self.stats["dropped"] += 1
+            return
+        self.stats["scheduled"] += 1
+
+    def _work(self):
+        while True:
+            spec = self._queue.get()
+            if spec is None:
+                return
+
+            try:
+                if not self._cancelled.is_set():
+                    self.pkgmgr.prefetch(spec)
+            except Exception as e:
+                # The resolver gets to see the error when it needs the package
+                self.stats["failed"] += 1
+                logger.debug('- Prefetching %s failed: %s' % (spec, e))
+            finally:
+                self._events[spec.name].set()
+
+    def _wait(self, name):
+        """Waits until prefetching the named package is done, if it was
+        scheduled, and counts whether it was prefetched in time.
+        """
+        event = self._events.get(name)
+        if event is None or not self._threads:
+            self.stats["misses"] += 1
+        elif event.is_set():
+            self.stats["hits"] += 1
+        else:
+            self.stats["waits"] += 1
+            event.wait()
+
+    def find_best_match(self, spec):
+        self._wait(spec.name)
+        return self.pkgmgr.find_best_match(spec)
+
+    def get_dependencies(self, name, version, extra=()):
+        deps = self.pkgmgr.get_dependencies(name, version, extra)
+        for dep, _ in deps:
+            self.schedule(dep)
+        return deps
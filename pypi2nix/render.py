@@ -0,0 +1,240 @@
+"""
+Models the templates render the resolved packages of all environments from.
+"""
+
+from collections import defaultdict, namedtuple
+
+DATA_FORMAT = 2
+
+# Extras sections of packages that become build inputs
+TEST_SECTIONS = ("test", "tests", "testing", "_tests_require", "_test_suite")
+
+
+def _render_key(pkg):
+    """Returns what the template renders of a package, to compare packages
+    resolved for different environments.
+    """
+    return (
+        pkg["name"], pkg["version"], pkg["src"]["url"].split("#")[0],
+        pkg["src"]["algo"], pkg["src"]["sum"],
+        bool(pkg["has_tests"]), bool(pkg["has_circular_deps"]),
+        frozenset(pkg["deps"]),
+        frozenset((section, frozenset(deps))
+                  for section, deps in pkg["extra"].iteritems()))
+
+
+def split_shared_packages(resolved_pkgs):
+    """Splits the resolved packages of all environments into packages that
+    are resolved identically for several environments, which are rendered
+    once for those environments, and the remaining packages of every
+    environment.
+
+    Returns the shared packages as (environments, packages) groups, sorted
+    by their sorted tuple of environments, and a dict of the remaining
+    packages by environment.  Packages are sorted by fullname.
+    """
+    variants = defaultdict(dict)
+    for env in sorted(resolved_pkgs):
+        for fullname, pkg in resolved_pkgs[env].iteritems():
+            variants[fullname].setdefault(_render_key(pkg), []).append(env)
+
+    shared = defaultdict(list)
+    env_pkgs = dict((env, []) for env in resolved_pkgs)
+    for fullname in sorted(variants):
+        # Share the variant most environments resolved, if any two did
+        shared_envs = max(
+            variants[fullname].values(), key=lambda envs: (len(envs), envs))
+        if len(shared_envs) > 1:
+            shared[tuple(shared_envs)].append(
+                resolved_pkgs[shared_envs[0]][fullname])
+        else:
+            shared_envs = []
+
+        for envs in variants[fullname].itervalues():
+            if envs is not shared_envs:
+                for env in envs:
+                    env_pkgs[env].append(resolved_pkgs[env][fullname])
+
+    return sorted(shared.iteritems()), env_pkgs
+
+
+PackageModel = namedtuple("PackageModel", [
+    "fullname", "name", "version", "url", "algo", "sum", "has_tests",
+    "has_circular_deps", "build_inputs", "install_requires", "extra"])
+
+AliasModel = namedtuple("AliasModel", ["name", "fullname", "extras", "source"])
+
+RenderModel = namedtuple("RenderModel", ["aliases", "shared", "packages"])
+
+
+def _dictsort(d):
+    """Returns the items of a dict the way the `dictsort` filter sorts them."""
+    return sorted(d.iteritems(), key=lambda item: item[0].lower())
+
+
+def _refs(deps):
+    """Returns the references of the default template to dependencies, in
+    the iteration order of their set.
+    """
+    return "".join(
+        '(self.by-version."%s" [%s]) ' % (
+            fullname, " ".join('"%s"' % extra for extra in extras))
+        for fullname, extras in set(deps))
+
+
+def package_model(pkg, test_extra):
+    """Returns what the default template renders of a package, with its
+    dependencies rendered as references already.
+    """
+    extra = pkg["extra"]
+    return PackageModel(
+        fullname=pkg["fullname"],
+        name=pkg["name"],
+        version=pkg["version"],
+        url=pkg["src"]["url"].split("#")[0],
+        algo=pkg["src"]["algo"],
+        sum=pkg["src"]["sum"],
+        has_tests=bool(pkg["has_tests"]),
+        has_circular_deps=bool(pkg["has_circular_deps"]),
+        build_inputs=_refs(
+            sum((extra.get(section, []) for section in TEST_SECTIONS), [])),
+        install_requires=_refs(
+            pkg["deps"] + extra.get("_setup_requires", [])),
+        extra=tuple(
+            (section, _refs(deps)) for section, deps in extra.iteritems()
+            if section not in test_extra))
+
+
+def render_model(resolved_pkgs, resolved_alias, test_extra):
+    """Returns the model the sections of the default template are rendered
+    from: the aliases of every environment, the groups of shared packages
+    and the remaining packages of every environment that has any, as
+    immutable tuples in the order they are rendered.
+    """
+    aliases = []
+    for env, pkgs in _dictsort(resolved_alias):
+        aliases.append((env, tuple(
+            AliasModel(
+                name=name,
+                fullname=resolved_pkgs[env][spec.fullname]["fullname"],
+                extras="".join('"%s" ' % e for e in alias_extras(spec)),
+                source=source or "default")
+            for name, (spec, source) in _dictsort(pkgs))))
+
+    model = lambda pkg: package_model(pkg, test_extra)
+    shared, env_pkgs = split_shared_packages(resolved_pkgs)
+    return RenderModel(
+        aliases=tuple(aliases),
+        shared=tuple(
+            (envs, tuple(map(model, pkgs))) for envs, pkgs in shared),
+        packages=tuple(
+            (env, tuple(map(model, pkgs)))
+            for env, pkgs in _dictsort(env_pkgs) if pkgs))
+
+
+def variant_name(fullname, extras):
+    """Returns the name of the variant of a package with the given extras,
+    the way `callPythonPackage` in the default template names it.
+    """
+    return fullname + ("-" + "_".join(extras) if extras else "")
+
+
+def alias_extras(spec):
+    """Returns the extras an alias of the pinned spec refers to."""
+    return tuple(extra for extra in spec.extra if extra[0] != "_")
+
+
+def _dep_variants(deps):
+    return sorted(set(
+        variant_name(fullname, tuple(extras)) for fullname, extras in deps))
+
+
+def used_variants(resolved_pkgs, resolved_alias):
+    """Returns the extras of all variants of every package that are referred
+    to by dependencies or aliases in any environment, by fullname.
+    """
+    variants = defaultdict(set)
+    for env, pkgs in resolved_pkgs.iteritems():
+        for fullname, pkg in pkgs.iteritems():
+            variants[fullname].add(())
+            deps = pkg["deps"] + sum(pkg["extra"].values(), [])
+            for dep, extras in deps:
+                variants[dep].add(tuple(extras))
+        for spec, _ in resolved_alias.get(env, {}).itervalues():
+            variants[spec.fullname].add(alias_extras(spec))
+    return variants
+
+
+def flat_package(pkg, variants, test_extra):
+    """Returns what the flat template renders of a package: its attributes
+    and the names and propagated build inputs of each of its variants with
+    the given extras, with dependencies referred to by variant name.
+    """
+    extra = pkg["extra"]
+    install_requires = _dep_variants(
+        pkg["deps"] + extra.get("_setup_requires", []))
+
+    model = {
+        "name": pkg["name"],
+        "version": pkg["version"],
+        "url": pkg["src"]["url"].split("#")[0],
+        "algo": pkg["src"]["algo"],
+        "sum": pkg["src"]["sum"],
+        "has_tests": bool(pkg["has_tests"]),
+        "has_circular_deps": bool(pkg["has_circular_deps"]),
+        "build_inputs": _dep_variants(
+            sum((extra.get(section, []) for section in TEST_SECTIONS), [])),
+        "install_requires": install_requires,
+        "variants": [],
+    }
+    for extras in sorted(variants):
+        extras_deps = sum(
+            (extra.get(e, []) for e in extras if e not in test_extra), [])
+        model["variants"].append({
+            "name": variant_name(pkg["fullname"], extras),
+            "propagated": sorted(
+                set(install_requires) | set(_dep_variants(extras_deps))),
+        })
+    return model
+
+
+def flat_packages(resolved_pkgs, resolved_alias, test_extra):
+    """Returns the models of the flat template: the groups of shared packages
+    and the remaining packages of every environment, like
+    `split_shared_packages`, as `flat_package` models.
+    """
+    variants = used_variants(resolved_pkgs, resolved_alias)
+    flat = lambda pkg: flat_package(pkg, variants[pkg["fullname"]], test_extra)
+
+    shared, env_pkgs = split_shared_packages(resolved_pkgs)
+    return [(envs, map(flat, pkgs)) for envs, pkgs in shared], dict(
+        (env, map(flat, pkgs)) for env, pkgs in env_pkgs.iteritems())
+
+
+def json_data(resolved_pkgs, resolved_alias, test_extra):
+    """Returns the data the Nix loader of the json output mode reads: the
+    `flat_packages` models, and the aliases of every environment by name
+    and by extras section, referring to variants by name.
+    """
+    shared, env_pkgs = flat_packages(resolved_pkgs, resolved_alias, test_extra)
+
+    envs = {}
+    for env, pkgs in env_pkgs.iteritems():
+        aliases, by_extra = {}, defaultdict(dict)
+        for name, (spec, source) in resolved_alias.get(env, {}).iteritems():
+            variant = variant_name(spec.fullname, alias_extras(spec))
+            aliases[name] = variant
+            by_extra[source or "default"][name] = variant
+        envs[env] = {
+            "aliases": aliases,
+            "by_extra": dict(by_extra),
+            "packages": pkgs,
+        }
+
+    return {
+        "format": DATA_FORMAT,
+        "shared": [
+            {"envs": list(shared_envs), "packages": pkgs}
+            for shared_envs, pkgs in shared],
+        "envs": envs,
+    }
@@ -0,0 +1,192 @@
+"""
+Interpreter independent package requirements.
+
+Requirements of a package are recorded together with their environment
+markers, so they can be introspected once per package archive and then be
+evaluated cheaply for every interpreter.
+"""
+
+import os
+import re
+import json
+import subprocess
+
+try:
+    from packaging.markers import Marker, InvalidMarker
+except ImportError:
+    try:
+        from pkg_resources.extern.packaging.markers import (  # noqa
+            Marker, InvalidMarker)
+    except ImportError:
+        from .markers import Marker, InvalidMarker  # noqa
+
+from .log import logger
+from .datastructures import Spec
+
+
+# Prints PEP 508 marker variables of the interpreter running it
+_MARKER_ENVIRONMENT_SCRIPT = """
+import json, os, platform, sys
+implementation = getattr(sys, 'implementation', None)
+if implementation is not None:
+    info = implementation.version
+    version = '%d.%d.%d' % (info.major, info.minor, info.micro)
+    if info.releaselevel != 'final':
+        version += info.releaselevel[0] + str(info.serial)
+    name = implementation.name
+else:
+    version = '0'
+    name = platform.python_implementation().lower()
+sys.stdout.write(json.dumps({
+    'implementation_name': name,
+    'implementation_version': version,
+    'os_name': os.name,
+    'platform_machine': platform.machine(),
+    'platform_python_implementation': platform.python_implementation(),
+    'platform_release': platform.release(),
+    'platform_system': platform.system(),
+    'platform_version': platform.version(),
+    'python_full_version': platform.python_version(),
+    'python_version': '.'.join(platform.python_version_tuple()[:2]),
+    'sys_platform': sys.platform,
+}))
+"""
+
+# Marker environments by interpreter, see `get_marker_environment`
+_MARKER_ENVIRONMENTS = {}
+
+# Code in setup.py that makes requirements depend on the interpreter
+_INTERPRETER_BRANCH = re.compile(
+    r"sys\.(hex|sub)?version|version_info|python_version|"
+    r"python_implementation|\bPY(2|3|33|34)\b|[Pp]y[Pp]y")
+
+
+def get_marker_environment(exe, python_path=None):
+    """Returns the values of environment marker variables for the given
+    interpreter, running it only once.
+    """
+    if exe in _MARKER_ENVIRONMENTS:
+        return _MARKER_ENVIRONMENTS[exe]
+
+    env = dict(os.environ)
+    if python_path:
+        env["PYTHONPATH"] = python_path
+    out = subprocess.check_output(
+        [exe, '-c', _MARKER_ENVIRONMENT_SCRIPT], env=env)
+    environment = dict(
+        (str(key), str(value)) for key, value in json.loads(out).iteritems())
+
+    _MARKER_ENVIRONMENTS[exe] = environment
+    return environment
+
+
+def split_marker(line):
+    """Splits a requirement line into the requirement and its environment
+    marker, which is None if there is none.
+    """
+    requirement, _, marker = line.partition(';')
+    return requirement.strip(), marker.strip() or None
+
+
+def evaluate_marker(marker, environment, extra=None):
+    """Returns whether the marker holds in the given marker environment.
+    Markers that can not be parsed are considered to hold.
+    """
+    if not marker:
+        return True
+
+    environment = dict(environment, extra=extra or '')
+    try:
+        return Marker(marker).evaluate(environment)
+    except InvalidMarker:
+        logger.warn("!! Invalid environment marker %s", marker)
+        return True
+
+
+def parse_requires_file(lines):
+    """Parses lines of a requires.txt file into (requirement, section,
+    marker) tuples, keeping requirements of all extras sections.
+
+    Sections are written as `[extra]`, `[extra:marker]` or `[:marker]` for
+    requirements without an extra that only apply in some environments.
+    """
+    requires = []
+    section, section_marker = None, None
+    for line in lines:
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        elif line[0] == "[":
+            section, _, section_marker = line[1:-1].partition(':')
+            section = section or None
+            section_marker = section_marker or None
+            continue
+
+        requirement, marker = split_marker(line)
+        if section_marker and marker:
+            marker = '(%s) and (%s)' % (section_marker, marker)
+        requires.append((requirement, section, marker or section_marker))
+
+    return requires
+
+
+def branches_on_interpreter(setup_py):
+    """Returns whether the source of a setup.py looks like it computes its
+    arguments differently depending on the interpreter.
+    """
+    return bool(_INTERPRETER_BRANCH.search(setup_py))
+
+
+def select_deps(requires, setup_args, extra, environment, name=None):
+    """Selects the dependencies of a package for the given extras and
+    marker environment, like setuptools does when installing it.
+
+    `requires` are the (requirement, section, marker) entries of the
+    package's requires.txt, and `setup_args` a function returning its setup
+    arguments, which is only called when they are needed.  Returns
+    (Spec, section) pairs.
+    """
+    to_list = lambda x: x if isinstance(x, list) else [x]
+    flatten = lambda lst: \
+        sum(([x] if not isinstance(x, list) else flatten(x) for x in lst), [])
+
+    def from_setup_args(args, key, section=None):
+        deps = []
+        for line in flatten(to_list(args.get(key) or [])):
+            requirement, marker = split_marker(str(line))
+            if requirement and evaluate_marker(marker, environment, section):
+                deps.append((requirement, section))
+        return deps
+
+    deps = [
+        (requirement, section) for requirement, section, marker in requires
+        if (section is None or section in extra) and
+        evaluate_marker(marker, environment, section)
+    ]
+
+    # Only run setup.py when its arguments are actually needed
+    if not deps or any(e in extra for e in (
+        "_tests_require", "_setup_requires", "_test_suite"
+    )):
+        args = setup_args() or {}
+    else:
+        args = {}
+
+    # distutils does not provide egg_info
+    if not deps:
+        deps += from_setup_args(args, "install_requires")
+        deps += from_setup_args(args, "requires")
+
+    # This should be written by egg_info, but it's not
+    if "_tests_require" in extra:
+        deps += from_setup_args(args, "tests_require", '_tests_require')
+    # Native dependencies
+    if "_setup_requires" in extra:
+        deps += from_setup_args(args, "setup_requires", '_setup_requires')
+    if "_test_suite" in extra:
+        # Hardcoded nose collector test suite fix
+        if "nose.collector" in (args.get("test_suite") or "") and \
+                name != "nose":
+            deps += [('nose', '_test_suite')]
+
+    return [(Spec.from_line(dep), src) for dep, src in deps if "#" not in dep]
@@ -6,6 +6,7 @@ and included here only to not create a piptools ~> distutils2 dependency.
 """
 
 import re
+from bisect import bisect_left, bisect_right
 
 
 class IrrationalVersionError(Exception):
@@ -344,6 +345,142 @@ def suggest_normalized_version(s):
     return None
 
 
+_LEADING_NUMDOTS = re.compile(r"^\d+(?:\.\d+)*")
+
+# Parsed version keys by version string, see `version_key`
+_VERSION_KEYS = {}
+_VERSION_KEYS_MAX_SIZE = 50000
+
+
+def version_key(s):
+    """Returns a sort key for the given version string, see `parse_version_key`.
+
+    Keys are immutable tuples and interned in a bounded cache, since the same
+    versions get compared over and over again while resolving.
+    """
+    try:
+        return _VERSION_KEYS[s]
+    except KeyError:
+        pass
+
+    key = parse_version_key(s)
+    if len(_VERSION_KEYS) >= _VERSION_KEYS_MAX_SIZE:
+        _VERSION_KEYS.clear()
+    _VERSION_KEYS[s] = key
+    return key
+
+
+def parse_version_key(s):
+    """Parses the given version string into a sort key.
+
+    Rational versions are keyed by their `NormalizedVersion` parts, allowing
+    huge major version numbers.  Irrational versions are keyed by their
+    suggested normalized version or, as a last resort, by their leading
+    numeric segments followed by the rest of the string, which sorts them
+    right after the final release of those segments:
+
+        >>> version_key('1.0') < version_key('2011k') < version_key('2011l')
+        True
+    """
+    try:
+        return NormalizedVersion(s, error_on_huge_major_num=False).parts
+    except IrrationalVersionError:
+        pass
+
+    suggested = suggest_normalized_version(s)
+    if suggested is not None:
+        try:
+            return NormalizedVersion(
+                suggested, error_on_huge_major_num=False).parts
+        except IrrationalVersionError:
+            pass
+
+    match = _LEADING_NUMDOTS.match(s)
+    main = match and tuple(int(n) for n in match.group().split('.')) or ()
+    rest = s[match.end():] if match else s
+    return (main, _FINAL_MARKER,
+            (_FINAL_MARKER[0], rest) if rest else _FINAL_MARKER)
+
+
+def is_final_key(key):
+    """Returns whether the given version key is of a final release, that is
+    neither a pre-release nor a development release.
+    """
+    return key[1] == _FINAL_MARKER and 'dev' not in key[2]
+
+
+class VersionIndex(object):
+    """Releases of a single project, sorted by their version keys.
+
+    Answers which is the highest version satisfying a set of predicates in
+    O(log n + k): the range predicates are bisected into a slice of the
+    releases, which is then scanned from the top, skipping the k versions
+    that are excluded or are pre-releases.
+    """
+
+    def __init__(self, versions):
+        entries = sorted((version_key(v), v) for v in set(versions))
+        self._keys = [key for key, _ in entries]
+        self._versions = [version for _, version in entries]
+
+    def __len__(self):
+        return len(self._versions)
+
+    def __iter__(self):
+        return iter(self._versions)
+
+    def _slice(self, preds):
+        """Returns the bounds of the slice of releases within the range of the
+        given predicates, and the set of excluded version keys.
+        """
+        keys = self._keys
+        lo, hi = 0, len(keys)
+        excluded = set()
+        for qual, version in preds:
+            key = version_key(version)
+            if qual == '==':
+                lo = max(lo, bisect_left(keys, key))
+                hi = min(hi, bisect_right(keys, key))
+            elif qual == '>=':
+                lo = max(lo, bisect_left(keys, key))
+            elif qual == '>':
+                lo = max(lo, bisect_right(keys, key))
+            elif qual == '<=':
+                hi = min(hi, bisect_right(keys, key))
+            elif qual == '<':
+                hi = min(hi, bisect_left(keys, key))
+            elif qual == '!=':
+                excluded.add(key)
+            else:
+                raise ValueError('Unknown qualifier %r' % (qual,))
+        return lo, hi, excluded
+
+    def best_match(self, preds, prereleases=False):
+        """Returns the highest version satisfying all of the given
+        (qualifier, version) predicates, or None if there is none.
+
+        Like pip, final releases are preferred.  Pre-releases are only
+        returned if `prereleases` is set, or if no final release matches.
+        """
+        lo, hi, excluded = self._slice(preds)
+        best_prerelease = None
+        for i in range(hi - 1, lo - 1, -1):
+            key = self._keys[i]
+            if key in excluded:
+                continue
+            if prereleases or is_final_key(key):
+                return self._versions[i]
+            if best_prerelease is None:
+                best_prerelease = self._versions[i]
+        return best_prerelease
+
+    def matches(self, preds):
+        """Returns all versions satisfying the given predicates, ascending."""
+        lo, hi, excluded = self._slice(preds)
+        return [self._versions[i] for i in range(lo, hi)
+                if self._keys[i] not in excluded]
+
+
 # A predicate is: "ProjectName (VERSION1, VERSION2, ..)
 _PREDICATE = re.compile(r"(?i)^\s*(\w[\s\w-]*(?:\.\w*)*)(.*)")
 _VERSIONS = re.compile(r"^\s*\((?P<versions>.*)\)\s*$|^\s*"
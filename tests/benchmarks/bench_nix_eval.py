@@ -0,0 +1,138 @@
+"""Benchmarks evaluating the Nix expression generated for 1000 packages in
+two environments, in the default and the flat output mode.
+
+Evaluation is timed with nix-instantiate against a stub of nixpkgs, if it
+is available.  Otherwise only the size and structure of the outputs are
+compared.
+
+Run with: python -m tests.benchmarks.bench_nix_eval
+"""
+
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+import time
+
+from pypi2nix.cmd import render_generated, flat_template
+from pypi2nix.render import flat_packages, used_variants
+from pypi2nix.render import variant_name
+from tests.unit.fixtures import resolved_packages
+
+COUNT = 1000
+ENVS = ('python27', 'python26')
+REPEAT = 3
+
+# Evaluates all package variants against a minimal stub of nixpkgs
+EVAL_EXPRESSION = """
+let
+  lib = rec {
+    optionalAttrs = cond: set: if cond then set else {};
+    optionalString = cond: s: if cond then s else "";
+    isFunction = builtins.isFunction;
+    head = builtins.head;
+    drop = n: l: builtins.genList
+      (i: builtins.elemAt l (i + n)) (builtins.length l - n);
+    concatStringsSep = builtins.concatStringsSep;
+    attrByPath = attrPath: default: e:
+      if attrPath == [] then e else
+      let attr = head attrPath; in
+        if e ? ${attr}
+        then attrByPath (builtins.tail attrPath) default e.${attr}
+        else default;
+  };
+  flatten = x: if builtins.isList x then builtins.concatMap flatten x else [x];
+
+  pkgs = { inherit lib; fetchurl = args: args; };
+  python = { majorVersion = "2.7"; executable = "python"; };
+  buildPythonPackage = args: args;
+  self = import %(path)s {
+    inherit pkgs python buildPythonPackage self; overrides = {};
+  };
+
+  force = p: p.name + builtins.concatStringsSep " "
+    (map (d: d.name) (flatten p.propagatedBuildInputs));
+  packages = [ %(packages)s ];
+in builtins.stringLength (builtins.concatStringsSep "" (map force packages))
+"""
+
+
+def render(mode, resolved_pkgs, resolved_alias):
+    start = time.time()
+    if mode == 'flat':
+        shared, env_pkgs = flat_packages(
+            resolved_pkgs, resolved_alias, ('test',))
+        result = flat_template.render(
+            resolved_alias=resolved_alias, shared_pkgs=shared,
+            env_pkgs=env_pkgs)
+    else:
+        result = u''.join(render_generated(
+            resolved_pkgs, resolved_alias, ('test',)))
+    return result, time.time() - start
+
+
+def variant_refs(mode, resolved_pkgs, resolved_alias):
+    """Returns Nix expressions of all package variants."""
+    refs = []
+    variants = used_variants(resolved_pkgs, resolved_alias)
+    for fullname, extras_set in sorted(variants.iteritems()):
+        for extras in sorted(extras_set):
+            if mode == 'flat':
+                refs.append('self.by-version."%s"' % variant_name(
+                    fullname, extras))
+            else:
+                refs.append('(self.by-version."%s" [%s])' % (
+                    fullname, ' '.join('"%s"' % e for e in extras)))
+    return refs
+
+
+def evaluate(tmpdir, mode, result, refs):
+    path = os.path.join(tmpdir, '%s.nix' % mode)
+    with open(path, 'w') as f:
+        f.write(result)
+    expr_path = os.path.join(tmpdir, 'eval-%s.nix' % mode)
+    with open(expr_path, 'w') as f:
+        f.write(EVAL_EXPRESSION % dict(path=path, packages=' '.join(refs)))
+
+    timings = []
+    for _ in range(REPEAT):
+        start = time.time()
+        subprocess.check_output(
+            ['nix-instantiate', '--eval', '--strict', expr_path])
+        timings.append(time.time() - start)
+    return min(timings)
+
+
+def has_nix_instantiate():
+    return any(
+        os.access(os.path.join(path, 'nix-instantiate'), os.X_OK)
+        for path in os.environ.get('PATH', '').split(os.pathsep))
+
+
+def main():
+    resolved_pkgs, resolved_alias = resolved_packages(COUNT, ENVS)
+    nix = has_nix_instantiate()
+    if not nix:
+        print('nix-instantiate not found, comparing output structure only')
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        for mode in ('default', 'flat'):
+            result, render_time = render(mode, resolved_pkgs, resolved_alias)
+            calls = len(re.findall(
+                r'callPythonPackage|attrByPathAlternatives|'
+                r'self\.by-version\."[^"]*" \[', result))
+            line = '%-8s %8d bytes  %6d lines  %6d indirect calls  ' \
+                'render %5.2fs' % (mode, len(result), result.count('\n'),
+                                   calls, render_time)
+            if nix:
+                refs = variant_refs(mode, resolved_pkgs, resolved_alias)
+                line += '  eval %5.2fs' % evaluate(tmpdir, mode, result, refs)
+            print(line)
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main()
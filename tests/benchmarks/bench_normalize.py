@@ -0,0 +1,46 @@
+"""Benchmarks SpecSet normalization of names with hundreds of predicates.
+
+Run with: python -m tests.benchmarks.bench_normalize
+"""
+
+import random
+import time
+
+from pypi2nix.datastructures import SpecSet, Spec
+
+PREDICATES = 500
+ROUNDS = 100
+
+
+def make_spec_set(count, seed=0):
+    """Returns a satisfiable spec set with `count` single predicate specs."""
+    rnd = random.Random(seed)
+    spec_set = SpecSet()
+    for _ in range(count):
+        qual = rnd.choice(['>', '>=', '<', '<=', '!='])
+        if qual.startswith('>'):
+            version = '1.%d.%d' % (rnd.randint(0, 9), rnd.randint(0, 99))
+        elif qual.startswith('<'):
+            version = '3.%d.%d' % (rnd.randint(0, 9), rnd.randint(0, 99))
+        else:
+            version = '%d.%d.%d' % (
+                rnd.randint(1, 3), rnd.randint(0, 9), rnd.randint(0, 99))
+        spec_set.add_spec(Spec('django', [(qual, version)], source='bench'))
+    return spec_set
+
+
+def main():
+    spec_set = make_spec_set(PREDICATES)
+
+    start = time.time()
+    for _ in range(ROUNDS):
+        spec = spec_set.normalize_specs_for_name('django')
+    elapsed = time.time() - start
+
+    print('%d predicates -> %d: %.2fms per normalization' % (
+        len(spec_set.explode('django')), len(spec.preds),
+        elapsed * 1000 / ROUNDS))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,48 @@
+"""Benchmarks resolving the `large` fixture graph scaled 10x with simulated
+network and introspection latency, with and without prefetching.
+
+Run with: python -m tests.benchmarks.bench_prefetch
+"""
+
+import logging
+import time
+
+from pypi2nix.log import logger
+from pypi2nix.datastructures import SpecSet
+from pypi2nix.dependency_resolver import DependencyResolver
+from pypi2nix.prefetch import Prefetcher
+from tests.unit.fixtures import SlowPackageManager, large, scale
+
+FACTOR = 10
+FETCH_LATENCY = 0.02
+INTROSPECT_LATENCY = 0.01
+
+
+def run(graph, workers):
+    pkgmgr = SlowPackageManager(graph, FETCH_LATENCY, INTROSPECT_LATENCY)
+    spec_set = SpecSet()
+    spec_set.add_specs('sentry-x%d' % copy for copy in range(FACTOR))
+
+    start = time.time()
+    if workers:
+        with Prefetcher(pkgmgr, workers=workers) as prefetcher:
+            DependencyResolver(spec_set, prefetcher).resolve()
+        hit_rate = '%3.0f%%' % (prefetcher.hit_rate() * 100)
+    else:
+        DependencyResolver(spec_set, pkgmgr).resolve()
+        hit_rate = '-'
+    elapsed = time.time() - start
+
+    print('%d prefetch workers  %6.2fs  hit rate %s' % (
+        workers, elapsed, hit_rate))
+
+
+def main():
+    logger.setLevel(logging.WARNING)
+    graph = scale(large, FACTOR)
+    for workers in (0, 1, 4, 8):
+        run(graph, workers)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+"""Benchmarks rendering the output for 1000 packages in two environments,
+with the default template, also with its sections rendered in parallel,
+and the flat template, against writing the json data of the json output
+mode.
+
+Times include building the models the output is rendered from.
+
+Run with: python -m tests.benchmarks.bench_render
+"""
+
+import json
+import multiprocessing
+import time
+from cStringIO import StringIO
+
+from pypi2nix.cmd import render_generated, flat_template
+from pypi2nix.render import flat_packages, json_data
+from tests.unit.fixtures import resolved_packages
+
+COUNT = 1000
+ENVS = ('python27', 'python26')
+REPEAT = 5
+TEST_EXTRA = ('test',)
+
+
+def render_default(resolved_pkgs, resolved_alias, out):
+    render_generated(
+        resolved_pkgs, resolved_alias, TEST_EXTRA
+    ).dump(out, encoding='utf-8')
+
+
+def render_parallel(resolved_pkgs, resolved_alias, out):
+    render_generated(
+        resolved_pkgs, resolved_alias, TEST_EXTRA, multiprocessing.cpu_count()
+    ).dump(out, encoding='utf-8')
+
+
+def render_flat(resolved_pkgs, resolved_alias, out):
+    shared, env_pkgs = flat_packages(resolved_pkgs, resolved_alias, TEST_EXTRA)
+    flat_template.stream(
+        resolved_alias=resolved_alias, shared_pkgs=shared, env_pkgs=env_pkgs
+    ).dump(out, encoding='utf-8')
+
+
+def render_json(resolved_pkgs, resolved_alias, out):
+    data = json_data(resolved_pkgs, resolved_alias, TEST_EXTRA)
+    json.dump(data, out, indent=1, sort_keys=True)
+
+
+def bench(render, resolved_pkgs, resolved_alias):
+    """Returns the best time of rendering and the size of the output."""
+    timings = []
+    for _ in range(REPEAT):
+        out = StringIO()
+        start = time.time()
+        render(resolved_pkgs, resolved_alias, out)
+        timings.append(time.time() - start)
+    return min(timings), len(out.getvalue())
+
+
+def main():
+    resolved_pkgs, resolved_alias = resolved_packages(COUNT, ENVS)
+    total = sum(len(pkgs) for pkgs in resolved_pkgs.itervalues())
+
+    for mode, render in (('default', render_default),
+                         ('parallel', render_parallel),
+                         ('flat', render_flat),
+                         ('json', render_json)):
+        elapsed, size = bench(render, resolved_pkgs, resolved_alias)
+        print('%-8s %6.3fs  %8.0f packages/s  %8d bytes' % (
+            mode, elapsed, total / elapsed, size))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,46 @@
+"""Benchmarks DependencyResolver on the `large` fixture graph scaled 100x.
+
+Run with: python -m tests.benchmarks.bench_resolver
+"""
+
+import logging
+import time
+
+from pypi2nix.log import logger
+from pypi2nix.datastructures import SpecSet
+from pypi2nix.dependency_resolver import DependencyResolver
+from tests.unit.fixtures import FakePackageManager, large, scale
+
+FACTOR = 100
+
+
+class FullRoundResolver(DependencyResolver):
+    """Expands every name in every round, like the resolver used to."""
+
+    def changed_specs(self):
+        return list(self.spec_set.normalize())
+
+
+def run(resolver_class, graph):
+    pkgmgr = FakePackageManager(graph)
+    spec_set = SpecSet()
+    spec_set.add_specs('sentry-x%d' % copy for copy in range(FACTOR))
+
+    start = time.time()
+    pinned = resolver_class(spec_set, pkgmgr).resolve()
+    elapsed = time.time() - start
+
+    print('%-20s %4d packages  %6d expansions  %7.2fs' % (
+        resolver_class.__name__, len(list(pinned)),
+        pkgmgr.get_dependencies_calls, elapsed))
+
+
+def main():
+    logger.setLevel(logging.WARNING)
+    graph = scale(large, FACTOR)
+    run(DependencyResolver, graph)
+    run(FullRoundResolver, graph)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,43 @@
+"""Measures the memory used by a SpecSet holding 100k specs.
+
+Run with: python -m tests.benchmarks.bench_spec_memory
+"""
+
+import gc
+import resource
+import sys
+import time
+
+from pypi2nix.datastructures import Spec, SpecSet
+
+SPECS = 100000
+
+
+def max_rss_kb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def main():
+    gc.collect()
+    rss_before = max_rss_kb()
+
+    start = time.time()
+    spec_set = SpecSet()
+    for i in range(SPECS):
+        spec_set.add_spec(Spec(
+            'package-%d' % (i % 5000),
+            [('>=', '1.%d' % (i // 5000)), ('<', '3.0')],
+            source='bench'))
+    elapsed = time.time() - start
+
+    rss_after = max_rss_kb()
+    spec = Spec.from_line('foo>=1.0,<3.0')
+    print('%d specs in %.2fs, max RSS grew by %.1fMB (%d bytes per spec)' % (
+        SPECS, elapsed, (rss_after - rss_before) / 1024.0,
+        (rss_after - rss_before) * 1024 / SPECS))
+    print('Spec instance: %d bytes, has __dict__: %s' % (
+        sys.getsizeof(spec), hasattr(spec, '__dict__')))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from mock import patch
+from pypi2nix.caching import PersistentCache, flush_caches
+
+
+class TestPersistentCache(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'cache.pickle')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_persistent(self):
+        cache = PersistentCache(self.path)
+        cache['a'] = 1
+        self.assertFalse(os.path.exists(self.path))
+        cache.flush()
+        self.assertEqual(PersistentCache(self.path)['a'], 1)
+        self.assertEqual(
+            [name for name in os.listdir(self.tmpdir)
+             if not name.endswith('.lock')], ['cache.pickle'])
+
+    def test_merge(self):
+        """Writers sharing a file keep each others entries."""
+        cache1 = PersistentCache(self.path)
+        cache2 = PersistentCache(self.path)
+        self.assertNotIn('a', cache1)
+        self.assertNotIn('b', cache2)
+
+        cache1['a'] = 1
+        cache1.flush()
+        cache2['b'] = 2
+        cache2['a'] = 3
+        cache2.flush()
+
+        cache = PersistentCache(self.path)
+        self.assertEqual(cache['a'], 3)
+        self.assertEqual(cache['b'], 2)
+        self.assertEqual(cache2.get('a'), 3)
+
+    def test_empty_cache(self):
+        cache = PersistentCache(self.path)
+        cache.update({'a': 1})
+        cache.empty_cache()
+        self.assertNotIn('a', cache)
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_threads(self):
+        """Keys set by several threads are all written."""
+        cache = PersistentCache(self.path)
+
+        def fill(start):
+            for i in range(start, start + 50):
+                cache[i] = i
+
+        threads = [threading.Thread(target=fill, args=(start,))
+                   for start in range(0, 200, 50)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        cache.flush()
+
+        self.assertEqual(
+            sorted(k for k in PersistentCache(self.path).cache
+                   if k != '__format__'), range(200))
+
+    def test_flush_once(self):
+        """Keys are only written once, entries written by others later on
+        are kept.
+        """
+        cache1 = PersistentCache(self.path)
+        cache2 = PersistentCache(self.path)
+        cache1['a'] = 1
+        cache1.flush()
+        cache2.update({'a': 2})
+
+        with patch.object(PersistentCache, 'write_cache') as write_cache:
+            cache1.flush()
+        self.assertFalse(write_cache.called)
+
+        cache1['b'] = 3
+        cache1.flush()
+        self.assertEqual(PersistentCache(self.path)['a'], 2)
+
+    def test_flush_caches(self):
+        caches = {'persistent': PersistentCache(self.path), 'plain': {}}
+        caches['persistent']['a'] = 1
+        caches['plain']['a'] = 1
+        flush_caches(caches)
+        self.assertEqual(PersistentCache(self.path)['a'], 1)
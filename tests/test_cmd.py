@@ -1,6 +1,10 @@
+import os
+import shutil
+import tempfile
 import unittest
 
-from pypi2nix.cmd import parse_specline
+from jinja2 import Template
+from pypi2nix.cmd import parse_specline, write_output, write_json
 
 
 class TestParseSpecline(unittest.TestCase):
@@ -113,3 +117,43 @@ class TestParseSpecline(unittest.TestCase):
                 "overrides": {"package": {"deps_append": ["dep3==1.2"]}}
             }
         })
+
+
+class TestWriteOutput(unittest.TestCase):
+    template = Template(
+        '{% for name in names %}{{ name }}\n{% endfor %}'
+        '{% if fail %}{{ fail() }}{% endif %}')
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'out.nix')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_write(self):
+        write_output(self.path, self.template.stream(names=['a', u'\xe9']))
+        with open(self.path) as f:
+            self.assertEqual(f.read(), 'a\n\xc3\xa9\n')
+
+    def test_failed_render(self):
+        """A failing render leaves the previous output in place."""
+        with open(self.path, 'w') as f:
+            f.write('old')
+
+        def fail():
+            raise ValueError('render failed')
+
+        with self.assertRaises(ValueError):
+            write_output(
+                self.path, self.template.stream(names=['a'], fail=fail))
+        with open(self.path) as f:
+            self.assertEqual(f.read(), 'old')
+        self.assertEqual(os.listdir(self.tmpdir), ['out.nix'])
+
+    def test_write_json(self):
+        write_json(self.path, {'b': [1, 2], 'a': 'x'})
+        with open(self.path) as f:
+            self.assertEqual(
+                f.read(), '{\n "a": "x", \n "b": [\n  1, \n  2\n ]\n}\n')
+
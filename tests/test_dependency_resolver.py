@@ -0,0 +1,186 @@
+import unittest
+
+from pypi2nix.datastructures import SpecSet, ResolvedGraph
+from pypi2nix.dependency_resolver import DependencyResolver, ClosureCache
+from tests.unit.fixtures import FakePackageManager, simple, large, scale
+
+
+class TestDependencyResolver(unittest.TestCase):
+    def resolve(self, graph, *specs):
+        pkgmgr = FakePackageManager(graph)
+        spec_set = SpecSet()
+        spec_set.add_specs(specs)
+        resolver = DependencyResolver(spec_set, pkgmgr)
+        return resolver, pkgmgr, resolver.resolve()
+
+    def test_resolve_simple(self):
+        """A simple scenario for finding dependencies."""
+        _, _, pinned = self.resolve(simple, 'foo')
+        self.assertItemsEqual(
+            ['foo==0.1', 'bar==1.2', 'qux==0.1', 'simplejson==2.4.0'],
+            map(str, pinned))
+
+    def test_resolve_large(self):
+        _, _, pinned = self.resolve(large, 'sentry')
+        pinned = dict((spec.name, spec.pinned) for spec in pinned)
+        self.assertEqual(pinned['django'], '1.4.1')
+        self.assertEqual(pinned['kombu'], '2.4.7')
+        self.assertEqual(pinned['django-social-auth'], '0.7.2')
+        self.assertEqual(pinned['httplib'], '0.7.6')
+        self.assertEqual(len(pinned), 28)
+
+    def test_expands_only_changed_names(self):
+        """Names are only expanded again when their normalized spec changes"""
+        resolver, pkgmgr, _ = self.resolve(simple, 'foo')
+
+        # foo, bar and qux once, simplejson twice: first unconstrained from
+        # bar, then again once qux narrows it down to <2.6
+        self.assertEqual(pkgmgr.get_dependencies_calls, 5)
+        self.assertEqual(str(resolver._expanded['simplejson']),
+                         'simplejson<2.6')
+
+    def test_resolve_graph(self):
+        """The resolved graph carries dependencies of every pinned package,
+        reusing what was found while expanding.
+        """
+        pkgmgr = FakePackageManager(simple)
+        spec_set = SpecSet()
+        spec_set.add_spec('foo')
+        graph = DependencyResolver(spec_set, pkgmgr).resolve_graph()
+
+        self.assertEqual(
+            ['bar==1.2', 'foo==0.1', 'qux==0.1', 'simplejson==2.4.0'],
+            map(str, graph.pinned))
+        self.assertEqual(graph['foo'].version, '0.1')
+        self.assertEqual(['bar'], [str(dep) for dep, _ in graph['foo'].deps])
+        self.assertItemsEqual(
+            ['qux', 'simplejson'], [str(dep) for dep, _ in graph['bar'].deps])
+        self.assertEqual(graph['simplejson'].deps, [])
+        self.assertEqual(pkgmgr.get_dependencies_calls, 5)
+        self.assertEqual(pkgmgr.find_best_match_calls, 5)
+
+    def test_scaled_graph(self):
+        graph = scale(large, 3)
+        _, pkgmgr, pinned = self.resolve(
+            graph, 'sentry-x0', 'sentry-x1', 'sentry-x2')
+        self.assertEqual(len(list(pinned)), 3 * 28)
+        self.assertEqual(pkgmgr.get_dependencies_calls, 3 * 28)
+
+
+class TestClosureCache(unittest.TestCase):
+    def resolve(self, graph, closures, *specs):
+        pkgmgr = FakePackageManager(graph)
+        spec_set = SpecSet()
+        spec_set.add_specs(specs)
+        resolver = DependencyResolver(spec_set, pkgmgr, closures=closures)
+        return pkgmgr, resolver.resolve()
+
+    def test_graft(self):
+        """A known closure is grafted without asking the package manager
+        for dependencies of its members.
+        """
+        cache = {}
+        _, pinned = self.resolve(large, ClosureCache(cache), 'sentry')
+        pkgmgr, grafted = self.resolve(large, ClosureCache(cache), 'sentry')
+        self.assertEqual(map(str, grafted), map(str, pinned))
+        self.assertEqual(pkgmgr.get_dependencies_calls, 0)
+
+    def test_shared_subtree(self):
+        """Closures of dependencies are grafted into other resolutions."""
+        cache = {}
+        self.resolve(large, ClosureCache(cache), 'sentry')
+        pkgmgr, pinned = self.resolve(large, ClosureCache(cache), 'kombu')
+        self.assertEqual(
+            ['amqplib==1.0.2', 'anyjson==0.3.3', 'kombu==3.0.0'],
+            map(str, pinned))
+        self.assertEqual(pkgmgr.get_dependencies_calls, 1)
+
+    def test_fingerprint(self):
+        cache = {}
+        self.resolve(large, ClosureCache(cache, fingerprint='a'), 'sentry')
+        pkgmgr, _ = self.resolve(
+            large, ClosureCache(cache, fingerprint='b'), 'sentry')
+        self.assertEqual(pkgmgr.get_dependencies_calls, 28)
+
+    def test_invalidation(self):
+        """Members whose dependencies changed are expanded again."""
+        cache = {}
+        self.resolve(simple, ClosureCache(cache), 'foo')
+
+        graph = dict(simple, **{'qux-0.1': ['simplejson<2.6', 'six']})
+        graph['six-1.0'] = []
+        validate = FakePackageManager(graph).get_dependencies
+        pkgmgr, pinned = self.resolve(
+            graph, ClosureCache(cache, validate=validate), 'foo')
+        self.assertIn('six==1.0', map(str, pinned))
+        # qux, six and the newest simplejson, which bar asks for before the
+        # changed qux narrows it down to <2.6
+        self.assertEqual(pkgmgr.get_dependencies_calls, 3)
+
+    def test_context_dependent_versions(self):
+        """Members are grafted with their best match in the resolution they
+        are grafted into, not the one their closure was stored from.
+        """
+        graph = {
+            'a-1.0': ['b'], 'd-1.0': ['b<2'],
+            'b-1.0': ['c<2'], 'b-3.0': ['c>=3'],
+            'c-1.0': [], 'c-3.0': [],
+        }
+        cache = {}
+        self.resolve(graph, ClosureCache(cache), 'a', 'd')
+        _, pinned = self.resolve(graph, ClosureCache(cache), 'a')
+        self.assertEqual(['a==1.0', 'b==3.0', 'c==3.0'], map(str, pinned))
+
+    def test_stores_dependencies_once(self):
+        """Only the dependencies of every package are stored, not a closure
+        per package.
+        """
+        cache = {}
+        self.resolve(large, ClosureCache(cache), 'sentry')
+        self.assertEqual(len(cache), 28)
+        deps = cache[('sentry', '5.0.14', (), None)]
+        self.assertIn('django>=1.4.1,<=1.5', [str(dep) for dep, _ in deps])
+
+
+class TestIncrementalResolution(unittest.TestCase):
+    def resolve(self, graph, previous=None):
+        pkgmgr = FakePackageManager(graph)
+        spec_set = SpecSet()
+        spec_set.add_spec('sentry')
+        resolver = DependencyResolver(spec_set, pkgmgr, previous=previous)
+        return pkgmgr, resolver.resolve_graph()
+
+    def without(self, graph, name):
+        """Returns a copy of the resolved graph without the named node."""
+        copy = ResolvedGraph()
+        for node in graph:
+            if node.name != name:
+                copy.add(node.spec, node.deps)
+        return copy
+
+    def test_unchanged(self):
+        _, previous = self.resolve(large)
+        pkgmgr, graph = self.resolve(large, previous)
+        self.assertEqual(map(str, graph.pinned), map(str, previous.pinned))
+        self.assertEqual(pkgmgr.find_best_match_calls, 0)
+        self.assertEqual(pkgmgr.get_dependencies_calls, 0)
+
+    def test_version_bump(self):
+        """Only the bumped package and what its new dependencies affect are
+        resolved again.
+        """
+        _, previous = self.resolve(large)
+        bumped = dict(large, **{
+            'kombu-2.4.8': ['anyjson>=0.3.3', 'amqplib>=1.1'],
+            'amqplib-1.1.0': [],
+            'Django-1.4.2': [],
+        })
+        pkgmgr, graph = self.resolve(bumped, self.without(previous, 'kombu'))
+
+        pinned = dict((spec.name, spec.pinned) for spec in graph.pinned)
+        self.assertEqual(pinned['kombu'], '2.4.8')
+        self.assertEqual(pinned['amqplib'], '1.1.0')
+        # Newer releases of unaffected packages are not picked up
+        self.assertEqual(pinned['django'], '1.4.1')
+        self.assertEqual(len(pinned), 28)
+        self.assertEqual(pkgmgr.get_dependencies_calls, 2)
@@ -0,0 +1,129 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from mock import patch
+from pypi2nix.caching import fingerprint, hashabledict
+from pypi2nix.datastructures import Spec, SpecSet
+from pypi2nix.lockfile import write_lockfile, read_lockfile, LockedPackages
+from pypi2nix.package_manager import PackageManager
+from pip.index import Link
+
+
+def make_pkg(name, version, requires=(), extras=(), overrides=None):
+    fullname = '%s-%s' % (name, version)
+    return {
+        "name": name, "fullname": fullname, "version": version,
+        "extras": list(extras),
+        "src": {"url": "http://example.com/%s.tar.gz" % fullname,
+                "algo": "md5", "sum": "abc123"},
+        "deps": [], "extra": {},
+        "requires": [(line, None) for line in requires],
+        "links": [],
+        "pkg_info": {"has_tests": False, "Home-page": "http://example.com"},
+        "overrides": fingerprint(overrides),
+    }
+
+
+class TestLockfile(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'lock.json')
+
+        pkgs = {
+            'foo-1.0': make_pkg('foo', '1.0', ['bar>=1.0']),
+            'bar-1.2': make_pkg('bar', '1.2'),
+            'bar-2.0': make_pkg('bar', '2.0'),
+        }
+        pkgs['foo-1.0']["deps"] = [('bar-1.2', ())]
+        pkgs['foo-1.0']["links"] = ['http://example.com/links/']
+        alias = {'foo': (Spec.from_pinned('foo', '1.0'), None)}
+        write_lockfile(self.path, {'python27': pkgs}, {'python27': alias})
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_round_trip(self):
+        locked = read_lockfile(self.path)
+        self.assertEqual(locked.keys(), ['python27'])
+        self.assertEqual(
+            sorted(locked['python27']), ['bar-1.2', 'bar-2.0', 'foo-1.0'])
+        self.assertEqual(locked['python27']['foo-1.0']["deps"], [['bar-1.2', []]])
+
+    def test_missing(self):
+        self.assertEqual(read_lockfile(self.path + '.missing'), {})
+
+    def test_locked_packages(self):
+        locked = LockedPackages(read_lockfile(self.path)['python27'])
+        self.assertEqual(locked.best_match(Spec.from_line('bar<2.0'), None), '1.2')
+        self.assertEqual(locked.best_match(Spec.from_line('bar'), None), '2.0')
+        self.assertIsNone(locked.best_match(Spec.from_line('bar>2.0'), None))
+        self.assertIsNone(locked.best_match(Spec.from_line('qux'), None))
+
+        deps = locked.get_dependencies('foo', '1.0', (), None)
+        self.assertEqual([(str(dep), section) for dep, section in deps],
+                         [('bar>=1.0', None)])
+        self.assertIsNone(locked.get_dependencies('foo', '1.0', ('x',), None))
+        self.assertIsNone(
+            locked.get_dependencies('foo', '1.0', (), {'new_deps': ('qux',)}))
+
+    def test_graph(self):
+        """Names locked in several versions, with other overrides or bumped
+        in versions are left out of the locked graph.
+        """
+        locked = LockedPackages(read_lockfile(self.path)['python27'])
+        self.assertEqual(map(str, locked.graph().pinned), ['foo==1.0'])
+        self.assertEqual(
+            [str(dep) for dep, _ in locked.graph()['foo'].deps], ['bar>=1.0'])
+
+        versions = SpecSet([Spec.from_pinned('foo', '1.1')])
+        self.assertEqual(len(locked.graph(versions=versions)), 0)
+        self.assertEqual(len(locked.graph({'foo': {'src': 'foo.zip'}})), 0)
+
+    def test_package_manager(self):
+        """Locked packages are neither looked up on the index, nor
+        downloaded or introspected.
+        """
+        pkgmgr = PackageManager(locked=read_lockfile(self.path)['python27'])
+        with patch.object(PackageManager, '_find_link') as find_link, \
+                patch.object(PackageManager, 'get_package') as get_package:
+            version = pkgmgr.find_best_match(Spec.from_line('foo'))
+            deps = pkgmgr.get_dependencies('foo', version)
+            link = pkgmgr.get_link('foo', version)[0]
+            self.assertEqual(pkgmgr.get_hash(link), ('md5', 'abc123'))
+            self.assertFalse(pkgmgr.get_pkg_info('foo', version)["has_tests"])
+        self.assertEqual(version, '1.0')
+        self.assertEqual([str(dep) for dep, _ in deps], ['bar>=1.0'])
+        self.assertEqual(link.url, 'http://example.com/foo-1.0.tar.gz')
+        self.assertEqual(
+            pkgmgr.get_dependency_links('foo', version),
+            ['http://example.com/links/'])
+        self.assertIn(
+            'http://example.com/links/', pkgmgr.finder.dependency_links)
+        self.assertFalse(find_link.called)
+        self.assertFalse(get_package.called)
+
+    def test_package_manager_overrides(self):
+        """Packages locked with other overrides are looked up again."""
+        pkgmgr = PackageManager(
+            overrides={'foo': hashabledict(src='http://example.com/foo.zip')},
+            locked=read_lockfile(self.path)['python27'])
+        locked = pkgmgr.locked
+        link = Link('http://example.com/foo-1.0.tar.gz')
+        self.assertIsNone(locked.get('foo', '1.0', pkgmgr.overrides['foo']))
+        self.assertIsNone(locked.get_hash(link.url, pkgmgr.overrides))
+        self.assertEqual(locked.get_hash(link.url, {}), ('md5', 'abc123'))
+
+        self.assertIsNone(
+            locked.best_match(Spec.from_line('foo'), pkgmgr.overrides['foo']))
+
+        # The link is found again, even with a cold link cache
+        with patch.object(PackageManager, '_find_candidate_link') as find, \
+                patch.object(PackageManager, 'get_package') as get_package:
+            find.return_value = (link, '1.0')
+            self.assertEqual(pkgmgr.get_link('foo', '1.0'), (link, '1.0'))
+            get_package.return_value.get_pkginfo.return_value = {}
+            pkgmgr.get_pkg_info('foo', '1.0')
+        self.assertTrue(find.called)
+        self.assertTrue(get_package.called)
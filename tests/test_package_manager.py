@@ -1,13 +1,16 @@
 import os
 import tempfile
+import threading
 import unittest
 import shutil
+import tarfile
 import textwrap
 import mock
 import pypi2nix
 
 from mock import patch, Mock
-from pypi2nix.package_manager import Package, PackageManager
+from pypi2nix.package_manager import (
+    Package, PackageManager, CandidateFinder, prune_extracted)
 from pypi2nix.datastructures import Spec
 from pypi2nix.caching import hashabledict
 from pip.index import Link
@@ -70,6 +73,28 @@ class TestPackage(unittest.TestCase):
             self.assertEqual(package.version, "1.2.3")
             self.assertEqual(package.dist_dir, m)
 
+    def test_init_from_name_version(self):
+        with mockPackage(
+            setup="""
+            from setuptools import setup
+            setup(name="other", version="0.0.1")
+            """
+        ) as m:
+            with patch.object(Package, '_get_package_setup_arguments') as mock_method:
+                package = Package(name="ABC", version="1.2.3", dist_dir=m)
+                self.assertEqual(package.name, "abc")
+                self.assertEqual(package.version, "1.2.3")
+                self.assertFalse(mock_method.called)
+
+    def test_init_is_lazy(self):
+        with mockPackage(indir="abc-1.2.3") as m:
+            with patch.object(Package, '_get_name_version') as mock_method:
+                mock_method.return_value = ("abc", "1.2.3")
+                package = Package(package_dir=m)
+                self.assertFalse(mock_method.called)
+                self.assertEqual(package.version, "1.2.3")
+                self.assertEqual(mock_method.call_count, 1)
+
     def test_get_deps(self):
         with mockPackage(
             setup="""
@@ -304,6 +329,20 @@ class TestPackageManager(unittest.TestCase):
             )
             pkgmgr.get_package.assert_called_with(spec)
 
+    def test_get_package_known_name_version(self):
+        """Tests if packages from the manager skip name detection"""
+        with mockPackage(indir="abc-1.2.3") as m:
+            spec = Spec.from_line("abc==1.2.3")
+            pkgmgr = PackageManager()
+            pkgmgr._get_or_download_package = Mock(return_value="abc.tar.gz")
+            pkgmgr._extract = Mock(return_value=m)
+
+            with patch.object(Package, '_get_package_setup_arguments') as mock_method:
+                package = pkgmgr.get_package(spec)
+                self.assertEqual(package.name, "abc")
+                self.assertEqual(package.version, "1.2.3")
+                self.assertFalse(mock_method.called)
+
     def test_get_dependencies_cache(self):
         """Tests if dependency cache works"""
         with mockPackage(
@@ -349,8 +388,14 @@ class TestPackageManager(unittest.TestCase):
             pkgmgr = PackageManager(
                 dependency_hook=dependency_hook, overrides={"abc": override})
             pkgmgr.get_package = Mock(return_value=package)
+            pkgmgr.get_link = Mock(return_value=(
+                Link("http://foo.com/abc-1.2.3.tar.gz#md5=abc123"), "1.2.3"))
             deps = pkgmgr.get_dependencies(spec.name, spec.pinned)
-            dependency_hook.assert_called_with(override, spec, deps, package)
+
+            # The package is passed lazily, so it is only extracted if used
+            (o, s, d, p), _ = dependency_hook.call_args
+            self.assertEqual((o, s, d), (override, spec, deps))
+            self.assertEqual(p.dist_dir, package.dist_dir)
 
     def test_get_versions(self):
         """Tests if getting picked versions works"""
@@ -416,3 +461,119 @@ class TestPackageManager(unittest.TestCase):
             link = pkgmgr.get_link("foo", "1.1")
 
             self.assertEqual(mock_method.return_value, link)
+
+    def test_find_best_match_candidates(self):
+        """Tests if known releases are used instead of querying the index"""
+        pkgmgr = PackageManager()
+        pkgmgr._version_cache[("foo", ())] = [
+            ("1.1", Link("http://foo.com/foo-1.1.tar.gz#md5=hash11")),
+            ("1.0", Link("http://foo.com/foo-1.0.tar.gz#md5=hash10")),
+            ("2.0b1", Link("http://foo.com/foo-2.0b1.tar.gz#md5=hash2")),
+        ]
+
+        with patch.object(pypi2nix.package_manager.PackageFinder, 'find_requirement') as mock_method:
+            self.assertEqual(pkgmgr.find_best_match(Spec.from_line("foo")), "1.1")
+            self.assertEqual(
+                pkgmgr.find_best_match(Spec.from_line("foo<1.1")), "1.0")
+            self.assertEqual(
+                pkgmgr.find_best_match(Spec.from_line("foo>1.1")), "2.0b1")
+            self.assertEqual(
+                pkgmgr.get_link("foo", "1.0"),
+                (Link("http://foo.com/foo-1.0.tar.gz#md5=hash10"), "1.0"))
+            self.assertFalse(mock_method.called)
+
+    def test_find_candidates_threads(self):
+        """Threads sharing a finder get the releases of their own project,
+        also while others are looking up releases.
+        """
+        finder = PackageManager().finder
+        sorted_versions = dict(
+            (name, threading.Event()) for name in ('foo', 'bar'))
+
+        def find_requirement(self, req, upgrade):
+            name = req.name
+            self._sort_versions([
+                ('1.0', Link('http://%s.com/%s-1.0.tar.gz' % (name, name)),
+                 '1.0')])
+            sorted_versions[name].set()
+            other, = set(sorted_versions) - set([name])
+            sorted_versions[other].wait(5)
+
+        results = {}
+
+        def find(name):
+            results[name] = finder.find_candidates(name)
+
+        with patch.object(CandidateFinder, 'find_requirement', find_requirement):
+            threads = [threading.Thread(target=find, args=(name,))
+                       for name in sorted_versions]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        for name in sorted_versions:
+            (version, link), = results[name]
+            self.assertEqual(link.url, 'http://%s.com/%s-1.0.tar.gz' % (
+                name, name))
+
+    def test_extract(self):
+        """Tests if archives are extracted once into private views"""
+        tmpdir = tempfile.mkdtemp()
+        try:
+            src = os.path.join(tmpdir, "abc-1.0")
+            os.makedirs(os.path.join(src, "abc"))
+            for path in ("setup.py", "abc/__init__.py"):
+                with open(os.path.join(src, path), "w") as f:
+                    f.write("# %s" % path)
+            archive = os.path.join(tmpdir, "abc-1.0.tar.gz")
+            with tarfile.open(archive, "w:gz") as tar:
+                tar.add(src, "abc-1.0")
+
+            views = []
+            for _ in range(2):
+                pkgmgr = PackageManager(download_cache_root=tmpdir)
+                pkgmgr._unpack_archive = Mock(wraps=pkgmgr._unpack_archive)
+                views.append(pkgmgr._extract(archive))
+            self.assertNotEqual(views[0], views[1])
+            self.assertFalse(pkgmgr._unpack_archive.called)
+
+            package = Package(package_dir=views[1])
+            self.assertEqual(package.read_file("setup.py"), "# setup.py")
+
+            # Files rewritten in place by setup.py do not reach the pristine
+            # tree other views are created from
+            with open(os.path.join(views[0], "abc-1.0/abc/__init__.py"),
+                      "w") as f:
+                f.write("changed")
+            view = PackageManager(download_cache_root=tmpdir)._extract(archive)
+            with open(os.path.join(view, "abc-1.0/abc/__init__.py")) as f:
+                self.assertEqual(f.read(), "# abc/__init__.py")
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_prune_extracted(self):
+        """Extracted archives that were not used recently are removed"""
+        tmpdir = tempfile.mkdtemp()
+        try:
+            archive = os.path.join(tmpdir, "abc-1.0.tar.gz")
+            with tarfile.open(archive, "w:gz") as tar:
+                tar.add(__file__, "abc-1.0/setup.py")
+            pkgmgr = PackageManager(download_cache_root=tmpdir)
+            pristine_dir = pkgmgr._get_pristine_tree(archive)
+
+            prune_extracted(tmpdir, 60)
+            self.assertTrue(os.path.isdir(pristine_dir))
+
+            # Using the tree again marks it as used
+            os.utime(pristine_dir, (0, 0))
+            pkgmgr._get_pristine_tree(archive)
+            prune_extracted(tmpdir, 60)
+            self.assertTrue(os.path.isdir(pristine_dir))
+
+            os.utime(pristine_dir, (0, 0))
+            prune_extracted(tmpdir, 60)
+            self.assertFalse(os.path.exists(pristine_dir))
+            self.assertTrue(os.path.exists(archive))
+        finally:
+            shutil.rmtree(tmpdir)
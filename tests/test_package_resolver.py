@@ -0,0 +1,262 @@
+import random
+import unittest
+
+from mock import patch, Mock
+from pypi2nix.datastructures import Spec, ConflictError
+from pypi2nix.package_resolver import PackageResolver, break_circular_deps
+
+NODES = 10000
+
+
+def make_packages(edges, extra_edges=()):
+    """Returns a packages dict, like the one built by PackageResolver, for
+    the given (package, dependency) edges.
+    """
+    packages = {}
+    for name, dep in list(edges) + list(extra_edges):
+        for n in (name, dep):
+            packages.setdefault(n, {
+                "fullname": n, "deps": [], "extra": {},
+                "has_circular_deps": False})
+    for name, dep in edges:
+        packages[name]["deps"].append((dep, ()))
+    for name, dep in extra_edges:
+        packages[name]["extra"].setdefault("tests", []).append((dep, ()))
+    return packages
+
+
+def all_edges(packages):
+    return set(
+        (name, dep) for name, pkg in packages.iteritems()
+        for dep, _ in pkg["deps"] + sum(pkg["extra"].values(), []))
+
+
+def reachable(adjacency, start):
+    seen = set([start])
+    todo = [start]
+    while todo:
+        for dep in adjacency[todo.pop()]:
+            if dep not in seen:
+                seen.add(dep)
+                todo.append(dep)
+    return seen
+
+
+def is_acyclic(packages):
+    """Kahn's algorithm, succeeds in removing all nodes only for a DAG."""
+    adjacency = dict((name, []) for name in packages)
+    indegree = dict((name, 0) for name in packages)
+    for name, dep in all_edges(packages):
+        adjacency[name].append(dep)
+        indegree[dep] += 1
+    queue = [name for name, degree in indegree.iteritems() if degree == 0]
+    removed = 0
+    while queue:
+        name = queue.pop()
+        removed += 1
+        for dep in adjacency[name]:
+            indegree[dep] -= 1
+            if indegree[dep] == 0:
+                queue.append(dep)
+    return removed == len(packages)
+
+
+class TestBreakCircularDeps(unittest.TestCase):
+    def test_no_cycles(self):
+        edges = [('a', 'b'), ('b', 'c'), ('a', 'c')]
+        packages = make_packages(edges)
+        break_circular_deps(packages, ['a'])
+        self.assertEqual(all_edges(packages), set(edges))
+        self.assertFalse(
+            any(pkg["has_circular_deps"] for pkg in packages.values()))
+
+    def test_cycle(self):
+        packages = make_packages([('a', 'b'), ('b', 'c'), ('c', 'a')])
+        break_circular_deps(packages, ['a'])
+        self.assertEqual(all_edges(packages), set([('a', 'b'), ('b', 'c')]))
+        self.assertTrue(packages['c']["has_circular_deps"])
+        self.assertFalse(packages['a']["has_circular_deps"])
+
+    def test_cross_edge_in_cycle(self):
+        """Only back edges are removed, dependencies between packages of
+        the same cycle that do not close it are kept.
+        """
+        packages = make_packages(
+            [('a', 'b'), ('b', 'a'), ('a', 'c'), ('c', 'b')])
+        break_circular_deps(packages, ['a'])
+        self.assertEqual(
+            all_edges(packages), set([('a', 'b'), ('a', 'c'), ('c', 'b')]))
+        self.assertTrue(packages['b']["has_circular_deps"])
+        self.assertFalse(packages['c']["has_circular_deps"])
+
+    def test_cycle_in_extra(self):
+        packages = make_packages([('a', 'b')], extra_edges=[('b', 'a')])
+        break_circular_deps(packages, ['a'])
+        self.assertEqual(packages['b']["extra"]["tests"], [])
+        self.assertTrue(packages['b']["has_circular_deps"])
+
+    def test_large_ring(self):
+        """A single cycle through all packages loses exactly one edge."""
+        edges = [('p%d' % i, 'p%d' % ((i + 1) % NODES)) for i in range(NODES)]
+        packages = make_packages(edges)
+        break_circular_deps(packages, ['p0'])
+        self.assertEqual(
+            all_edges(packages), set(edges) - set([('p%d' % (NODES - 1), 'p0')]))
+
+    def test_large_random(self):
+        """Random graphs become acyclic, removing only edges that are part
+        of a cycle.
+        """
+        rnd = random.Random(0)
+        names = ['p%d' % i for i in range(NODES)]
+        # A DAG along the names, plus a number of edges pointing back
+        edges = set((names[i], names[rnd.randint(i + 1, NODES - 1)])
+                    for i in range(NODES - 1) for _ in range(3))
+        back_edges = set((names[i], names[rnd.randint(0, i - 1)])
+                         for i in rnd.sample(range(1, NODES), 200))
+        packages = make_packages(edges, extra_edges=back_edges)
+
+        original = all_edges(packages)
+        break_circular_deps(packages, [names[0]])
+        self.assertTrue(is_acyclic(packages))
+        kept = all_edges(packages)
+        self.assertTrue(kept <= original)
+
+        adjacency = dict((name, set()) for name in packages)
+        for name, dep in original:
+            adjacency[name].add(dep)
+        for name, dep in original - kept:
+            self.assertIn(name, reachable(adjacency, dep))
+
+
+class TestResolve(unittest.TestCase):
+    def test_flush_caches(self):
+        """Caches are written once per run, also when it fails."""
+        cache = {'dep_cache': Mock()}
+        resolver = PackageResolver(cache=cache)
+        with patch.object(PackageResolver, '_resolve',
+                          side_effect=ConflictError('conflict')), \
+                patch('pypi2nix.package_resolver.flush_caches') as flush:
+            self.assertRaises(ConflictError, resolver.resolve, [])
+        flush.assert_called_once_with(cache)
+
+
+class TestResolveMany(unittest.TestCase):
+    graph = {
+        'a': ['django', 'six'],
+        'b': ['django'],
+        'c': ['six'],
+        'django': [],
+        'six': [],
+        'p': ['q'],
+        'q': ['p'],
+    }
+
+    def fake_resolve(self, specs, versions=(), overrides={}, **kwargs):
+        """Resolves the specs in `graph`, pinning everything to 1.0."""
+        names = set(spec.name for spec, _ in specs)
+        if set(['b', 'c']) <= names:
+            raise ConflictError('Conflict: b with c')
+        self.resolved.append(sorted(names))
+
+        packages = {}
+        todo = list(names)
+        while todo:
+            name = todo.pop()
+            if name + '-1.0' in packages:
+                continue
+            packages[name + '-1.0'] = {
+                "name": name, "fullname": name + '-1.0', "extra": {},
+                "deps": [(dep + '-1.0', ()) for dep in self.graph[name]]}
+            todo.extend(self.graph[name])
+        alias = dict(
+            (spec.name, (Spec.from_pinned(spec.name, '1.0'), src))
+            for spec, src in specs)
+        return packages, alias
+
+    def resolve_many(self, *entries, **kwargs):
+        self.resolved = []
+        resolver = PackageResolver()
+        with patch.object(PackageResolver, 'resolve', self.fake_resolve):
+            return resolver.resolve_many([
+                (name, Spec.from_line(name), versions, overrides)
+                for name, versions, overrides in entries], **kwargs)
+
+    def test_batch(self):
+        """Entries with the same versions and overrides are resolved at once,
+        and every package lists the entries needing it.
+        """
+        pkgs, alias = self.resolve_many(('a', None, None), ('b', [], {}))
+        self.assertEqual(self.resolved, [['a', 'b']])
+        self.assertEqual(pkgs['django-1.0']["packages"], ['a', 'b'])
+        self.assertEqual(pkgs['six-1.0']["packages"], ['a'])
+        self.assertEqual(sorted(alias), ['a', 'b'])
+
+    def test_cycle(self):
+        """Packages an entry only reaches through a circular dependency are
+        still listed as needed by it, and the cycle is broken once merged.
+        """
+        pkgs, _ = self.resolve_many(('p', None, None), ('q', None, None))
+        self.assertEqual(pkgs['p-1.0']["packages"], ['p', 'q'])
+        self.assertEqual(pkgs['q-1.0']["packages"], ['p', 'q'])
+        self.assertEqual(pkgs['p-1.0']["deps"], [('q-1.0', ())])
+        self.assertEqual(pkgs['q-1.0']["deps"], [])
+        self.assertTrue(pkgs['q-1.0']["has_circular_deps"])
+
+    def test_separate_batches(self):
+        pkgs, _ = self.resolve_many(
+            ('a', None, None), ('c', ['six==1.0'], None))
+        self.assertEqual(self.resolved, [['a'], ['c']])
+        self.assertEqual(pkgs['six-1.0']["packages"], ['a', 'c'])
+
+    def test_conflict(self):
+        """Conflicting batches are resolved one entry at a time."""
+        pkgs, _ = self.resolve_many(('b', None, None), ('c', None, None))
+        self.assertEqual(self.resolved, [['b'], ['c']])
+        self.assertEqual(sorted(pkgs), ['b-1.0', 'c-1.0', 'django-1.0', 'six-1.0'])
+
+    def test_reuse_unchanged(self):
+        """Stored results are reused for batches whose entries and
+        overrides of resolved packages did not change.
+        """
+        results = {}
+        entries = [('a', None, None), ('b', None, None), ('c', ['x'], None)]
+        pkgs, alias = self.resolve_many(*entries, results=results)
+        self.assertEqual(len(results), 2)
+
+        reused, reused_alias = self.resolve_many(*entries, results=results)
+        self.assertEqual(self.resolved, [])
+        self.assertEqual(reused, pkgs)
+        self.assertEqual(reused_alias, alias)
+
+        self.resolve_many(('a', None, None), ('b', ['django==1.0'], None),
+                          ('c', ['x'], None), results=results)
+        self.assertEqual(self.resolved, [['a'], ['b']])
+
+    def test_changed_sibling(self):
+        """Entries resolved together are resolved again when any of them
+        changed, since they constrain each other.
+        """
+        results = {}
+        self.resolve_many(('a', None, None), ('b', None, None),
+                          results=results)
+        self.resolve_many(('a', None, None), ('c', None, None),
+                          results=results)
+        self.assertEqual(self.resolved, [['a', 'c']])
+
+    def test_reuse_conflict(self):
+        """Entries resolved one by one are reused one by one."""
+        results = {}
+        entries = [('b', None, None), ('c', None, None)]
+        pkgs, _ = self.resolve_many(*entries, results=results)
+        reused, _ = self.resolve_many(*entries, results=results)
+        self.assertEqual(self.resolved, [])
+        self.assertEqual(reused, pkgs)
+
+    def test_changed_overrides(self):
+        results = {}
+        entries = [('a', None, None), ('b', None, None)]
+        self.resolve_many(*entries, results=results)
+        self.resolve_many(
+            *entries, results=results, overrides={'six': {'src': 'six.zip'}})
+        self.assertEqual(self.resolved, [['a', 'b']])
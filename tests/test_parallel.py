@@ -0,0 +1,32 @@
+import os
+import unittest
+
+from pypi2nix.parallel import run_parallel, WorkerError
+
+
+def fail():
+    raise ValueError('broken')
+
+
+class TestRunParallel(unittest.TestCase):
+    def test_results(self):
+        pids = run_parallel(
+            dict((key, os.getpid) for key in range(4)), jobs=2)
+        self.assertEqual(sorted(pids), range(4))
+        self.assertNotIn(os.getpid(), pids.values())
+
+    def test_single_job(self):
+        """With a single job tasks run in this process."""
+        self.assertEqual(
+            run_parallel({'a': os.getpid, 'b': os.getpid}, jobs=1),
+            {'a': os.getpid(), 'b': os.getpid()})
+
+    def test_failure(self):
+        with self.assertRaises(WorkerError) as cm:
+            run_parallel({'a': os.getpid, 'b': fail}, jobs=2)
+        self.assertIn('ValueError: broken', str(cm.exception))
+
+    def test_died(self):
+        with self.assertRaises(WorkerError):
+            run_parallel({'a': lambda: os._exit(3), 'b': os.getpid},
+                         jobs=2, poll_interval=0.1)
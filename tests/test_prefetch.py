@@ -0,0 +1,45 @@
+import unittest
+
+from pypi2nix.datastructures import SpecSet
+from pypi2nix.dependency_resolver import DependencyResolver
+from pypi2nix.prefetch import Prefetcher
+from tests.unit.fixtures import SlowPackageManager, large
+
+
+class TestPrefetcher(unittest.TestCase):
+    def resolve(self, pkgmgr):
+        spec_set = SpecSet()
+        spec_set.add_spec('sentry')
+        return DependencyResolver(spec_set, pkgmgr).resolve()
+
+    def test_resolve(self):
+        """Prefetching does not change the resolved set and mostly hits"""
+        expected = map(str, self.resolve(SlowPackageManager(large)))
+
+        with Prefetcher(SlowPackageManager(large), workers=4) as prefetcher:
+            pinned = self.resolve(prefetcher)
+        self.assertEqual(map(str, pinned), expected)
+        self.assertEqual(prefetcher.stats["misses"], 1)
+        self.assertEqual(prefetcher.stats["failed"], 0)
+        self.assertGreater(prefetcher.hit_rate(), 0.9)
+
+    def test_bounded_queue(self):
+        """Dependencies found while the queue is full are not prefetched"""
+        prefetcher = Prefetcher(SlowPackageManager(large), max_queued=2)
+        pinned = self.resolve(prefetcher)
+        self.assertEqual(prefetcher.stats["scheduled"], 2)
+        self.assertGreater(prefetcher.stats["dropped"], 0)
+
+        # Without workers nothing is prefetched, and cancelling drops the
+        # scheduled packages
+        self.assertEqual(prefetcher.hit_rate(), 0)
+        prefetcher.cancel()
+        self.assertEqual(len(list(pinned)), 28)
+
+    def test_cancel(self):
+        prefetcher = Prefetcher(SlowPackageManager(large), workers=1)
+        prefetcher.start()
+        prefetcher.get_dependencies('sentry', '5.0.14')
+        prefetcher.cancel()
+        self.assertFalse(any(t.is_alive() for t in prefetcher._threads))
+        self.assertTrue(all(e.is_set() for e in prefetcher._events.values()))
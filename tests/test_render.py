@@ -0,0 +1,241 @@
+import json
+import unittest
+
+from mock import patch
+from pypi2nix.cmd import (
+    render_generated, flat_template, loader_template, sections_template)
+from pypi2nix.datastructures import Spec
+from pypi2nix.render import (
+    split_shared_packages, flat_packages, used_variants, variant_name,
+    json_data, render_model)
+
+
+def make_pkg(name, version, url=None, deps=(), extra=None):
+    fullname = '%s-%s' % (name, version)
+    return {
+        "name": name, "fullname": fullname, "version": version,
+        "src": {"url": url or "http://example.com/%s.tar.gz" % fullname,
+                "algo": "md5", "sum": "abc123"},
+        "has_tests": False, "has_circular_deps": False,
+        "deps": [(dep, ()) for dep in deps], "extra": extra or {}, "meta": {},
+        "packages": [name],
+    }
+
+
+class TestSharedPackages(unittest.TestCase):
+    def setUp(self):
+        self.resolved_pkgs = {
+            'python26': {
+                'a-1.0': make_pkg('a', '1.0', deps=['b-1.0']),
+                'b-1.0': make_pkg('b', '1.0', url='http://mirror/b.tar.gz'),
+            },
+            'python27': {
+                'a-1.0': make_pkg('a', '1.0', deps=['b-1.0']),
+                'b-1.0': make_pkg('b', '1.0'),
+                'c-1.0': make_pkg('c', '1.0'),
+            },
+            'pypy': {
+                'a-1.0': make_pkg('a', '1.0', deps=['b-1.0']),
+                'b-1.0': make_pkg('b', '1.0', url='http://mirror/b.tar.gz'),
+            },
+        }
+
+    def test_split(self):
+        shared, env_pkgs = split_shared_packages(self.resolved_pkgs)
+        self.assertEqual(
+            [(envs, [(pkg["fullname"], pkg["src"]["url"]) for pkg in pkgs])
+             for envs, pkgs in shared],
+            [(('pypy', 'python26'), [('b-1.0', 'http://mirror/b.tar.gz')]),
+             (('pypy', 'python26', 'python27'),
+              [('a-1.0', 'http://example.com/a-1.0.tar.gz')])])
+        self.assertEqual(env_pkgs['pypy'], [])
+        self.assertEqual(env_pkgs['python26'], [])
+        self.assertEqual(
+            [(pkg["fullname"], pkg["src"]["url"])
+             for pkg in env_pkgs['python27']],
+            [('b-1.0', 'http://example.com/b-1.0.tar.gz'),
+             ('c-1.0', 'http://example.com/c-1.0.tar.gz')])
+
+    def test_render_once(self):
+        alias = dict(
+            (env, {'a': (Spec.from_pinned('a', '1.0'), None)})
+            for env in self.resolved_pkgs)
+        result = u''.join(render_generated(self.resolved_pkgs, alias, ()))
+        self.assertEqual(result.count('"a-1.0" = callPythonPackage'), 1)
+        self.assertEqual(result.count('"b-1.0" = callPythonPackage'), 2)
+        self.assertNotIn('pythonName == "pypy") {\n  })', result)
+
+        # Shared packages are only defined for the environments sharing them
+        self.assertLess(
+            result.index('(elem pythonName [ "pypy" "python26" ])'),
+            result.index('http://mirror/b.tar.gz'))
+        self.assertLess(
+            result.index('http://mirror/b.tar.gz'),
+            result.index('(elem pythonName [ "pypy" "python26" "python27" ])'))
+
+
+class TestRenderModel(unittest.TestCase):
+    def setUp(self):
+        self.resolved_pkgs = {
+            'python26': {
+                'a-1.0': make_pkg('a', '1.0', deps=['b-1.0'], extra={
+                    'test': [('c-1.0', ())], 'docs': [('c-1.0', ('x',))]}),
+                'b-1.0': make_pkg(
+                    'b', '1.0', url='http://mirror/b.tar.gz#md5=1'),
+                'c-1.0': make_pkg('c', '1.0'),
+            },
+            'python27': {
+                'a-1.0': make_pkg('a', '1.0', deps=['b-1.0'], extra={
+                    'test': [('c-1.0', ())], 'docs': [('c-1.0', ('x',))]}),
+                'b-1.0': make_pkg('b', '1.0'),
+                'c-1.0': make_pkg('c', '1.0'),
+            },
+        }
+        self.resolved_alias = dict(
+            (env, {'a': (Spec.from_pinned('a', '1.0', extra=('x', '_y')),
+                         None)})
+            for env in self.resolved_pkgs)
+
+    def test_model(self):
+        model = render_model(
+            self.resolved_pkgs, self.resolved_alias, ('test',))
+        alias_env, (alias,) = model.aliases[0]
+        self.assertEqual(alias_env, 'python26')
+        self.assertEqual(alias.extras, '"x" ')
+        self.assertEqual(alias.source, 'default')
+
+        (envs, (a, c)), = model.shared
+        self.assertEqual(envs, ('python26', 'python27'))
+        self.assertEqual(a.build_inputs, '(self.by-version."c-1.0" []) ')
+        self.assertEqual(a.install_requires, '(self.by-version."b-1.0" []) ')
+        self.assertEqual(
+            a.extra, (('docs', '(self.by-version."c-1.0" ["x"]) '),))
+        self.assertEqual(
+            [(env, [pkg.url for pkg in pkgs]) for env, pkgs in model.packages],
+            [('python26', ['http://mirror/b.tar.gz']),
+             ('python27', ['http://example.com/b-1.0.tar.gz'])])
+
+    def test_render_parallel(self):
+        """Sections rendered by several workers are concatenated to the
+        same output.
+        """
+        render = lambda jobs: u''.join(render_generated(
+            self.resolved_pkgs, self.resolved_alias, ('test',), jobs))
+        self.assertEqual(render(3), render(1))
+        self.assertIn('docs = [(self.by-version."c-1.0" ["x"]) ];', render(1))
+
+    def test_render_serial_streams(self):
+        """With one job, packages are only rendered as the stream is
+        consumed, one at a time.
+        """
+        sections = sections_template.module
+        with patch.object(
+            sections, 'packages', wraps=sections.packages
+        ) as packages:
+            stream = render_generated(
+                self.resolved_pkgs, self.resolved_alias, ('test',))
+            self.assertFalse(packages.called)
+            u''.join(stream)
+        self.assertEqual(
+            [len(pkgs) for (pkgs,), _ in packages.call_args_list], [1] * 4)
+
+
+class TestFlatPackages(unittest.TestCase):
+    def setUp(self):
+        self.resolved_pkgs = {'python27': {
+            'a-1.0': make_pkg('a', '1.0'),
+            'b-1.0': make_pkg('b', '1.0', extra={
+                'x': [('c-1.0', ())], 'test': [('c-1.0', ())]}),
+            'c-1.0': make_pkg('c', '1.0'),
+        }}
+        self.resolved_pkgs['python27']['a-1.0']["deps"] = [('b-1.0', ('x',))]
+        self.resolved_alias = {'python27': {
+            'a': (Spec.from_pinned('a', '1.0', extra=('y', '_tests')), None)}}
+
+    def test_variant_name(self):
+        self.assertEqual(variant_name('a-1.0', ()), 'a-1.0')
+        self.assertEqual(variant_name('a-1.0', ('x', 'y')), 'a-1.0-x_y')
+
+    def test_used_variants(self):
+        variants = used_variants(self.resolved_pkgs, self.resolved_alias)
+        self.assertEqual(variants['a-1.0'], set([(), ('y',)]))
+        self.assertEqual(variants['b-1.0'], set([(), ('x',)]))
+        self.assertEqual(variants['c-1.0'], set([()]))
+
+    def test_flat_packages(self):
+        shared, env_pkgs = flat_packages(
+            self.resolved_pkgs, self.resolved_alias, ('test',))
+        self.assertEqual(shared, [])
+        a, b, c = env_pkgs['python27']
+        self.assertEqual(a["install_requires"], ['b-1.0-x'])
+        self.assertEqual(b["build_inputs"], ['c-1.0'])
+        self.assertEqual(
+            [(v["name"], v["propagated"]) for v in b["variants"]],
+            [('b-1.0', []), ('b-1.0-x', ['c-1.0'])])
+
+    def test_render(self):
+        shared, env_pkgs = flat_packages(
+            self.resolved_pkgs, self.resolved_alias, ('test',))
+        result = flat_template.render(
+            resolved_alias=self.resolved_alias,
+            shared_pkgs=shared, env_pkgs=env_pkgs)
+        self.assertIn('"a" = self.by-version."a-1.0-y";', result)
+        self.assertIn('(overrides."b" or overrides."b-1.0-x" or {});', result)
+        self.assertNotIn('callPythonPackage', result)
+        self.assertNotIn('attrByPathAlternatives', result)
+
+    def test_override_order(self):
+        """Overrides are looked up by basename first and by variant name
+        second, in the flat mode like in the default one.
+        """
+        default = u''.join(render_generated(
+            self.resolved_pkgs, self.resolved_alias, ('test',)))
+        self.assertIn(
+            'attrByPathAlternatives ([[pkg.basename] [pkg.name]])', default)
+        self.assertIn('basename = "a";', default)
+        self.assertIn('name = "a-1.0";', default)
+
+        shared, env_pkgs = flat_packages(
+            self.resolved_pkgs, self.resolved_alias, ('test',))
+        flat = flat_template.render(
+            resolved_alias=self.resolved_alias,
+            shared_pkgs=shared, env_pkgs=env_pkgs)
+        self.assertIn('basename = "a";', flat)
+        self.assertIn('(overrides."a" or overrides."a-1.0" or {});', flat)
+
+
+class TestJsonData(unittest.TestCase):
+    def setUp(self):
+        self.resolved_pkgs = {
+            'python26': {'a-1.0': make_pkg('a', '1.0', deps=['b-1.0']),
+                         'b-1.0': make_pkg('b', '1.0')},
+            'python27': {'a-1.0': make_pkg('a', '1.0', deps=['b-1.0']),
+                         'b-1.0': make_pkg('b', '2.0')},
+        }
+        self.resolved_alias = dict(
+            (env, {'a': (Spec.from_pinned('a', '1.0', extra=('x',)),
+                         'tests')})
+            for env in self.resolved_pkgs)
+
+    def test_json_data(self):
+        data = json_data(self.resolved_pkgs, self.resolved_alias, ())
+        self.assertEqual(
+            [(group["envs"], [pkg["name"] for pkg in group["packages"]])
+             for group in data["shared"]],
+            [(['python26', 'python27'], ['a'])])
+        self.assertEqual(
+            [v["name"] for v in data["shared"][0]["packages"][0]["variants"]],
+            ['a-1.0', 'a-1.0-x'])
+        python27 = data["envs"]["python27"]
+        self.assertEqual(python27["aliases"], {'a': 'a-1.0-x'})
+        self.assertEqual(python27["by_extra"], {'tests': {'a': 'a-1.0-x'}})
+        self.assertEqual(
+            [pkg["version"] for pkg in python27["packages"]], ['2.0'])
+
+        # Round trips through json unchanged
+        self.assertEqual(json.loads(json.dumps(data)), data)
+
+    def test_loader(self):
+        result = loader_template.render(data_file='python-packages.json')
+        self.assertIn(
+            'builtins.readFile (./. + "/python-packages.json")', result)
@@ -0,0 +1,146 @@
+import sys
+import unittest
+
+from mock import Mock, patch
+from pip.index import Link
+from pypi2nix import requirements, markers
+from pypi2nix.package_manager import PackageManager
+from pypi2nix.requirements import (
+    parse_requires_file, evaluate_marker, select_deps,
+    branches_on_interpreter, get_marker_environment)
+
+PY27 = {'python_version': '2.7', 'sys_platform': 'linux2',
+        'platform_python_implementation': 'CPython'}
+PY33 = dict(PY27, python_version='3.3')
+
+REQUIRES = """\
+six
+foo>=1.0
+
+[:python_version < "3"]
+futures
+
+[test]
+nose
+
+[test:python_version >= "3"]
+mock; sys_platform == "linux2"
+"""
+
+
+class TestRequirements(unittest.TestCase):
+    def test_parse_requires_file(self):
+        self.assertEqual(parse_requires_file(REQUIRES.splitlines()), [
+            ('six', None, None),
+            ('foo>=1.0', None, None),
+            ('futures', None, 'python_version < "3"'),
+            ('nose', 'test', None),
+            ('mock', 'test',
+             '(python_version >= "3") and (sys_platform == "linux2")'),
+        ])
+
+    def test_evaluate_marker(self):
+        self.assertTrue(evaluate_marker(None, PY27))
+        self.assertTrue(evaluate_marker('python_version < "3"', PY27))
+        self.assertFalse(evaluate_marker('python_version < "3"', PY33))
+        self.assertTrue(evaluate_marker('extra == "test"', PY27, 'test'))
+        self.assertTrue(evaluate_marker('not a marker', PY27))
+
+    def test_fallback_markers(self):
+        """Markers evaluate like with packaging without it."""
+        environment = dict(PY27, os_name='posix', extra='test')
+        for marker in [
+                'python_version < "3"', 'python_version >= "2.6"',
+                '"2.7" == python_version', 'python_version ~= "2.6"',
+                'python_version in "2.6 2.7"', 'sys_platform not in "win32"',
+                'python_version < "3" and sys_platform == "win32"',
+                '(python_version < "3" or extra == "x") and os.name == "posix"',
+                'python_implementation != "PyPy"', "extra == 'test'"]:
+            self.assertEqual(
+                markers.Marker(marker).evaluate(environment),
+                requirements.Marker(marker).evaluate(environment), marker)
+
+        for marker in ['not a marker', 'python_version <', '(os_name == "x"',
+                       'foo == "1"']:
+            with self.assertRaises(markers.InvalidMarker):
+                markers.Marker(marker)
+
+    def test_select_deps(self):
+        requires = parse_requires_file(REQUIRES.splitlines())
+        setup_args = Mock(return_value={})
+
+        deps = select_deps(requires, setup_args, ('test',), PY27)
+        self.assertEqual(
+            [(str(dep), src) for dep, src in deps],
+            [('six', None), ('foo>=1.0', None), ('futures', None),
+             ('nose', 'test')])
+
+        deps = select_deps(requires, setup_args, ('test',), PY33)
+        self.assertEqual(
+            [(str(dep), src) for dep, src in deps],
+            [('six', None), ('foo>=1.0', None), ('nose', 'test'),
+             ('mock', 'test')])
+        self.assertFalse(setup_args.called)
+
+    def test_select_deps_setup_args(self):
+        setup_args = Mock(return_value={
+            "install_requires": ['six', 'enum34; python_version < "3.4"'],
+            "tests_require": ['nose'],
+        })
+        deps = select_deps([], setup_args, ('_tests_require',), PY33)
+        self.assertEqual(
+            [(str(dep), src) for dep, src in deps],
+            [('six', None), ('enum34', None), ('nose', '_tests_require')])
+
+    def test_branches_on_interpreter(self):
+        self.assertTrue(branches_on_interpreter(
+            "if sys.version_info < (3,):\n    requires.append('futures')"))
+        self.assertTrue(branches_on_interpreter("if six.PY3: pass"))
+        self.assertFalse(branches_on_interpreter(
+            "setup(name='foo', install_requires=['six'])"))
+
+    def test_marker_environment(self):
+        environment = get_marker_environment(sys.executable)
+        self.assertEqual(
+            environment['python_version'], '%d.%d' % sys.version_info[:2])
+        self.assertIs(get_marker_environment(sys.executable), environment)
+
+
+class TestSharedRequirements(unittest.TestCase):
+    def package_manager(self, cache, exe):
+        pkgmgr = PackageManager(cache=cache, exe=exe)
+        pkgmgr.get_link = Mock(return_value=(
+            Link("http://foo.com/abc-1.0.tar.gz#md5=abc123"), "1.0"))
+        pkgmgr.get_package = Mock()
+        pkgmgr.get_package.return_value.get_requirements.return_value = {
+            "requires": parse_requires_file(REQUIRES.splitlines()),
+            "setup_args": {}, "links": [],
+            "interpreter_specific": self.interpreter_specific}
+        return pkgmgr
+
+    def get_dependencies(self):
+        cache = {"requirements_cache": {}, "link_cache": {},
+                 "dep_cache": {}, "pkg_info_cache": {}, "extract_cache": {},
+                 "version_cache": {}}
+        results = []
+        with patch.dict(requirements._MARKER_ENVIRONMENTS,
+                        {'python2.7': PY27, 'python3.3': PY33}):
+            for exe in ['python2.7', 'python3.3']:
+                pkgmgr = self.package_manager(dict(cache, dep_cache={}), exe)
+                deps = pkgmgr.get_dependencies('abc', '1.0')
+                results.append(
+                    (pkgmgr.get_package.called, [str(dep) for dep, _ in deps]))
+        return results
+
+    def test_shared(self):
+        """Requirements are introspected once and evaluated per env"""
+        self.interpreter_specific = False
+        self.assertEqual(self.get_dependencies(), [
+            (True, ['six', 'foo>=1.0', 'futures']),
+            (False, ['six', 'foo>=1.0']),
+        ])
+
+    def test_interpreter_specific(self):
+        self.interpreter_specific = True
+        self.assertEqual(
+            [called for called, _ in self.get_dependencies()], [True, True])
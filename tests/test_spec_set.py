@@ -27,6 +27,34 @@ class TestSpecSet(unittest.TestCase):
         specset.add_spec('django<1.4')
         self.assertItemsEqual(['django>=1.3', 'django-pipeline', 'django<1.4'], map(str, specset))
 
+    def test_iteration_order(self):
+        """Specs are iterated ordered by name and spec."""
+        specset = SpecSet()
+
+        for line in ['six', 'django<1.4', 'Babel', 'django>=1.3', 'django']:
+            specset.add_spec(line)
+
+        self.assertEqual(
+            ['babel', 'django', 'django<1.4', 'django>=1.3', 'six'],
+            map(str, specset))
+        self.assertEqual(len(specset), 5)
+        self.assertEqual(['babel', 'django', 'six'], specset.names())
+
+    def test_lookup_by_name(self):
+        specset = SpecSet()
+        for line in ['six==1.4', 'django<1.4', 'django>=1.3']:
+            specset.add_spec(line)
+
+        self.assertEqual(str(specset.get('six')), 'six==1.4')
+        self.assertEqual(str(specset.get('Six')), 'six==1.4')
+        self.assertEqual(str(specset.get('django')), 'django<1.4')
+        self.assertEqual(specset.get('babel'), None)
+        self.assertEqual(
+            ['django<1.4', 'django>=1.3'],
+            map(str, specset.specs_for_name('django')))
+        self.assertEqual([], specset.specs_for_name('babel'))
+        self.assertEqual(['django', 'six'], specset.names())
+
     def test_explode(self):
         """Exploding a spec list into specs of max one predicate."""
         specset = SpecSet()
@@ -114,6 +142,37 @@ class TestSpecSet(unittest.TestCase):
         with self.assertRaises(ConflictError):
             specset.normalize()
 
+    def test_normalizing_compares_versions(self):
+        """Normalizing compares versions, not strings."""
+        specset = SpecSet()
+        specset.add_spec('django>=1.9')
+        specset.add_spec('django>=1.10')
+        specset.add_spec('django<1.100')
+        specset.add_spec('django<1.20')
+
+        normalized = specset.normalize()
+        assert 'django>=1.10,<1.20' in map(str, normalized)
+
+    def test_normalizing_drops_notequal_outside_range(self):
+        """Not-equal ops outside of the allowed range are dropped."""
+        specset = SpecSet()
+        specset.add_spec('django>1.4,<1.6')
+        specset.add_spec('django!=1.4')
+        specset.add_spec('django!=1.5')
+        specset.add_spec('django!=1.6')
+
+        normalized = specset.normalize()
+        assert 'django>1.4,<1.6,!=1.5' in map(str, normalized)
+
+    def test_normalizing_date_versions(self):
+        """Versions that are dates or otherwise irrational are supported."""
+        specset = SpecSet()
+        specset.add_spec('pytz>=2011k')
+        specset.add_spec('pytz<2013.01')
+
+        normalized = specset.normalize()
+        assert 'pytz>=2011k,<2013.01' in map(str, normalized)
+
     def test_normalizing_conflicts(self):
         """Normalizing can lead to conflicts."""
         specset = SpecSet()
@@ -123,6 +182,23 @@ class TestSpecSet(unittest.TestCase):
         with self.assertRaises(ConflictError):
             specset.normalize()
 
+    def test_normalizing_is_cached(self):
+        """Normalized specs are cached per name until that name changes."""
+        specset = SpecSet()
+        specset.add_spec('django>=1.3')
+        specset.add_spec('six')
+
+        django = specset.normalize_name('django')
+        six = specset.normalize_name('six')
+        self.assertIs(specset.normalize_name('django'), django)
+
+        specset.add_spec('django>=1.3')
+        self.assertIs(specset.normalize_name('django'), django)
+
+        specset.add_spec('django<1.4')
+        self.assertEqual(str(specset.normalize_name('django')), 'django>=1.3,<1.4')
+        self.assertIs(specset.normalize_name('six'), six)
+
     def test_normalizing_keeps_source_info(self):
         """Normalizing keeps source information for specs."""
         specset = SpecSet()
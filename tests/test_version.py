@@ -0,0 +1,63 @@
+import unittest
+
+from pypi2nix import version
+from pypi2nix.version import version_key, NormalizedVersion, VersionIndex
+
+
+class TestVersionKey(unittest.TestCase):
+    def test_rational(self):
+        """Rational versions are keyed by their parts."""
+        for v in ['1.0', '1.2.3a2', '1.0.post256.dev345']:
+            self.assertEqual(version_key(v), NormalizedVersion(v).parts)
+
+    def test_ordering(self):
+        versions = ['1.0b1', '1.0.dev1', '1.0', '1.0.post1', '1.10', '2011k',
+                    '2011l', '2013.01']
+        self.assertEqual(sorted(reversed(versions), key=version_key), versions)
+
+    def test_interned(self):
+        """Keys are cached, but the cache stays bounded."""
+        self.assertIs(version_key('1.2.3'), version_key('1.2.3'))
+
+        old_size = version._VERSION_KEYS_MAX_SIZE
+        version._VERSION_KEYS_MAX_SIZE = 10
+        try:
+            for i in range(100):
+                version_key('1.%d' % i)
+            self.assertTrue(len(version._VERSION_KEYS) <= 10)
+        finally:
+            version._VERSION_KEYS_MAX_SIZE = old_size
+
+
+class TestVersionIndex(unittest.TestCase):
+    def setUp(self):
+        self.index = VersionIndex(
+            ['1.0', '1.1', '1.2b1', '1.2', '1.3', '2.0a1', '1.10', '1.1'])
+
+    def test_sorted(self):
+        self.assertEqual(
+            list(self.index),
+            ['1.0', '1.1', '1.2b1', '1.2', '1.3', '1.10', '2.0a1'])
+
+    def test_best_match(self):
+        best_match = self.index.best_match
+        self.assertEqual(best_match([]), '1.10')
+        self.assertEqual(best_match([('<', '1.3')]), '1.2')
+        self.assertEqual(best_match([('<=', '1.3')]), '1.3')
+        self.assertEqual(best_match([('>', '1.3'), ('<', '1.10')]), None)
+        self.assertEqual(best_match([('==', '1.1')]), '1.1')
+        self.assertEqual(best_match([('==', '1.4')]), None)
+        self.assertEqual(
+            best_match([('<', '1.10'), ('!=', '1.3'), ('!=', '1.2')]), '1.1')
+
+    def test_prereleases(self):
+        """Final releases are preferred over pre-releases."""
+        best_match = self.index.best_match
+        self.assertEqual(best_match([], prereleases=True), '2.0a1')
+        self.assertEqual(best_match([('>', '1.10')]), '2.0a1')
+        self.assertEqual(best_match([('==', '1.2b1')]), '1.2b1')
+
+    def test_matches(self):
+        self.assertEqual(
+            self.index.matches([('>=', '1.2'), ('<=', '1.10'), ('!=', '1.3')]),
+            ['1.2', '1.10'])
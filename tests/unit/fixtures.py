@@ -1,3 +1,14 @@
+import copy
+import random
+import threading
+import time
+
+from pkg_resources import Requirement
+
+from pypi2nix.datastructures import Spec, ops
+from pypi2nix.version import version_key
+
+
 simple = {
     'foo-0.1': ['bar'],
     'bar-1.2': ['qux', 'simplejson'],
@@ -80,3 +91,131 @@ large = {
         ],
     'django-social-auth-trello-1.0.2': [],
 }
+
+
+def scale(graph, factor):
+    """Returns `factor` independent copies of the given fixture graph, with
+    every package name suffixed by the number of its copy.
+    """
+    def rename(name, index):
+        return '%s-x%d' % (name, index)
+
+    scaled = {}
+    for index in range(factor):
+        for fullname, deps in graph.items():
+            name, version = fullname.rsplit('-', 1)
+            new_deps = []
+            for dep in deps:
+                req = Requirement.parse(dep)
+                new_deps.append(rename(req.project_name, index) +
+                                ','.join(map(''.join, req.specs)))
+            scaled['%s-%s' % (rename(name, index), version)] = new_deps
+    return scaled
+
+
+def resolved_packages(count, envs=('python27',), seed=0):
+    """Returns resolved packages and aliases, like `PackageResolver` returns
+    them for every environment, of `count` random packages.  Some packages
+    have extras, and most are resolved identically for all environments.
+    """
+    rnd = random.Random(seed)
+    names = ['pkg%d' % i for i in range(count)]
+
+    def dep():
+        name = rnd.choice(names)
+        extras = ('extra',) if rnd.random() < 0.1 else ()
+        return ('%s-1.0' % name, extras)
+
+    base = {}
+    for name in names:
+        fullname = '%s-1.0' % name
+        base[fullname] = {
+            "name": name, "fullname": fullname, "version": "1.0",
+            "src": {"url": 'https://pypi.python.org/packages/source/p/'
+                           '%s/%s.tar.gz' % (name, fullname),
+                    "algo": "md5", "sum": '%032x' % rnd.getrandbits(128)},
+            "has_tests": rnd.random() < 0.3,
+            "has_circular_deps": False,
+            "deps": [dep() for _ in range(rnd.randint(0, 4))],
+            "extra": {"extra": [dep()]} if rnd.random() < 0.2 else {},
+            "meta": {}, "packages": [name],
+        }
+
+    resolved_pkgs, resolved_alias = {}, {}
+    for env in envs:
+        pkgs = copy.deepcopy(base)
+        if env != envs[0]:
+            # Some packages are resolved to other archives
+            for pkg in rnd.sample(pkgs.values(), count // 20):
+                pkg["src"]["url"] = pkg["src"]["url"].replace('.tar.gz', '.zip')
+        resolved_pkgs[env] = pkgs
+        resolved_alias[env] = dict(
+            (name, (Spec.from_pinned(name, '1.0'), None))
+            for name in names[:count // 10])
+    return resolved_pkgs, resolved_alias
+
+
+class FakePackageManager(object):
+    """Package manager serving packages from a fixture graph, which maps
+    package fullnames to lists of dependency speclines.
+    """
+
+    def __init__(self, graph):
+        self._versions = {}
+        self._deps = {}
+        for fullname, deps in graph.items():
+            name, version = fullname.rsplit('-', 1)
+            name = name.lower()
+            self._versions.setdefault(name, []).append(version)
+            self._deps[(name, version)] = [
+                (Spec.from_line(dep), None) for dep in deps]
+
+        self.find_best_match_calls = 0
+        self.get_dependencies_calls = 0
+
+    def find_best_match(self, spec):
+        self.find_best_match_calls += 1
+        candidates = [
+            version for version in self._versions.get(spec.name, [])
+            if all(ops[qual](version, value) for qual, value in spec.preds)]
+        if not candidates:
+            raise Exception('No package found for %s' % spec)
+        return max(candidates, key=version_key)
+
+    def get_dependencies(self, name, version, extra=()):
+        self.get_dependencies_calls += 1
+        return self._deps[(name, version)]
+
+
+class SlowPackageManager(FakePackageManager):
+    """Fake package manager with latency: fetching a package from the index
+    takes `fetch_latency` seconds, and introspecting it `introspect_latency`
+    seconds.  Fetched packages can be prefetched.
+    """
+
+    def __init__(self, graph, fetch_latency=0.01, introspect_latency=0.01):
+        super(SlowPackageManager, self).__init__(graph)
+        self.fetch_latency = fetch_latency
+        self.introspect_latency = introspect_latency
+        self._fetched = set()
+        self._lock = threading.Lock()
+
+    def _fetch(self, name):
+        with self._lock:
+            if name in self._fetched:
+                return
+        time.sleep(self.fetch_latency)
+        with self._lock:
+            self._fetched.add(name)
+
+    def find_best_match(self, spec):
+        self._fetch(spec.name)
+        return super(SlowPackageManager, self).find_best_match(spec)
+
+    def get_dependencies(self, name, version, extra=()):
+        time.sleep(self.introspect_latency)
+        return super(SlowPackageManager, self).get_dependencies(
+            name, version, extra)
+
+    def prefetch(self, spec):
+        self.find_best_match(spec)
@@ -1,5 +1,6 @@
+import pickle
 import unittest
-from piptools.datastructures import Spec
+from pypi2nix.datastructures import Spec
 
 
 class TestSpec(unittest.TestCase):
@@ -18,3 +19,49 @@ class TestSpec(unittest.TestCase):
 
         assert Spec.from_line('foo>1.2,==1.2.1').is_pinned
         assert Spec.from_line('foo==1.2.1,==1.2.2').is_pinned  # useless, but pinned ;)
+
+    def test_canonical(self):
+        """Predicate order does not matter."""
+        spec1 = Spec.from_line('foo<2.0,>=1.10,!=1.5')
+        spec2 = Spec.from_line('foo!=1.5,>=1.10,<2.0')
+
+        self.assertEqual(spec1, spec2)
+        self.assertEqual(hash(spec1), hash(spec2))
+        self.assertEqual(str(spec1), 'foo>=1.10,<2.0,!=1.5')
+        self.assertEqual(spec1.preds, spec2.preds)
+
+    def test_immutable(self):
+        spec = Spec.from_line('foo>1.2')
+        with self.assertRaises(AttributeError):
+            spec.name = 'bar'
+        with self.assertRaises(AttributeError):
+            spec.pinned = '1.3'
+
+        pinned = spec.pin('1.3')
+        self.assertEqual(str(pinned), 'foo==1.3')
+        self.assertEqual(str(spec), 'foo>1.2')
+
+    def test_pinned(self):
+        self.assertEqual(Spec.from_line('foo>1.2,==1.2.1').pinned, '1.2.1')
+
+    def test_matches(self):
+        spec = Spec.from_line('foo>1.2,<2.0,!=1.5')
+        self.assertTrue(spec.matches('1.3'))
+        self.assertFalse(spec.matches('1.5'))
+        self.assertFalse(spec.matches('2.0'))
+        self.assertTrue(Spec.from_line('foo').matches('0.1'))
+
+    def test_pickle(self):
+        spec = Spec.from_line('foo[bar]>1.2', source='baz')
+        for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+            loaded = pickle.loads(pickle.dumps(spec, protocol))
+            self.assertEqual(loaded, spec)
+            self.assertEqual(loaded.source, 'baz')
+
+    def test_unpickle_legacy(self):
+        """Specs pickled with an instance dict can still be loaded."""
+        spec = Spec.__new__(Spec)
+        spec.__setstate__({
+            '_name': 'foo', '_preds': [('>', '1.2')],
+            '_source': None, '_extra': ()})
+        self.assertEqual(spec, Spec.from_line('foo>1.2'))